@@ -2,8 +2,6 @@ from rest_framework import generics, status, permissions
 from rest_framework.response import Response
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.tokens import RefreshToken
-from google.oauth2 import id_token as google_id_token
-from google.auth.transport import requests
 from django.conf import settings
 
 from .serializers import RegisterSerializer, GoogleAuthSerializer
@@ -45,6 +43,9 @@ class GoogleLoginView(generics.GenericAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         id_token = serializer.validated_data['id_token']
+        # google-auth is slow to import and only this view needs it
+        from google.auth.transport import requests
+        from google.oauth2 import id_token as google_id_token
         try:
             idinfo = google_id_token.verify_oauth2_token(id_token, requests.Request(), None)
             email = idinfo.get('email')
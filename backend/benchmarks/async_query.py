@@ -0,0 +1,152 @@
+"""Concurrent query throughput: sync workers vs. the async ASGI view.
+
+A stub LLM that waits ``--llm-latency`` seconds stands in for Gemini and a
+hash-seeded stub replaces the embedding model, so only the serving model is
+measured.  ``sync_workers`` pushes the requests through the DRF ``query``
+action on ``--workers`` threads, like gunicorn's sync workers; ``asgi`` sends
+them all at once to the ASGI application in a single process::
+
+    python -m benchmarks.async_query [--requests 60] [--llm-latency 0.5]
+"""
+import asyncio
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.common import emit, make_parser, setup_django, temporary_database
+
+
+class StubEmbeddings:
+    def __init__(self, dim):
+        self.dim = dim
+
+    def embed_query(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:4], 'little')
+        return np.random.default_rng(seed).standard_normal(self.dim).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+class StubLLM:
+    """Network-bound LLM: blocks in ``invoke``, yields in ``ainvoke``."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def invoke(self, prompt):
+        time.sleep(self.latency)
+        return 'stub answer'
+
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(self.latency)
+        return 'stub answer'
+
+
+def _summarize(name, latencies, statuses, wall):
+    latencies = np.array(latencies) * 1000
+    return {
+        'mode': name,
+        'requests': len(latencies),
+        'ok': sum(1 for code in statuses if code == 200),
+        'wall_s': wall,
+        'throughput_rps': len(latencies) / wall,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--requests', type=int, default=60)
+    parser.add_argument('--workers', type=int, default=3, help='Sync worker count to compare against')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Seconds per stub LLM call')
+    parser.add_argument('--chunks', type=int, default=200)
+    parser.add_argument('--dim', type=int, default=384)
+    args = parser.parse_args()
+
+    # Route queries to the async views, as smartdocs/asgi.py does.
+    os.environ['SMARTDOCS_ASGI'] = 'True'
+    setup_django()
+    import httpx
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.core.asgi import get_asgi_application
+    from django.test import RequestFactory
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    from documents import model_registry
+    from documents.models import Document, DocumentChunk
+    from documents.throttling import QueryRateThrottle
+    from documents.views import DocumentViewSet
+
+    settings.ALLOWED_HOSTS = ['*']
+    settings.SEMANTIC_CACHE_ENABLED = False
+    settings.ASYNC_QUERY_CONCURRENCY = max(settings.ASYNC_QUERY_CONCURRENCY, args.requests)
+    # The benchmark user would otherwise hit the per-minute query limit.
+    QueryRateThrottle.rate = '1000000/minute'
+    embeddings = StubEmbeddings(args.dim)
+    llm = StubLLM(args.llm_latency)
+    model_registry.register(model_registry.EMBEDDINGS, lambda: embeddings)
+    model_registry.register(model_registry.HF_LLM, lambda: llm)
+    model_registry.register(model_registry.GEMINI_LLM, lambda: llm)
+
+    with temporary_database():
+        user = User.objects.create_user('bench', password='bench')
+        document = Document.objects.create(
+            title='doc.pdf', file='documents/doc.pdf', file_type='PDF', uploaded_by=user,
+        )
+        DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=document, content=f'chunk {i} text', chunk_index=i,
+                          embedding=embeddings.embed_query(f'chunk {i} text'))
+            for i in range(args.chunks)
+        ])
+        auth = f'Bearer {RefreshToken.for_user(user).access_token}'
+        url = f'/api/documents/{document.id}/query/'
+        rows = []
+
+        # Each question is unique so the answer cache never short-circuits.
+        sync_view = DocumentViewSet.as_view({'post': 'query'})
+        factory = RequestFactory()
+
+        def sync_request(i):
+            request = factory.post(url, {'query': f'sync question {i}'},
+                                   content_type='application/json', HTTP_AUTHORIZATION=auth)
+            started = time.perf_counter()
+            response = sync_view(request, pk=document.id)
+            return time.perf_counter() - started, response.status_code
+
+        sync_request(-1)  # warm up
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(sync_request, range(args.requests)))
+        rows.append(_summarize(f'sync_workers({args.workers})', [r[0] for r in results],
+                               [r[1] for r in results], time.perf_counter() - started))
+
+        application = get_asgi_application()
+
+        async def run_async():
+            transport = httpx.ASGITransport(app=application)
+            async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+                async def one(i):
+                    started = time.perf_counter()
+                    response = await client.post(url, json={'query': f'async question {i}'},
+                                                 headers={'Authorization': auth}, timeout=None)
+                    return time.perf_counter() - started, response.status_code
+
+                await one(-1)  # warm up
+                started = time.perf_counter()
+                results = await asyncio.gather(*(one(i) for i in range(args.requests)))
+                return results, time.perf_counter() - started
+
+        results, wall = asyncio.run(run_async())
+        rows.append(_summarize('asgi', [r[0] for r in results], [r[1] for r in results], wall))
+
+    emit('async_query', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
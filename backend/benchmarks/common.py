@@ -0,0 +1,108 @@
+"""Shared helpers for the benchmark scripts.
+
+Run benchmarks from the ``backend`` directory, e.g.::
+
+    python -m benchmarks.embedding_batch --json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+
+def setup_django() -> None:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartdocs.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def temporary_database():
+    """Create a throwaway, migrated copy of the configured database.
+
+    SQLite gets an on-disk file (not ``:memory:``) so commits pay real fsyncs;
+    other backends use Django's usual ``test_<name>`` database.
+    """
+    from django.conf import settings
+    from django.db import connection
+
+    if connection.vendor == 'sqlite':
+        tmpdir = tempfile.mkdtemp(prefix='smartdocs-bench-')
+        settings.DATABASES['default'].setdefault('TEST', {})['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def make_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--json', action='store_true', help='Print machine-readable JSON')
+    return parser
+
+
+def emit(name: str, rows: List[Dict[str, Any]], as_json: bool = False) -> None:
+    """Print benchmark ``rows`` as a table, or as JSON with ``--json``."""
+    if as_json:
+        print(json.dumps({'benchmark': name, 'results': rows}, indent=2))
+        return
+
+    print(name)
+    if not rows:
+        return
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    widths = {c: max(len(c), *(len(_fmt(r.get(c))) for r in rows)) for c in columns}
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print('  '.join(_fmt(row.get(c)).ljust(widths[c]) for c in columns))
+
+
+def _fmt(value: Any) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return f'{value:.4g}'
+    return str(value)
+
+
+def write_text_pdf(path: str, pages: List[List[str]]) -> None:
+    """Write a minimal PDF with one page per entry of ``pages`` (lines of text).
+
+    Only plain ASCII Helvetica text is supported; that is all the extraction
+    benchmarks need and avoids a PDF-writing dependency.
+    """
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # page tree, filled in once the page object numbers are known
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    page_numbers = []
+    for lines in pages:
+        escaped = (line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') for line in lines)
+        content = 'BT /F1 10 Tf 12 TL 40 800 Td ' + ' '.join(f'({line}) Tj T*' for line in escaped) + ' ET'
+        content = content.encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content))
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % len(objects)
+        )
+        page_numbers.append(len(objects))
+    kids = b' '.join(b'%d 0 R' % number for number in page_numbers)
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_numbers))
+
+    with open(path, 'wb') as out:
+        out.write(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(out.tell())
+            out.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+        xref = out.tell()
+        out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+        for offset in offsets:
+            out.write(b'%010d 00000 n \n' % offset)
+        out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
@@ -0,0 +1,101 @@
+"""Payload size, latency and SQL query count of ``GET /api/documents/``.
+
+Compares the old nested representation (every chunk and embedding inlined)
+with the current list serializer for one user owning many documents::
+
+    python -m benchmarks.document_list [--documents 200] [--chunks 40]
+"""
+import json
+import time
+
+import numpy as np
+
+from benchmarks.common import emit, make_parser, setup_django, temporary_database
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--chunks', type=int, default=40, help='Chunks per document')
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework import serializers
+    from rest_framework.test import APIClient
+
+    from documents.models import Document, DocumentChunk
+    from documents.serializers import VectorSerializerField
+
+    class LegacyChunkSerializer(serializers.ModelSerializer):
+        embedding = VectorSerializerField()
+
+        class Meta:
+            model = DocumentChunk
+            fields = ['id', 'content', 'chunk_index', 'embedding']
+
+    class LegacyDocumentSerializer(serializers.ModelSerializer):
+        """The nested serializer ``GET /api/documents/`` used to return."""
+        chunks = LegacyChunkSerializer(many=True, read_only=True)
+        uploaded_by = serializers.ReadOnlyField(source='uploaded_by.username')
+        embedding = VectorSerializerField()
+
+        class Meta:
+            model = Document
+            fields = ['id', 'title', 'file', 'file_type', 'uploaded_at',
+                      'updated_at', 'uploaded_by', 'content', 'embedding', 'chunks']
+
+    settings.ALLOWED_HOSTS = ['*']
+    rng = np.random.default_rng(0)
+    chunk_text = 'lorem ipsum dolor sit amet ' * 37
+
+    with temporary_database():
+        user = User.objects.create_user('bench', password='bench')
+        for i in range(args.documents):
+            document = Document.objects.create(
+                title=f'doc-{i}.pdf', file=f'documents/doc-{i}.pdf', file_type='PDF',
+                uploaded_by=user, content=chunk_text * args.chunks,
+            )
+            DocumentChunk.objects.bulk_create([
+                DocumentChunk(document=document, content=chunk_text, chunk_index=j,
+                              embedding=rng.standard_normal(args.dim).astype(np.float32))
+                for j in range(args.chunks)
+            ])
+
+        def legacy():
+            queryset = Document.objects.filter(uploaded_by=user)
+            return json.dumps(LegacyDocumentSerializer(queryset, many=True).data).encode()
+
+        client = APIClient()
+        client.force_authenticate(user)
+
+        def current():
+            return client.get('/api/documents/').content
+
+        rows = []
+        for name, fn in (('legacy_nested', legacy), ('list_serializer', current)):
+            fn()  # warm up (URLconf import, connection setup)
+            timings = []
+            for _ in range(args.repeat):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    payload = fn()
+                    timings.append(time.perf_counter() - started)
+            rows.append({
+                'representation': name,
+                'documents': args.documents,
+                'payload_bytes': len(payload),
+                'median_ms': float(np.median(timings)) * 1000,
+                'sql_queries': len(queries),
+            })
+
+    emit('document_list', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Chunks/sec of ingestion embedding for several batch sizes on CPU.
+
+    python -m benchmarks.embedding_batch [--chunks 512] [--batch-sizes 1,16,64,256]
+"""
+import time
+
+from benchmarks.common import emit, make_parser, setup_django
+
+
+def synthetic_chunks(count: int, size: int = 1000):
+    sentence = 'The quick brown fox jumps over the lazy dog while the contract renews annually. '
+    text = sentence * (size // len(sentence) + 1)
+    return [f'{i} {text[:size]}' for i in range(count)]
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--chunks', type=int, default=512)
+    parser.add_argument('--batch-sizes', default='1,16,64,256')
+    parser.add_argument('--stream', action='store_true', help='Overlap encoding with batch production')
+    args = parser.parse_args()
+
+    setup_django()
+    from documents import embedding
+
+    # Pin to CPU and load the model outside the timed region.
+    encoder = embedding.get_encoder()
+    if hasattr(encoder, 'to'):
+        encoder.to('cpu')
+    texts = synthetic_chunks(args.chunks)
+    embedding.encode(texts[:2])
+
+    rows = []
+    for batch_size in (int(b) for b in args.batch_sizes.split(',')):
+        started = time.perf_counter()
+        count = 0
+        for batch, vectors in embedding.embed_texts(texts, batch_size=batch_size, stream=args.stream, use_cache=False):
+            count += len(vectors)
+        elapsed = time.perf_counter() - started
+        rows.append({
+            'batch_size': batch_size,
+            'chunks': count,
+            'seconds': elapsed,
+            'chunks_per_sec': count / elapsed,
+        })
+    emit('embedding_batch', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
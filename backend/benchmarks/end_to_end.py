@@ -0,0 +1,306 @@
+"""End-to-end load test: upload, ingestion and queries through the real views.
+
+Runs offline and deterministically.  Synthetic PDF and DOCX files go through
+``POST /api/documents/``, the queued ingestion jobs are run the way
+``manage.py ingest_worker`` runs them, and questions go through
+``POST /api/documents/<id>/query/`` from ``--concurrency`` client threads.
+The models are stand-ins: a hash-seeded embedder (``--embed-ms`` per text),
+a Gemini stand-in (``--llm-ms`` per call, ``--llm-error-rate`` failures that
+exercise the Flan-T5 fallback) and a Flan-T5 stand-in (``--hf-ms``)::
+
+    python -m benchmarks.end_to_end [--docs 6] [--pages 20] [--formats pdf,docx]
+        [--queries 200] [--concurrency 4] [--output run.json] [--compare base.json]
+
+Per phase it reports throughput, latency p50/p95/p99, database queries per
+request and the process's peak RSS once the phase is done.  ``--output``
+writes the results with the git commit and configuration as JSON;
+``--compare`` prints every figure against such a file from an earlier run.
+"""
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.common import emit, make_parser, setup_django, temporary_database, write_text_pdf
+
+WORDS = (
+    'agreement supplier customer invoice payment term renewal notice breach liability warranty '
+    'service level availability support data protection security incident audit fee schedule '
+    'termination confidentiality delivery acceptance milestone report quarter revenue policy'
+).split()
+
+
+class StubEmbeddings:
+    """Deterministic embedder with the sentence-transformers ``encode`` too."""
+
+    def __init__(self, dim, ms_per_text):
+        self.dim = dim
+        self.seconds_per_text = ms_per_text / 1000
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:4], 'little')
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        time.sleep(self.seconds_per_text * len(texts))
+        return np.stack([self._vector(text) for text in texts]) if texts else np.empty((0, self.dim))
+
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+
+class StubLLM:
+    def __init__(self, name, ms, error_rate=0.0, seed=0):
+        self.name = name
+        self.seconds = ms / 1000
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def invoke(self, prompt):
+        time.sleep(self.seconds)
+        with self.lock:
+            failed = self.random.random() < self.error_rate
+        if failed:
+            raise RuntimeError(f'{self.name} stand-in failure')
+        return f'{self.name} answer ({len(prompt)} prompt chars)'
+
+
+class StubTokenizer:
+    def encode(self, text):
+        return text.split()
+
+
+def synthetic_pages(rng, pages, lines_per_page):
+    return [
+        [f'{page + 1}.{line + 1} ' + ' '.join(rng.choice(WORDS) for _ in range(12))
+         for line in range(lines_per_page)]
+        for page in range(pages)
+    ]
+
+
+def synthetic_file(fmt, rng, pages, lines_per_page):
+    """``(name, bytes)`` of a synthetic ``fmt`` ('pdf' or 'docx') file."""
+    content = synthetic_pages(rng, pages, lines_per_page)
+    name = f'synthetic-{rng.getrandbits(32):08x}.{fmt}'
+    if fmt == 'pdf':
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as file:
+            write_text_pdf(file.name, content)
+            return name, open(file.name, 'rb').read()
+    import docx
+
+    document = docx.Document()
+    for number, lines in enumerate(content):
+        for line in lines:
+            document.add_paragraph(line)
+        if number < len(content) - 1:
+            document.add_page_break()
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return name, buffer.getvalue()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(phase, latencies, db_queries, statuses, wall, **extra):
+    latencies = np.array(latencies) * 1000
+    row = {
+        'phase': phase,
+        'requests': len(latencies),
+        'ok': sum(1 for code in statuses if code in (200, 201, 202)),
+        'wall_s': wall,
+        'per_s': len(latencies) / wall if wall else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'db_queries_mean': float(np.mean(db_queries)),
+        'db_queries_max': int(np.max(db_queries)),
+    }
+    row.update(extra)
+    row['peak_rss_mb'] = peak_rss_mb()
+    return row
+
+
+def timed_request(fn):
+    """Run ``fn()`` and return ``(seconds, database queries, response)``."""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = fn()
+        elapsed = time.perf_counter() - started
+    return elapsed, len(queries), response
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(rows, baseline_path):
+    with open(baseline_path) as file:
+        baseline = {row['phase']: row for row in json.load(file)['results']}
+    print(f'compared with {baseline_path}')
+    for row in rows:
+        before = baseline.get(row['phase'])
+        if before is None:
+            continue
+        for key, value in row.items():
+            old = before.get(key)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and key != 'requests':
+                change = f'{(value - old) / old * 100:+.1f}%' if old else 'n/a'
+                print(f"  {row['phase']:9} {key:16} {old:>12.4g} -> {value:>12.4g}  {change}")
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--docs', type=int, default=6)
+    parser.add_argument('--pages', type=int, default=20, help='Pages per document')
+    parser.add_argument('--lines', type=int, default=30, help='Lines per page')
+    parser.add_argument('--formats', default='pdf,docx')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--repeat-fraction', type=float, default=0.2,
+                        help='Share of questions asked before (answer cache hits)')
+    parser.add_argument('--embed-ms', type=float, default=1.0, help='Stand-in embedding cost per text')
+    parser.add_argument('--llm-ms', type=float, default=200, help='Gemini stand-in latency')
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--hf-ms', type=float, default=400, help='Flan-T5 stand-in latency')
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='Results file of an earlier run')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from rest_framework.test import APIClient
+
+    from documents import jobs, model_registry
+    from documents.models import Document
+    from documents.throttling import DocumentUploadRateThrottle, QueryRateThrottle
+
+    scratch = tempfile.mkdtemp(prefix='smartdocs-e2e-')
+    settings.ALLOWED_HOSTS = ['*']
+    settings.MEDIA_ROOT = os.path.join(scratch, 'media')
+    settings.VECTOR_INDEX_DIR = os.path.join(scratch, 'vector_index')
+    settings.ASYNC_QUERY_CONCURRENCY = max(settings.ASYNC_QUERY_CONCURRENCY, args.concurrency)
+    DocumentUploadRateThrottle.rate = '1000000/minute'
+    QueryRateThrottle.rate = '1000000/minute'
+
+    embeddings = StubEmbeddings(args.dim, args.embed_ms)
+    gemini = StubLLM('gemini', args.llm_ms, args.llm_error_rate, args.seed)
+    flan = StubLLM('flan-t5', args.hf_ms)
+    model_registry.register(model_registry.EMBEDDINGS, lambda: embeddings)
+    model_registry.register(model_registry.GEMINI_LLM, lambda: gemini)
+    model_registry.register(model_registry.HF_LLM, lambda: flan)
+    model_registry.register(model_registry.HF_TOKENIZER, StubTokenizer)
+    # Routes queries to the Gemini stand-in; nothing leaves the machine.
+    os.environ['GOOGLE_API_KEY'] = 'offline-benchmark'
+
+    rng = random.Random(args.seed)
+    formats = [fmt.strip() for fmt in args.formats.split(',') if fmt.strip()]
+    files = [synthetic_file(formats[i % len(formats)], rng, args.pages, args.lines) for i in range(args.docs)]
+
+    rows = []
+    with temporary_database():
+        user = User.objects.create_user('bench', password='bench')
+
+        def client():
+            api = APIClient()
+            api.force_authenticate(user)
+            return api
+
+        uploader = client()
+        latencies, db_queries, statuses = [], [], []
+        started = time.perf_counter()
+        for name, data in files:
+            upload = io.BytesIO(data)
+            upload.name = name
+            elapsed, count, response = timed_request(
+                lambda: uploader.post('/api/documents/', {'file': upload, 'title': name}, format='multipart')
+            )
+            latencies.append(elapsed)
+            db_queries.append(count)
+            statuses.append(response.status_code)
+        rows.append(summarize('upload', latencies, db_queries, statuses, time.perf_counter() - started,
+                              mb=sum(len(data) for _, data in files) / 1024 / 1024))
+
+        latencies, db_queries, statuses = [], [], []
+        started = time.perf_counter()
+        while True:
+            job = jobs.claim_next()
+            if job is None:
+                break
+            elapsed, count, _ = timed_request(lambda: jobs.run_job(job))
+            job.refresh_from_db()
+            latencies.append(elapsed)
+            db_queries.append(count)
+            statuses.append(200 if job.status == job.COMPLETED else 500)
+        wall = time.perf_counter() - started
+        documents = list(Document.objects.filter(uploaded_by=user).values_list('id', flat=True))
+        chunks = sum(Document.objects.get(pk=pk).chunks.count() for pk in documents)
+        rows.append(summarize('ingest', latencies, db_queries, statuses, wall,
+                              pages_per_s=args.docs * args.pages / wall, chunks_per_s=chunks / wall))
+
+        asked = []
+        plan = []
+        for i in range(args.queries):
+            if asked and rng.random() < args.repeat_fraction:
+                plan.append(rng.choice(asked))
+            else:
+                question = (rng.choice(documents),
+                            f'What does the {rng.choice(WORDS)} clause say about {rng.choice(WORDS)} ({i})?')
+                asked.append(question)
+                plan.append(question)
+        local = threading.local()
+
+        def ask(item):
+            if not hasattr(local, 'client'):
+                local.client = client()
+            document_id, question = item
+            return timed_request(lambda: local.client.post(
+                f'/api/documents/{document_id}/query/', {'query': question}, format='json'
+            ))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(ask, plan))
+        rows.append(summarize('query', [r[0] for r in results], [r[1] for r in results],
+                              [r[2].status_code for r in results], time.perf_counter() - started,
+                              concurrency=args.concurrency))
+
+    shutil.rmtree(scratch, ignore_errors=True)
+
+    emit('end_to_end', rows, args.json)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'benchmark': 'end_to_end', 'commit': git_commit(), 'config': vars(args),
+                       'results': rows}, file, indent=2)
+    if args.compare:
+        compare(rows, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Throughput and latency of local generation with and without batching.
+
+At each concurrency level, that many client threads send prompts back to
+back.  Modes:
+
+* ``direct``    - every request calls the model itself (HF_BATCHING=off)
+* ``inprocess`` - requests go through a ``Batcher`` thread
+* ``server``    - requests go over a Unix socket to a batcher (served from a
+  thread here, so this measures the protocol overhead, not a second process)
+
+::
+
+    python -m benchmarks.generation_batching [--concurrency 1,4,16] [--real-model]
+
+Without ``--real-model`` the model is a stub that holds one shared "CPU" for
+``--base-ms + n * --item-ms`` per forward pass of ``n`` prompts, which is the
+shape of Flan-T5 generation cost on a few CPU cores.
+"""
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from benchmarks.common import emit, make_parser, setup_django
+
+MODES = ('direct', 'inprocess', 'server')
+
+
+class StubModel:
+    def __init__(self, base_s, item_s):
+        self.base_s = base_s
+        self.item_s = item_s
+        self.cpu = threading.Lock()
+
+    def generate(self, prompts):
+        with self.cpu:
+            time.sleep(self.base_s + self.item_s * len(prompts))
+        return [f'answer to {prompt[-20:]}' for prompt in prompts]
+
+
+def run_level(call, concurrency, requests_per_client):
+    latencies = []
+    lock = threading.Lock()
+
+    def client(n):
+        for i in range(requests_per_client):
+            started = time.perf_counter()
+            call(f'Context: ... Question {n}.{i}: what is the notice period?')
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests_per_s': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+    }
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--concurrency', default='1,2,4,8,16')
+    parser.add_argument('--requests', type=int, default=8, help='Requests per client thread')
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    parser.add_argument('--base-ms', type=float, default=120)
+    parser.add_argument('--item-ms', type=float, default=15)
+    parser.add_argument('--real-model', action='store_true', help='Use Flan-T5 (HF_LLM_MODEL_NAME)')
+    args = parser.parse_args()
+
+    setup_django()
+    from documents import batching, model_registry
+
+    if args.real_model:
+        generate = batching.pipeline_generate(model_registry.load_hf_pipeline())
+    else:
+        generate = StubModel(args.base_ms / 1000, args.item_ms / 1000).generate
+
+    batcher = batching.Batcher(generate, args.max_batch_size, args.max_wait_ms / 1000)
+    socket_path = os.path.join(tempfile.mkdtemp(prefix='smartdocs-gen-'), 'generation.sock')
+    authkey = b'benchmark'
+    threading.Thread(target=batching.serve, args=(batcher, socket_path, authkey), daemon=True).start()
+    while not os.path.exists(socket_path):
+        time.sleep(0.01)
+    remote = batching.RemoteBatcher(socket_path, authkey)
+
+    calls = {
+        'direct': lambda prompt: generate([prompt])[0],
+        'inprocess': lambda prompt: batcher.submit(prompt).result(),
+        'server': remote.generate,
+    }
+    rows = []
+    for concurrency in (int(c) for c in args.concurrency.split(',')):
+        for mode in MODES:
+            batches_before, requests_before = batcher.batches, batcher.requests
+            row = {'concurrency': concurrency, 'mode': mode}
+            row.update(run_level(calls[mode], concurrency, args.requests))
+            if mode != 'direct':
+                batches = batcher.batches - batches_before
+                row['mean_batch'] = (batcher.requests - requests_before) / batches if batches else 0.0
+            else:
+                row['mean_batch'] = 1.0
+            rows.append(row)
+
+    emit('generation_batching', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Per-query latency of vector, BM25 and hybrid (RRF-fused) retrieval.
+
+Synthetic chunks of about 150 words drawn from a Zipf-distributed vocabulary,
+each with a few identifiers (invoice numbers, clause numbers)::
+
+    python -m benchmarks.hybrid_retrieval [--sizes 1000,10000,100000]
+
+Also reports BM25 build time and the size of the stored (compressed) index.
+With ``DATABASE_URL`` pointing at Postgres, ``--postgres`` adds the full-text
+backend, measured on a throwaway database.
+"""
+import time
+
+import numpy as np
+
+from benchmarks.common import emit, make_parser, setup_django, temporary_database
+
+
+def synthetic_chunks(count, rng, vocabulary=5000, words=150):
+    vocab = np.array([f'w{i}' for i in range(vocabulary)])
+    ranks = np.minimum(rng.zipf(1.3, size=(count, words)), vocabulary) - 1
+    return [
+        ' '.join(vocab[row]) + f' invoice INV-{i:06d} clause {i % 40}.{i % 7}'
+        for i, row in enumerate(ranks)
+    ]
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--candidates', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--postgres', action='store_true', help='Also time Postgres full-text search')
+    args = parser.parse_args()
+
+    setup_django()
+    from documents.lexical import LexicalIndex
+    from documents.retrieval import DocumentIndex
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        texts = synthetic_chunks(size, rng)
+        index = DocumentIndex(texts, rng.standard_normal((size, args.dim), dtype=np.float32))
+        query_embedding = rng.standard_normal(args.dim, dtype=np.float32)
+        query = f'what does invoice INV-{size // 2:06d} say about w12 and w345'
+
+        started = time.perf_counter()
+        lexical = LexicalIndex.build(texts)
+        build = time.perf_counter() - started
+        stored = len(lexical.to_bytes())
+        index.attach_lexical(lexical)
+
+        vector = best_of(lambda: index.search(query_embedding, args.k), args.repeat)
+        bm25 = best_of(lambda: index.lexical_search(query, args.candidates), args.repeat)
+        hybrid = best_of(
+            lambda: index.hybrid_search(
+                query_embedding, index.lexical_search(query, args.candidates),
+                k=args.k, candidates=args.candidates,
+            ),
+            args.repeat,
+        )
+        row = {
+            'chunks': size,
+            'bm25_build_s': build,
+            'stored_kb': stored / 1024,
+            'vector_ms': vector * 1000,
+            'bm25_ms': bm25 * 1000,
+            'hybrid_ms': hybrid * 1000,
+        }
+        if args.postgres:
+            row['postgres_fts_ms'] = time_postgres(texts, query, args) * 1000
+        rows.append(row)
+
+    emit('hybrid_retrieval', rows, args.json)
+
+
+def time_postgres(texts, query, args):
+    from documents.lexical import postgres_search
+    from documents.models import Document, DocumentChunk
+
+    with temporary_database() as connection:
+        if connection.vendor != 'postgresql':
+            raise SystemExit('--postgres needs DATABASE_URL to point at Postgres')
+        document = Document.objects.create(title='bench.pdf', file='documents/bench.pdf', file_type='PDF')
+        DocumentChunk.objects.bulk_create(
+            [DocumentChunk(document=document, content=text, chunk_index=i) for i, text in enumerate(texts)],
+            batch_size=1000,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE documents_documentchunk')
+        return best_of(lambda: postgres_search(document.id, query, args.candidates), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
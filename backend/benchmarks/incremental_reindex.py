@@ -0,0 +1,126 @@
+"""Cost of re-indexing an edited document versus ingesting it from scratch.
+
+Ingests a synthetic document, edits ``--edit-percent`` of its pages (changed,
+inserted and deleted pages in equal parts), then re-processes it and reports
+chunks embedded and wall time for both passes.  The embedding cache is off so
+only the chunk diff saves work::
+
+    python -m benchmarks.incremental_reindex [--pages 500] [--edit-percent 1]
+
+By default the embedder is a stub costing ``--embed-ms`` per chunk (about
+all-MiniLM-L6-v2 on one CPU core); ``--real-model`` uses the configured model.
+"""
+import random
+import time
+
+import numpy as np
+
+from benchmarks.common import emit, make_parser, setup_django, temporary_database
+
+
+class StubEmbeddings:
+    def __init__(self, cost_s, dim=384):
+        self.cost_s = cost_s
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        time.sleep(self.cost_s * len(texts))
+        return np.random.default_rng(len(texts)).standard_normal((len(texts), self.dim)).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def synthetic_pages(count, rng):
+    words = 'contract renewal party notice term clause payment liability scope annex'.split()
+    return [
+        '\n'.join(
+            ' '.join(rng.choice(words) for _ in range(14)) + f' ({p}.{i})'
+            for i in range(20)
+        )
+        for p in range(count)
+    ]
+
+
+def edit_pages(pages, percent, rng):
+    pages = list(pages)
+    edits = max(1, round(len(pages) * percent / 100))
+    for n in range(edits):
+        position = rng.randrange(len(pages))
+        if n % 3 == 0:
+            pages[position] = pages[position].replace('payment', 'settlement', 1) + ' (amended)'
+        elif n % 3 == 1:
+            pages.insert(position, f'Inserted page {n}. ' * 60)
+        else:
+            del pages[position]
+    return pages, edits
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--edit-percent', type=float, default=1.0)
+    parser.add_argument('--embed-ms', type=float, default=5.0, help='Stub embedding cost per chunk')
+    parser.add_argument('--real-model', action='store_true', help='Use the configured embedding model')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from documents import model_registry
+    from documents.models import Document
+    from documents.processors import DocumentProcessor
+
+    settings.EMBEDDING_CACHE_ENABLED = False
+    settings.VECTOR_INDEX_ENABLED = False
+    if not args.real_model:
+        model_registry.register(model_registry.EMBEDDINGS, lambda: StubEmbeddings(args.embed_ms / 1000))
+
+    rng = random.Random(args.seed)
+    original = synthetic_pages(args.pages, rng)
+    edited, edits = edit_pages(original, args.edit_percent, rng)
+
+    class SyntheticProcessor(DocumentProcessor):
+        pages = original
+
+        def iter_pages(self):
+            return enumerate(self.pages, start=1)
+
+    embedded = []
+
+    def counting(texts):
+        for text in texts:
+            embedded.append(text)
+            yield text
+
+    import documents.processors as processors
+    embed_texts = processors.embed_texts
+    processors.embed_texts = lambda texts, **kwargs: embed_texts(counting(texts), **kwargs)
+
+    rows = []
+    with temporary_database() as connection:
+        model_registry.get_embeddings()
+        document = Document.objects.create(title='bench.pdf', file='documents/bench.pdf', file_type='PDF')
+        for label, pages in (('full', original), ('reindex', edited)):
+            SyntheticProcessor.pages = pages
+            embedded.clear()
+            started = time.perf_counter()
+            SyntheticProcessor(document).process_document()
+            elapsed = time.perf_counter() - started
+            rows.append({
+                'pass': label,
+                'vendor': connection.vendor,
+                'pages': len(pages),
+                'pages_edited': edits if label == 'reindex' else 0,
+                'chunks': document.chunks.count(),
+                'chunks_embedded': len(embedded),
+                'seconds': elapsed,
+            })
+    rows[1]['cost_vs_full'] = rows[1]['seconds'] / rows[0]['seconds']
+    rows[0]['cost_vs_full'] = 1.0
+
+    emit('incremental_reindex', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
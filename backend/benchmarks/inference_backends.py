@@ -0,0 +1,139 @@
+"""Latency, throughput and accuracy drift of each CPU inference backend.
+
+    python -m benchmarks.inference_backends [--backends torch,torch_int8,onnx,onnx_int8]
+        [--threads 4] [--generation]
+
+Embeddings: single-query latency (the query path), chunks/s at
+``EMBEDDING_BATCH_SIZE`` (the ingestion path) and the cosine similarity of
+each backend's vectors to full-precision PyTorch ones.  With
+``--generation`` Flan-T5 is timed too, and ``same_answer`` is the share of
+prompts answered exactly like the full-precision model.
+
+The ONNX backends need ``python manage.py export_onnx_models`` first;
+backends that cannot load are reported with their error.
+"""
+import statistics
+import time
+
+from benchmarks.common import emit, make_parser, setup_django
+from benchmarks.embedding_batch import synthetic_chunks
+
+QUERIES = [
+    'What is the notice period for termination?',
+    'Who pays for shipping under clause 7?',
+    'When was the agreement signed?',
+    'What happens if an invoice is paid late?',
+]
+
+
+def timed(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies)
+
+
+def bench_embeddings(inference, backend, texts, batch_size, repeat, reference_vectors):
+    import numpy as np
+
+    started = time.perf_counter()
+    embeddings = inference.load_embeddings(backend)
+    load_s = time.perf_counter() - started
+    embeddings.embed_query(QUERIES[0])  # warm-up
+
+    query_s = timed(lambda: [embeddings.embed_query(q) for q in QUERIES], repeat) / len(QUERIES)
+    encoder = getattr(embeddings, 'client', embeddings)
+    started = time.perf_counter()
+    vectors = np.asarray(encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                        show_progress_bar=False), dtype=np.float32)
+    batch_s = time.perf_counter() - started
+    row = {
+        'load_s': load_s,
+        'query_ms': query_s * 1000,
+        'chunks_per_s': len(texts) / batch_s,
+    }
+    if reference_vectors is None:
+        return row, vectors
+    cosines = inference.cosine_similarities(reference_vectors, vectors)
+    row.update({'mean_cosine': float(cosines.mean()), 'min_cosine': float(cosines.min())})
+    return row, vectors
+
+
+def bench_generation(inference, backend, prompts, repeat, reference_answers):
+    from documents.batching import pipeline_generate
+
+    started = time.perf_counter()
+    generate = pipeline_generate(inference.load_generator(backend))
+    load_s = time.perf_counter() - started
+    generate(prompts[:1])  # warm-up
+    answers = generate(prompts)
+    single_s = timed(lambda: generate(prompts[:1]), repeat)
+    batch_s = timed(lambda: generate(prompts), repeat)
+    row = {
+        'load_s': load_s,
+        'answer_ms': single_s * 1000,
+        'answers_per_s': len(prompts) / batch_s,
+    }
+    if reference_answers is not None:
+        row['same_answer'] = sum(a == b for a, b in zip(answers, reference_answers)) / len(prompts)
+    return row, answers
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--backends', default='torch,torch_int8,onnx,onnx_int8')
+    parser.add_argument('--chunks', type=int, default=256)
+    parser.add_argument('--threads', type=int, default=0, help='Intra-op threads (0 = settings)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--generation', action='store_true', help='Also benchmark Flan-T5')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from documents import inference
+
+    if args.threads:
+        settings.INFERENCE_INTRA_OP_THREADS = args.threads
+    backends = [b for b in args.backends.split(',') if b]
+    # Full precision always runs first: it is the drift reference.
+    backends = ['torch'] + [b for b in backends if b != 'torch']
+    texts = synthetic_chunks(args.chunks) + inference.DRIFT_SAMPLE_TEXTS
+    prompts = [
+        f'Context: The agreement was signed on 3 March 2021 and renews yearly. '
+        f'Invoices are due in 30 days.\n\nQuestion: {question}\n\nAnswer:'
+        for question in QUERIES
+    ]
+
+    rows = []
+    reference_vectors = reference_answers = None
+    for backend in backends:
+        row = {'model': 'embeddings', 'backend': backend}
+        try:
+            result, vectors = bench_embeddings(inference, backend, texts, settings.EMBEDDING_BATCH_SIZE,
+                                               args.repeat, reference_vectors)
+            row.update(result)
+            if reference_vectors is None:
+                reference_vectors = vectors
+        except Exception as e:
+            row['error'] = f'{e.__class__.__name__}: {e}'
+        rows.append(row)
+
+    if args.generation:
+        for backend in backends:
+            row = {'model': 'generator', 'backend': backend}
+            try:
+                result, answers = bench_generation(inference, backend, prompts, args.repeat, reference_answers)
+                row.update(result)
+                if reference_answers is None:
+                    reference_answers = answers
+            except Exception as e:
+                row['error'] = f'{e.__class__.__name__}: {e}'
+            rows.append(row)
+
+    emit('inference_backends', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
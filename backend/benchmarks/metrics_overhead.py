@@ -0,0 +1,55 @@
+"""Cost of recording metrics and of rendering ``/metrics``.
+
+    python -m benchmarks.metrics_overhead [--ops 200000] [--threads 1,4]
+
+Reports the time per ``Counter.inc`` and ``Histogram.observe`` call, with
+several threads recording at once, and the time to render the endpoint.
+"""
+import threading
+import time
+
+from benchmarks.common import emit, make_parser, setup_django
+
+
+def per_call_ns(fn, ops, threads):
+    def worker():
+        for i in range(ops // threads):
+            fn(i)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return (time.perf_counter() - started) / ops * 1e9
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--ops', type=int, default=200000)
+    parser.add_argument('--threads', default='1,4')
+    args = parser.parse_args()
+
+    setup_django()
+    from documents import metrics
+
+    stages = ('embed', 'index', 'retrieve', 'prompt', 'generate')
+    calls = {
+        'counter_inc': lambda i: metrics.QUERIES.inc(answered_by='bench'),
+        'histogram_observe': lambda i: metrics.QUERY_STAGE_SECONDS.observe(i % 1000 / 1000, stage=stages[i % 5]),
+    }
+    rows = []
+    for threads in (int(t) for t in args.threads.split(',')):
+        for name, fn in calls.items():
+            rows.append({'operation': name, 'threads': threads, 'ns_per_call': per_call_ns(fn, args.ops, threads)})
+
+    started = time.perf_counter()
+    body = metrics.render()
+    rows.append({'operation': f"render ({body.count(chr(10))} lines)", 'threads': 1,
+                 'ns_per_call': (time.perf_counter() - started) * 1e9})
+    emit('metrics_overhead', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
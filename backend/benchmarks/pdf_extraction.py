@@ -0,0 +1,118 @@
+"""Wall time and peak RSS of PDF extraction plus chunking.
+
+Generates a synthetic PDF (1000 pages by default) and runs each mode in a
+fresh subprocess so peak RSS figures are independent:
+
+* ``legacy``   - serial ``text += page`` extraction, then one split of the
+  whole string (the previous implementation)
+* ``serial``   - page generator feeding the incremental splitter
+* ``parallel`` - page ranges extracted in a process pool
+
+::
+
+    python -m benchmarks.pdf_extraction [--pages 1000] [--processes 4]
+
+``parallel`` only pays off with more than one CPU core; with a single core it
+is slower than ``serial`` because every worker re-parses the PDF.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import emit, make_parser, setup_django, write_text_pdf
+
+MODES = ('legacy', 'serial', 'parallel')
+
+
+def _peak_rss_mb(who):
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def run_mode(mode, pdf_path, processes):
+    setup_django()
+    import PyPDF2
+
+    from documents.extraction import iter_pdf_pages
+    from documents.models import Document
+    from documents.processors import DocumentProcessor
+
+    processor = DocumentProcessor(Document())
+    started = time.perf_counter()
+    first_chunk = None
+    chunks = 0
+    if mode == 'legacy':
+        text = ""
+        with open(pdf_path, 'rb') as file:
+            for page in PyPDF2.PdfReader(file).pages:
+                text += page.extract_text() + "\n"
+        for _ in processor.text_splitter.split_text(text):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - started
+            chunks += 1
+    else:
+        pages = iter_pdf_pages(
+            pdf_path,
+            processes=processes if mode == 'parallel' else 1,
+            min_parallel_pages=1,
+        )
+        for _ in processor.iter_chunks(pages):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - started
+            chunks += 1
+    wall = time.perf_counter() - started
+
+    return {
+        'mode': mode,
+        'chunks': chunks,
+        'wall_s': wall,
+        'first_chunk_s': first_chunk,
+        'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF),
+        'worker_peak_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--lines', type=int, default=45, help='Text lines per page')
+    parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--run-mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--pdf', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        print(json.dumps(run_mode(args.run_mode, args.pdf, args.processes)))
+        return
+
+    words = 'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor'.split()
+    pages = [
+        [' '.join(words[(p + i + j) % len(words)] for j in range(12)) + f' {p}.{i}'
+         for i in range(args.lines)]
+        for p in range(args.pages)
+    ]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pdf_path = os.path.join(tmpdir, 'bench.pdf')
+        write_text_pdf(pdf_path, pages)
+        del pages
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.pdf_extraction', '--run-mode', mode,
+                 '--pdf', pdf_path, '--processes', str(args.processes)],
+                check=True, capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            ).stdout
+            row = json.loads(output.strip().splitlines()[-1])
+            rows.append(dict(row, pages=args.pages))
+
+    emit('pdf_extraction', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
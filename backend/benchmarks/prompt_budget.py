@@ -0,0 +1,74 @@
+"""Prompt size and assembly time: naive concatenation vs ``build_prompt``.
+
+Splits a synthetic document with the ingestion splitter (so neighbouring
+chunks share the usual overlap), takes runs of adjacent chunks as the
+retrieved set and builds prompts with and without chat history::
+
+    python -m benchmarks.prompt_budget [--model google/flan-t5-base] [--turns 10]
+
+Tokens are counted with the model's tokenizer when ``transformers`` can load
+it, otherwise estimated at four characters per token (the ``counter`` column).
+"""
+import time
+
+from benchmarks.common import emit, make_parser, setup_django
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--model', help='Model name (defaults to HF_LLM_MODEL_NAME)')
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--turns', type=int, default=10, help='Chat history messages')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from documents import prompting
+    from documents.models import Document
+    from documents.processors import DocumentProcessor
+    from documents.retrieval import RetrievedChunk
+
+    model = args.model or settings.HF_LLM_MODEL_NAME
+    count = prompting.token_counter(model)
+    sentence = 'The supplier shall notify the customer of any change to the service within ten days. '
+    text = '\n'.join(f'{i}. ' + sentence * 2 for i in range(400))
+    chunks = [
+        RetrievedChunk(chunk, 1.0, i, i)
+        for i, chunk in enumerate(DocumentProcessor(Document()).text_splitter.split_text(text))
+    ]
+    history = [
+        {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'Message {i}: ' + sentence * 3}
+        for i in range(args.turns)
+    ]
+
+    rows = []
+    for label, chat_history in (('no_history', []), (f'{args.turns}_turns', history)):
+        retrieved = chunks[10:10 + args.k]
+        naive = prompting.QA_PROMPT.format(
+            context='\n\n'.join(chunk.text for chunk in retrieved),
+            history=prompting.compact_history(chat_history, 10 ** 9, count)[0],
+            question='When must the supplier notify the customer?',
+        )
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            prompt = prompting.build_prompt(
+                'When must the supplier notify the customer?', retrieved, chat_history, model
+            )
+        elapsed = (time.perf_counter() - started) / args.repeat
+        rows.append({
+            'case': label,
+            'model': model,
+            'counter': 'tokenizer' if count is not prompting.estimate_tokens else 'estimate',
+            'budget': prompting.token_budget(model),
+            'naive_tokens': count(naive),
+            'built_tokens': prompt.tokens,
+            'chunks_used': f'{len(prompt.chunks)}/{len(retrieved)}',
+            'build_ms': elapsed * 1000,
+        })
+
+    emit('prompt_budget', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""What cross-encoder reranking costs and what it saves in prompt tokens.
+
+On the labelled question set of ``benchmarks.retrieval_eval``, compares the
+hybrid top-``DEFAULT_TOP_K`` that goes into the prompt today with reranking
+``--candidates`` hybrid results down to ``--top-k``::
+
+    python -m benchmarks.rerank [--candidates 20] [--top-k 3]
+
+Reports recall and MRR of the chunks sent to the LLM, prompt tokens and the
+rerank time per question, both cold and with the scores cached.
+``--stub-embeddings`` / ``--stub-reranker`` run without the models (the stub
+reranker scores word overlap, so its quality figures mean little).
+"""
+import json
+import statistics
+import time
+
+from benchmarks.common import emit, make_parser, setup_django, temporary_database
+from benchmarks.retrieval_eval import DEFAULT_DATASET, TrigramEmbeddings, evaluate
+
+
+class OverlapReranker:
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        from documents.lexical import tokenize
+
+        scores = []
+        for question, text in pairs:
+            words = set(tokenize(text))
+            scores.append(sum(term in words for term in set(tokenize(question))))
+        return scores
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--dataset', default=DEFAULT_DATASET)
+    parser.add_argument('--candidates', type=int, default=20)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--stub-embeddings', action='store_true')
+    parser.add_argument('--stub-reranker', action='store_true')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.core.cache import cache
+    from documents import model_registry, prompting, rerank
+    from documents.lexical import LexicalIndex
+    from documents.retrieval import DEFAULT_TOP_K, DocumentIndex
+
+    if args.stub_reranker:
+        model_registry.register(model_registry.RERANKER, OverlapReranker)
+    # No latency budget or load shedding: measure the full rerank.
+    settings.RERANK_BUDGET_MS = 1e9
+    settings.RERANK_MAX_CONCURRENT = 1
+
+    with open(args.dataset) as file:
+        dataset = json.load(file)
+    embeddings = TrigramEmbeddings() if args.stub_embeddings else model_registry.get_embeddings()
+    chunks = dataset['chunks']
+    index = DocumentIndex(chunks, embeddings.embed_documents(chunks), chunk_ids=list(range(len(chunks))))
+    index.attach_lexical(LexicalIndex.build(chunks))
+    model_registry.get_reranker()
+    model_name = settings.HF_LLM_MODEL_NAME
+
+    totals = {'baseline': [], 'rerank': []}
+    rerank_ms = {'cold': [], 'cached': []}
+    with temporary_database():  # counters and the score cache use the database cache
+        cache.clear()
+        for item in dataset['queries']:
+            question, relevant = item['question'], set(item['relevant'])
+            query_embedding = embeddings.embed_query(question)
+            candidates = max(args.candidates, settings.HYBRID_CANDIDATES)
+            lexical_rows = index.lexical_search(question, candidates)
+            baseline = index.hybrid_search(query_embedding, lexical_rows, k=DEFAULT_TOP_K, candidates=candidates)
+            retrieved = index.hybrid_search(query_embedding, lexical_rows, k=args.candidates, candidates=candidates)
+            for label in ('cold', 'cached'):
+                started = time.perf_counter()
+                reranked, _ = rerank.rerank(question, retrieved, args.top_k)
+                rerank_ms[label].append((time.perf_counter() - started) * 1000)
+            for mode, selected in (('baseline', baseline), ('rerank', reranked)):
+                ranked = [chunk.chunk_id for chunk in selected]
+                recall, reciprocal_rank = evaluate(ranked, relevant, len(ranked))
+                tokens = prompting.build_prompt(question, selected, [], model_name).tokens
+                totals[mode].append((recall, reciprocal_rank, tokens))
+
+    rows = []
+    for mode, values in totals.items():
+        rows.append({
+            'mode': mode,
+            'chunks': DEFAULT_TOP_K if mode == 'baseline' else f'{args.top_k}/{args.candidates}',
+            'recall': statistics.mean(v[0] for v in values),
+            'mrr': statistics.mean(v[1] for v in values),
+            'prompt_tokens': statistics.mean(v[2] for v in values),
+            'rerank_ms': statistics.median(rerank_ms['cold']) if mode == 'rerank' else 0.0,
+            'cached_rerank_ms': statistics.median(rerank_ms['cached']) if mode == 'rerank' else 0.0,
+        })
+    emit('rerank', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
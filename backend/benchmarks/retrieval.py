@@ -0,0 +1,79 @@
+"""Top-k cosine retrieval: legacy per-chunk Python loop vs ``VectorIndex``.
+
+    python -m benchmarks.retrieval [--sizes 100,10000,1000000] [--legacy-max 100000]
+
+Pure NumPy; Django is not needed.  1M x 384 float32 needs about 1.5 GB RAM.
+"""
+import time
+
+import numpy as np
+
+from benchmarks.common import emit, make_parser
+
+
+def legacy_search(query_embedding, embeddings, k):
+    """The retriever that used to live in ``DocumentViewSet.query``."""
+    sims = []
+    for emb in embeddings:
+        sims.append(float(np.dot(query_embedding, emb) / (np.linalg.norm(query_embedding) * np.linalg.norm(emb))))
+    return np.argsort(sims)[-k:][::-1]
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--sizes', default='100,10000,1000000')
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--batch', type=int, default=32, help='Queries per batched search')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--legacy-max', type=int, default=100000,
+                        help='Skip the legacy loop above this many chunks')
+    args = parser.parse_args()
+
+    from documents.retrieval import VectorIndex
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        matrix = rng.standard_normal((size, args.dim), dtype=np.float32)
+        queries = rng.standard_normal((args.batch, args.dim), dtype=np.float32)
+        query = queries[0]
+
+        started = time.perf_counter()
+        index = VectorIndex(matrix)
+        build = time.perf_counter() - started
+
+        single = best_of(lambda: index.search(query, args.k), args.repeat)
+        batched = best_of(lambda: index.search_batch(queries, args.k), args.repeat) / args.batch
+
+        legacy = None
+        if size <= args.legacy_max:
+            as_lists = [row for row in matrix]
+            legacy = best_of(lambda: legacy_search(query, as_lists, args.k), 1)
+            expected = set(legacy_search(query, as_lists, args.k).tolist())
+            assert expected == set(index.search(query, args.k)[0].tolist())
+
+        rows.append({
+            'chunks': size,
+            'build_ms': build * 1000,
+            'legacy_ms': legacy * 1000 if legacy is not None else None,
+            'vector_ms': single * 1000,
+            'batched_ms_per_query': batched * 1000,
+            'speedup': legacy / single if legacy is not None else None,
+        })
+        del matrix, index
+
+    emit('retrieval', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Relevance of vector, BM25 and hybrid retrieval on a labelled question set.
+
+Reports recall@k and mean reciprocal rank per mode.  The default dataset
+(``benchmarks/data/retrieval_eval.json``) mixes identifier lookups with
+paraphrased questions; pass ``--dataset`` for your own file of the same shape::
+
+    python -m benchmarks.retrieval_eval [--k 3] [--dataset path.json]
+
+Chunks and questions are embedded with the configured embedding model.
+``--stub-embeddings`` swaps in a character-trigram hashing embedder so the
+harness runs without the model; its vector scores are then only a rough proxy.
+"""
+import json
+import os
+import zlib
+
+import numpy as np
+
+from benchmarks.common import emit, make_parser, setup_django
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'retrieval_eval.json')
+MODES = ('vector', 'bm25', 'hybrid')
+
+
+class TrigramEmbeddings:
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def embed_query(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = f'  {text.lower()}  '
+        for i in range(len(text) - 2):
+            vector[zlib.crc32(text[i:i + 3].encode('utf-8')) % self.dim] += 1
+        return vector
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def evaluate(ranked, relevant, k):
+    hits = [position for position, row in enumerate(ranked[:k]) if row in relevant]
+    recall = len(hits) / len(relevant)
+    reciprocal_rank = 1.0 / (hits[0] + 1) if hits else 0.0
+    return recall, reciprocal_rank
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--dataset', default=DEFAULT_DATASET)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--candidates', type=int, default=20)
+    parser.add_argument('--stub-embeddings', action='store_true')
+    parser.add_argument('--verbose', action='store_true', help='Print per-question ranks')
+    args = parser.parse_args()
+
+    setup_django()
+    from documents import model_registry
+    from documents.lexical import LexicalIndex
+    from documents.retrieval import DocumentIndex
+
+    with open(args.dataset) as file:
+        dataset = json.load(file)
+    embeddings = TrigramEmbeddings() if args.stub_embeddings else model_registry.get_embeddings()
+
+    chunks = dataset['chunks']
+    index = DocumentIndex(chunks, embeddings.embed_documents(chunks), chunk_ids=list(range(len(chunks))))
+    index.attach_lexical(LexicalIndex.build(chunks))
+
+    totals = {mode: [0.0, 0.0] for mode in MODES}
+    for item in dataset['queries']:
+        question, relevant = item['question'], set(item['relevant'])
+        query_embedding = embeddings.embed_query(question)
+        lexical_rows = index.lexical_search(question, args.candidates)
+        ranked = {
+            'vector': [chunk.chunk_id for chunk in index.search(query_embedding, args.k)],
+            'bm25': lexical_rows,
+            'hybrid': [
+                chunk.chunk_id for chunk in
+                index.hybrid_search(query_embedding, lexical_rows, k=args.k, candidates=args.candidates)
+            ],
+        }
+        for mode in MODES:
+            recall, reciprocal_rank = evaluate(ranked[mode], relevant, args.k)
+            totals[mode][0] += recall
+            totals[mode][1] += reciprocal_rank
+            if args.verbose:
+                print(f'{mode:7} {recall:.2f} {question} -> {ranked[mode][:args.k]} (want {sorted(relevant)})')
+
+    count = len(dataset['queries'])
+    rows = [
+        {
+            'mode': mode,
+            'questions': count,
+            f'recall@{args.k}': totals[mode][0] / count,
+            f'mrr@{args.k}': totals[mode][1] / count,
+        }
+        for mode in MODES
+    ]
+    emit('retrieval_eval', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Import time and memory of each process entry point.
+
+Every entry point runs in a fresh ``python -X importtime`` subprocess; the
+report lists total import time, wall time, peak RSS, which heavy packages got
+loaded and the slowest top-level imports::
+
+    python -m benchmarks.startup [--repeat 3] [--json]
+"""
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.common import emit, make_parser
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP = """
+import os, django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartdocs.settings')
+django.setup()
+"""
+URLCONF = """
+import importlib
+from django.conf import settings
+importlib.import_module(settings.ROOT_URLCONF)
+"""
+
+# What each kind of process imports before it can do its work.
+ENTRY_POINTS = {
+    'django_setup': SETUP,
+    'web_urlconf': SETUP + URLCONF,
+    'wsgi': "import smartdocs.wsgi\n" + URLCONF,
+    'ingest_worker': SETUP + "import documents.management.commands.ingest_worker\nimport documents.processors\n",
+    'query_path': SETUP + "import documents.qa\n",
+}
+
+HEAVY_PACKAGES = ('numpy', 'langchain', 'langchain_core', 'transformers', 'torch',
+                  'sentence_transformers', 'langchain_google_genai', 'stripe', 'google.auth')
+
+REPORT = """
+import json, resource, sys
+print('wall', time.perf_counter() - _started)
+print(json.dumps({'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  'heavy': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_PACKAGES,)
+
+
+def parse_importtime(stderr):
+    """Return ``(total_us, [(cumulative_us, module)])`` for top-level imports."""
+    top = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented by two extra spaces per level.
+        if name.startswith('  '):
+            continue
+        top.append((int(cumulative), name.strip()))
+    return sum(us for us, _ in top), top
+
+
+def measure(code):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         "import time\n_started = time.perf_counter()\n" + code + REPORT],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    lines = result.stdout.strip().splitlines()
+    wall = float(lines[-2].split()[1])
+    report = json.loads(lines[-1])
+    total_us, top = parse_importtime(result.stderr)
+    return {
+        'wall_ms': wall * 1000,
+        'import_ms': total_us / 1000,
+        # ru_maxrss is in KiB on Linux.
+        'peak_rss_mb': report['rss'] / 1024,
+        'heavy': report['heavy'],
+        'slowest': sorted(top, reverse=True)[:3],
+    }
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per entry point (best is kept)')
+    parser.add_argument('--entry-point', action='append', choices=sorted(ENTRY_POINTS),
+                        help='Only measure these entry points')
+    args = parser.parse_args()
+
+    rows = []
+    for name in args.entry_point or ENTRY_POINTS:
+        runs = [measure(ENTRY_POINTS[name]) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run['wall_ms'])
+        rows.append({
+            'entry_point': name,
+            'wall_ms': best['wall_ms'],
+            'import_ms': best['import_ms'],
+            'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+            'heavy_modules': ','.join(best['heavy']) or '-',
+            'slowest_imports': ', '.join(f'{module} {us / 1000:.0f}ms' for us, module in best['slowest']),
+        })
+
+    emit('startup', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Recall@k and latency of the IVF vector index against exact search.
+
+    python -m benchmarks.vector_index [--vectors 200000] [--nprobe 1,4,8,16,32]
+
+Uses clustered synthetic embeddings (real sentence embeddings are far from
+uniform) and a temporary index directory.
+"""
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import emit, make_parser, setup_django
+
+
+def clustered_vectors(rng, n, dim, clusters):
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    labels = rng.integers(clusters, size=n)
+    return centers[labels] + 0.35 * rng.standard_normal((n, dim), dtype=np.float32)
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--vectors', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--chunks-per-document', type=int, default=100)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nprobe', default='1,4,8,16,32')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import override_settings
+    from documents.retrieval import VectorIndex
+    from documents.vector_store import VectorStore
+
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(rng, args.vectors, args.dim, clusters=max(8, args.vectors // 2000))
+    # Questions land near some of the stored chunks.
+    queries = vectors[rng.integers(args.vectors, size=args.queries)]
+    queries = queries + 0.5 * rng.standard_normal(queries.shape, dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as path, override_settings(VECTOR_INDEX_TRAIN_THRESHOLD=args.vectors + 1):
+        store = VectorStore(path)
+        started = time.perf_counter()
+        per_doc = args.chunks_per_document
+        for document_id, start in enumerate(range(0, args.vectors, per_doc), start=1):
+            store.replace_document(document_id, 1, range(start, start + per_doc), vectors[start:start + per_doc])
+        load_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        store.train()
+        train_seconds = time.perf_counter() - started
+
+        exact = VectorIndex(vectors)
+        started = time.perf_counter()
+        truth = [set(exact.search(q, args.k)[0].tolist()) for q in queries]
+        exact_ms = (time.perf_counter() - started) / len(queries) * 1000
+
+        rows = [{'nprobe': 'exact', 'recall_at_k': 1.0, 'ms_per_query': exact_ms, 'p95_ms': None}]
+        for nprobe in (int(n) for n in args.nprobe.split(',')):
+            latencies, recalls = [], []
+            for query, expected in zip(queries, truth):
+                started = time.perf_counter()
+                hits = store.search(query, k=args.k, owner_id=1, nprobe=nprobe)
+                latencies.append(time.perf_counter() - started)
+                recalls.append(len(expected & {chunk_id for chunk_id, _, _ in hits}) / args.k)
+            rows.append({
+                'nprobe': nprobe,
+                'recall_at_k': float(np.mean(recalls)),
+                'ms_per_query': float(np.mean(latencies)) * 1000,
+                'p95_ms': float(np.percentile(latencies, 95)) * 1000,
+            })
+        for row in rows:
+            row.update({'vectors': args.vectors, 'lists': store.stats()['lists'],
+                        'load_s': load_seconds, 'train_s': train_seconds})
+
+    emit('vector_index', rows, args.json)
+
+
+if __name__ == '__main__':
+    main()
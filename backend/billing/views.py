@@ -1,13 +1,10 @@
 import os
-import stripe
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "")
-
 class CreateCheckoutSessionView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -16,6 +13,9 @@ class CreateCheckoutSessionView(APIView):
         price_id = request.data.get("price_id")
         if not price_id:
             return Response({"error": "price_id required"}, status=status.HTTP_400_BAD_REQUEST)
+        # stripe is slow to import and only this view needs it
+        import stripe
+        stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "")
         try:
             frontend_base = os.getenv("FRONTEND_URL", "http://localhost:3000")
             session = stripe.checkout.Session.create(
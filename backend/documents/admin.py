@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Document, DocumentChunk
+from .models import ChunkEmbedding, Document, DocumentChunk, IngestionJob
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
@@ -14,3 +14,16 @@ class DocumentChunkAdmin(admin.ModelAdmin):
     list_filter = ('document',)
     search_fields = ('content',)
     ordering = ('document', 'chunk_index')
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ('document', 'status', 'attempts', 'run_after', 'locked_by', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(ChunkEmbedding)
+class ChunkEmbeddingAdmin(admin.ModelAdmin):
+    list_display = ('text_hash', 'model_name', 'created_at')
+    list_filter = ('model_name',)
+    search_fields = ('text_hash',)
+    exclude = ('embedding',)
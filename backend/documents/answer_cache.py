@@ -0,0 +1,65 @@
+"""Shared cache of generated answers.
+
+Keys are SHA-256 digests of the normalised question, the chat history, the
+document's ``chunks_version`` and the LLM name, so they are identical in every
+worker process (unlike ``hash()``, which is salted per process) and a document
+that is re-processed gets fresh keys automatically.  Entries live in the
+``CACHES['default']`` backend, which is Redis, file or database backed in
+production (see ``CACHE_URL`` in settings).
+"""
+import hashlib
+import json
+import re
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import counters
+
+KEY_PREFIX = 'answer:v1'
+HITS = 'answer_cache.hits'
+MISSES = 'answer_cache.misses'
+
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_question(question: str) -> str:
+    return _whitespace.sub(' ', question).strip().lower()
+
+
+def make_key(document_id: int, version: int, question: str,
+             chat_history: Iterable[Dict[str, Any]], model_name: str) -> str:
+    history = [
+        [str(message.get('role', '')), _whitespace.sub(' ', str(message.get('content', ''))).strip()]
+        for message in chat_history or []
+    ]
+    payload = json.dumps(
+        [normalize_question(question), history, model_name],
+        ensure_ascii=False,
+        separators=(',', ':'),
+    )
+    digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    return f'{KEY_PREFIX}:{document_id}:{version}:{digest}'
+
+
+def lookup(key: str) -> Optional[Dict[str, Any]]:
+    result = cache.get(key)
+    counters.incr(HITS if result is not None else MISSES)
+    return result
+
+
+def store(key: str, result: Dict[str, Any]) -> None:
+    cache.set(key, result, timeout=settings.ANSWER_CACHE_TTL)
+
+
+def stats() -> Dict[str, Any]:
+    counts = counters.get_many([HITS, MISSES])
+    hits = counts[HITS]
+    misses = counts[MISSES]
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / lookups if lookups else 0.0,
+    }
@@ -0,0 +1,186 @@
+"""Async versions of ``DocumentViewSet.query`` and ``query_stream`` for ASGI deployments.
+
+DRF 3.14 has no async views, so these are plain Django coroutine views; the
+owner scoping, throttling, validation and error responses come from
+``query_api``, shared with the DRF actions.  While a request waits
+on Gemini it holds no thread, so one worker process can serve many queries
+at once.  ``ASYNC_QUERY_CONCURRENCY`` caps the queries in flight per process;
+requests that cannot start within ``ASYNC_QUERY_QUEUE_TIMEOUT`` seconds get
+a 503.
+"""
+import asyncio
+import json
+import logging
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import metrics, query_api
+from .models import Document
+
+logger = logging.getLogger(__name__)
+
+# asyncio primitives belong to one event loop (under WSGI every request runs
+# in a fresh one), so keep a semaphore per loop.
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(settings.ASYNC_QUERY_CONCURRENCY)
+    return semaphore
+
+
+def _error_response(error) -> JsonResponse:
+    body, status_code = error
+    return JsonResponse(body, status=status_code)
+
+
+def _parse_body(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+
+async def _start(request, pk):
+    """Authenticate, fetch the document, parse the body and wait for a slot.
+
+    Returns ``(user, document, params, semaphore)`` with the semaphore
+    acquired, or an error response.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'},
+                            status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        user = await sync_to_async(query_api.authenticate)(request)
+    except APIException as e:
+        detail = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+        return JsonResponse(detail, status=e.status_code)
+
+    try:
+        with metrics.QUERY_STAGE_SECONDS.time(stage='fetch'):
+            document = await query_api.document_queryset(user).aget(pk=pk)
+    except Document.DoesNotExist:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    data = _parse_body(request)
+    if data is None:
+        return JsonResponse({'detail': 'JSON parse error.'}, status=status.HTTP_400_BAD_REQUEST)
+    params = query_api.parse_query(data)
+    if params is None:
+        return _error_response(query_api.NO_QUERY)
+
+    semaphore = _get_semaphore()
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout=settings.ASYNC_QUERY_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        response = JsonResponse({'error': 'Server is busy, please retry shortly'},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = str(int(settings.ASYNC_QUERY_QUEUE_TIMEOUT))
+        return response
+    return user, document, params, semaphore
+
+
+async def query(request, pk):
+    from . import qa
+
+    started = await _start(request, pk)
+    if isinstance(started, HttpResponse):
+        return started
+    user, document, params, semaphore = started
+
+    try:
+        prepared = await qa.aprepare_query(
+            document,
+            params.question,
+            params.chat_history,
+            user=query_api.query_user(user),
+            use_semantic_cache=params.use_semantic_cache,
+        )
+        if prepared.cached_result:
+            return JsonResponse(prepared.cached_result)
+
+        answer, answered_by = await qa.agenerate_answer(prepared)
+        result = await qa.afinalize(prepared, answer, answered_by)
+        response = JsonResponse(result)
+        response['Server-Timing'] = prepared.server_timing()
+        return response
+    except qa.DocumentNotReady:
+        return _error_response(query_api.NOT_READY)
+    except Exception as e:
+        logger.error(f"Error processing query for document {pk}: {str(e)}")
+        return _error_response(query_api.QUERY_FAILED)
+    finally:
+        semaphore.release()
+
+
+async def query_stream(request, pk):
+    """Async ``DocumentViewSet.query_stream``.
+
+    The events come from an async generator, so under ASGI each token is
+    sent as soon as the LLM produces it (a sync iterator would be buffered
+    by Django and sent in one piece).  The query keeps its concurrency slot
+    until the stream ends.
+    """
+    from . import qa
+
+    started = await _start(request, pk)
+    if isinstance(started, HttpResponse):
+        return started
+    user, document, params, semaphore = started
+
+    started_at = time.perf_counter()
+    try:
+        prepared = await qa.aprepare_query(
+            document,
+            params.question,
+            params.chat_history,
+            user=query_api.query_user(user),
+            use_semantic_cache=params.use_semantic_cache,
+        )
+    except qa.DocumentNotReady:
+        semaphore.release()
+        return _error_response(query_api.NOT_READY)
+    except Exception as e:
+        semaphore.release()
+        logger.error(f"Error processing query for document {pk}: {str(e)}")
+        return _error_response(query_api.QUERY_FAILED)
+    return query_api.event_stream_response(_stream_events(prepared, started_at, semaphore))
+
+
+async def _stream_events(prepared, started: float, semaphore: asyncio.Semaphore):
+    from . import qa
+
+    try:
+        events = query_api.AnswerEvents(prepared, started)
+        for event in events.opening():
+            yield event
+        if prepared.cached_result:
+            return
+
+        answered_by = []
+        try:
+            async for text in qa.astream_answer(prepared, answered_by):
+                yield events.token(text)
+            result = await qa.afinalize(prepared, events.answer, answered_by[-1])
+        except Exception as e:
+            yield events.error(e)
+            return
+        yield events.done(result, answered_by[-1])
+    finally:
+        semaphore.release()
+
+
+# Authentication is token based, as for the DRF views.
+query.csrf_exempt = True
+query_stream.csrf_exempt = True
@@ -0,0 +1,260 @@
+"""Dynamic batching for the local Flan-T5 generator.
+
+Concurrent queries answered by the local model used to run one ``generate``
+call each, competing for the same CPU cores.  A ``Batcher`` owns the model on
+a single thread: requests wait in a queue, and the thread takes up to
+``HF_BATCH_MAX_SIZE`` of them, waiting at most ``HF_BATCH_MAX_WAIT_MS`` for a
+batch to fill, and generates for all of them in one padded forward pass.
+
+``HF_BATCHING`` selects where the batcher runs:
+
+* ``off``       - no batching; each request calls the pipeline directly.
+* ``inprocess`` - one batcher thread per worker process.
+* ``server``    - one shared batcher in a separate local process
+  (``manage.py generation_server``) that web workers reach over a socket, so
+  the model is loaded once per machine instead of once per worker.
+
+With batching on, ``model_registry.get_hf_llm()`` returns a ``BatchedLLM``,
+which has the ``invoke`` / ``ainvoke`` / ``stream`` interface of the
+LangChain LLMs.  Streamed answers need a ``generate`` call of their own, so
+they bypass the batch queue (in the server process too, when there is one).
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+GenerateFn = Callable[[List[str]], List[str]]
+StreamFn = Callable[[str], Iterator[str]]
+
+
+def pipeline_generate(llm) -> GenerateFn:
+    """Batch generation function for a LangChain ``HuggingFacePipeline``."""
+    hf_pipeline = getattr(llm, 'pipeline', None)
+
+    def generate(prompts: List[str]) -> List[str]:
+        if hf_pipeline is None:
+            return [str(llm.invoke(prompt)) for prompt in prompts]
+        # The pipeline pads the batch to its longest prompt.
+        outputs = hf_pipeline(prompts, batch_size=len(prompts), truncation=True)
+        return [
+            (output[0] if isinstance(output, list) else output)['generated_text']
+            for output in outputs
+        ]
+
+    return generate
+
+
+class Batcher:
+    """Coalesce concurrent ``submit`` calls into batched ``generate`` calls."""
+
+    def __init__(self, generate: GenerateFn, max_batch_size: int = 8, max_wait: float = 0.01):
+        self.generate = generate
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self.batches = 0
+        self.requests = 0
+        self._thread = threading.Thread(target=self._run, name='hf-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt: str) -> Future:
+        future: Future = Future()
+        self._queue.put((prompt, future))
+        return future
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = [item for item in self._collect() if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                outputs = self.generate([prompt for prompt, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+            'queued': self._queue.qsize(),
+        }
+
+
+# ---------------------------------------------------------------------------
+# Separate local process
+# ---------------------------------------------------------------------------
+
+def parse_address(address: str) -> Any:
+    """``host:port`` for TCP, anything else is a Unix socket path."""
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def pipeline_stream(llm) -> StreamFn:
+    """Unbatched token streaming for a LangChain ``HuggingFacePipeline``."""
+    from .qa import stream_llm
+
+    return lambda prompt: stream_llm(llm, prompt)
+
+
+def serve(batcher: Batcher, address: str, authkey: bytes, stream: Optional[StreamFn] = None) -> None:
+    """Accept client connections and answer their prompts through ``batcher``.
+
+    A client sends a prompt and gets back ``('ok', text)`` or ``('error',
+    message)``.  With ``stream``, it can send ``('stream', prompt)`` instead
+    and gets one ``('token', text)`` per piece of text, then ``('ok', None)``.
+    """
+    with Listener(parse_address(address), authkey=authkey) as listener:
+        logger.info(f"Generation server listening on {address}")
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                logger.warning(f"Rejected generation client: {str(e)}")
+                continue
+            threading.Thread(target=_serve_client, args=(batcher, connection, stream), daemon=True).start()
+
+
+def _serve_client(batcher: Batcher, connection, stream: Optional[StreamFn]) -> None:
+    with connection:
+        while True:
+            try:
+                request = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if isinstance(request, tuple):
+                    _, prompt = request
+                    if stream is None:
+                        raise RuntimeError("streaming is not enabled on this server")
+                    for text in stream(prompt):
+                        connection.send(('token', text))
+                    connection.send(('ok', None))
+                else:
+                    connection.send(('ok', batcher.submit(request).result()))
+            except (EOFError, OSError):
+                # The client went away mid-stream.
+                return
+            except Exception as e:
+                connection.send(('error', f"{e.__class__.__name__}: {e}"))
+
+
+class RemoteBatcher:
+    """Client of ``serve``; one connection per calling thread."""
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def generate(self, prompt: str) -> str:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = Client(self.address, authkey=self.authkey)
+        try:
+            connection.send(prompt)
+            status, result = connection.recv()
+        except (EOFError, OSError):
+            # Server restarted; reconnect on the next call.
+            self._local.connection = None
+            connection.close()
+            raise
+        if status != 'ok':
+            raise RuntimeError(f"Generation server error: {result}")
+        return result
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        # A connection of its own: the caller may resume the stream on other
+        # threads, or stop reading before the answer is complete.
+        with Client(self.address, authkey=self.authkey) as connection:
+            connection.send(('stream', prompt))
+            while True:
+                status, result = connection.recv()
+                if status == 'ok':
+                    return
+                if status != 'token':
+                    raise RuntimeError(f"Generation server error: {result}")
+                yield result
+
+
+# ---------------------------------------------------------------------------
+# LLM facade
+# ---------------------------------------------------------------------------
+
+class BatchedLLM:
+    """LLM-like wrapper sending prompts to a local or remote batcher."""
+
+    def __init__(
+        self,
+        batcher: Optional[Batcher] = None,
+        remote: Optional[RemoteBatcher] = None,
+        stream: Optional[StreamFn] = None,
+    ):
+        self.batcher = batcher
+        self.remote = remote
+        self._stream = stream
+
+    def invoke(self, prompt: str) -> str:
+        if self.remote is not None:
+            return self.remote.generate(prompt)
+        return self.batcher.submit(prompt).result()
+
+    async def ainvoke(self, prompt: str) -> str:
+        if self.remote is not None:
+            # Waiting on the socket does not use the CPU executor.
+            return await asyncio.get_running_loop().run_in_executor(None, self.remote.generate, prompt)
+        return await asyncio.wrap_future(self.batcher.submit(prompt))
+
+    def batch(self, prompts: Sequence[str]) -> List[str]:
+        if self.remote is not None:
+            return [self.remote.generate(prompt) for prompt in prompts]
+        futures = [self.batcher.submit(prompt) for prompt in prompts]
+        return [future.result() for future in futures]
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        if self.remote is not None:
+            return self.remote.stream(prompt)
+        if self._stream is None:
+            return iter([self.invoke(prompt)])
+        return self._stream(prompt)
+
+
+def authkey() -> bytes:
+    return (settings.HF_GENERATION_SERVER_AUTHKEY or settings.SECRET_KEY).encode('utf-8')
+
+
+def batcher_from_settings(llm) -> Batcher:
+    return Batcher(
+        pipeline_generate(llm),
+        max_batch_size=settings.HF_BATCH_MAX_SIZE,
+        max_wait=settings.HF_BATCH_MAX_WAIT_MS / 1000,
+    )
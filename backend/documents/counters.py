@@ -0,0 +1,27 @@
+"""Monotonic counters kept in the shared Django cache.
+
+With a Redis or database ``CACHE_URL`` every worker process increments the
+same counters, so the figures cover the whole deployment.
+"""
+from typing import Dict, Iterable
+
+from django.core.cache import cache
+
+PREFIX = 'counter:'
+
+
+def incr(name: str, delta: int = 1) -> None:
+    key = PREFIX + name
+    # ``add`` is a no-op when the counter exists; ``incr`` is atomic on Redis
+    # and DB backends.
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, timeout=None)
+
+
+def get_many(names: Iterable[str]) -> Dict[str, int]:
+    names = list(names)
+    values = cache.get_many([PREFIX + name for name in names])
+    return {name: values.get(PREFIX + name, 0) for name in names}
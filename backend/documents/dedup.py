@@ -0,0 +1,69 @@
+"""Reuse of work across identical uploads.
+
+Uploads are identified by the SHA-256 of the file (``Document.content_hash``,
+computed by ``HashingUploadHandler`` while the file streams in).  A repeat
+upload points at the stored copy of the earlier file instead of writing a new
+one, and ingestion copies the earlier document's extracted text and chunks
+instead of extracting and embedding again.
+"""
+from typing import Any, Dict, Optional
+
+from . import counters
+from .models import Document
+
+UPLOADS = 'dedup.uploads'
+UPLOAD_HITS = 'dedup.upload_hits'
+CHUNKS_REUSED = 'dedup.chunks_reused'
+
+
+def find_duplicate(content_hash: str) -> Optional[Document]:
+    """Return an earlier document with the same file contents, if any."""
+    if not content_hash:
+        return None
+    return (
+        Document.objects.filter(content_hash=content_hash)
+        .exclude(file='')
+        .order_by('id')
+        .only('id', 'file')
+        .first()
+    )
+
+
+def processed_source(document: Document) -> Optional[Document]:
+    """Return an already processed document with the same file contents."""
+    if not document.content_hash:
+        return None
+    return (
+        Document.objects.filter(content_hash=document.content_hash, chunks_version__gt=0)
+        .exclude(pk=document.pk)
+        .defer('embedding', 'lexical_index')
+        .order_by('-updated_at')
+        .first()
+    )
+
+
+def record_upload(duplicate: bool) -> None:
+    counters.incr(UPLOADS)
+    if duplicate:
+        counters.incr(UPLOAD_HITS)
+
+
+def record_reuse(chunk_count: int) -> None:
+    counters.incr(CHUNKS_REUSED, chunk_count)
+
+
+def stats() -> Dict[str, Any]:
+    # embedding pulls in NumPy; keep it out of the upload path's imports.
+    from .embedding import cache_stats as embedding_cache_stats
+
+    counts = counters.get_many([UPLOADS, UPLOAD_HITS, CHUNKS_REUSED])
+    embedding_cache = embedding_cache_stats()
+    return {
+        'uploads': counts[UPLOADS],
+        'duplicate_uploads': counts[UPLOAD_HITS],
+        'upload_hit_rate': counts[UPLOAD_HITS] / counts[UPLOADS] if counts[UPLOADS] else 0.0,
+        'chunks_reused': counts[CHUNKS_REUSED],
+        'embedding_cache': embedding_cache,
+        # Every reused chunk or cache hit is one embedding not computed.
+        'embeddings_saved': counts[CHUNKS_REUSED] + embedding_cache['embeddings_saved'],
+    }
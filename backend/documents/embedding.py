@@ -0,0 +1,191 @@
+"""Batched embedding of document chunks.
+
+Ingestion used to call ``embed_query`` once per chunk, i.e. one forward pass
+per chunk.  The helpers here feed the underlying sentence-transformers encoder
+whole batches instead and can optionally overlap encoding of one batch with
+producing (splitting) the next one.
+"""
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import counters, inference, model_registry
+from .models import ChunkEmbedding
+
+logger = logging.getLogger(__name__)
+
+CACHE_HITS = 'embedding_cache.hits'
+CACHE_MISSES = 'embedding_cache.misses'
+
+
+def get_encoder():
+    """Return the sentence-transformers model behind the shared embeddings."""
+    embeddings = model_registry.get_embeddings()
+    # ``HuggingFaceEmbeddings`` keeps the SentenceTransformer on ``client``.
+    return getattr(embeddings, 'client', embeddings)
+
+
+def encode(texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+    """Embed ``texts`` in one call and return a ``(len(texts), dim)`` float32 array."""
+    batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+    encoder = get_encoder()
+    if hasattr(encoder, 'encode'):
+        vectors = encoder.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+    else:
+        # Plain LangChain embeddings object without a sentence-transformers client.
+        vectors = encoder.embed_documents(texts)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def iter_batches(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def cache_model_name() -> str:
+    """The ``ChunkEmbedding.model_name`` of vectors from the current encoder.
+
+    Quantized and ONNX backends produce slightly different vectors than
+    full-precision PyTorch, so each backend gets its own cache entries.
+    """
+    return f"{settings.EMBEDDING_MODEL_NAME}@{inference.resolve_backend()}"
+
+
+def prune_cache(max_age_days: Optional[float] = None, other_models: bool = False) -> int:
+    """Delete cached embeddings older than ``max_age_days`` (``EMBEDDING_CACHE_TTL_DAYS``).
+
+    With ``other_models``, entries of other models or backends go too.
+    Chunks keep their own copy of the vector, so this only costs cache hits.
+    Returns the number of entries deleted.
+    """
+    if max_age_days is None:
+        max_age_days = settings.EMBEDDING_CACHE_TTL_DAYS
+    stale = ChunkEmbedding.objects.none()
+    if max_age_days > 0:
+        cutoff = timezone.now() - timedelta(days=max_age_days)
+        stale = ChunkEmbedding.objects.filter(created_at__lt=cutoff)
+    if other_models:
+        stale = stale | ChunkEmbedding.objects.exclude(model_name=cache_model_name())
+    deleted, _ = stale.delete()
+    if deleted:
+        logger.info(f"Pruned {deleted} cached chunk embedding(s)")
+    return deleted
+
+
+class _Batch:
+    """A batch of texts whose cached vectors are known and misses are pending."""
+
+    def __init__(self, texts: List[str], use_cache: bool):
+        self.texts = texts
+        self.hashes = [text_hash(text) for text in texts] if use_cache else None
+        self.vectors: Dict[str, np.ndarray] = {}
+        if use_cache:
+            self.model_name = cache_model_name()
+            self.vectors = dict(
+                ChunkEmbedding.objects.filter(
+                    model_name=self.model_name,
+                    text_hash__in=set(self.hashes),
+                ).values_list('text_hash', 'embedding')
+            )
+            # Identical texts within the batch are encoded once.
+            self.missing = list(dict.fromkeys(
+                text for text, digest in zip(texts, self.hashes) if digest not in self.vectors
+            ))
+        else:
+            self.missing = texts
+
+    def finish(self, encoded: Optional[np.ndarray]) -> np.ndarray:
+        if self.hashes is None:
+            return encoded
+        if self.missing:
+            new = dict(zip((text_hash(text) for text in self.missing), encoded))
+            ChunkEmbedding.objects.bulk_create(
+                [
+                    ChunkEmbedding(text_hash=digest, model_name=self.model_name, embedding=vector)
+                    for digest, vector in new.items()
+                ],
+                ignore_conflicts=True,
+            )
+            self.vectors.update(new)
+        counters.incr(CACHE_HITS, len(self.texts) - len(self.missing))
+        counters.incr(CACHE_MISSES, len(self.missing))
+        return np.stack([self.vectors[digest] for digest in self.hashes]).astype(np.float32, copy=False)
+
+
+def _finish(batch: _Batch, future) -> Tuple[List[str], np.ndarray]:
+    return batch.texts, batch.finish(future.result() if future is not None else None)
+
+
+def embed_texts(
+    texts: Iterable[str],
+    batch_size: Optional[int] = None,
+    stream: Optional[bool] = None,
+    use_cache: Optional[bool] = None,
+) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """Yield ``(batch_texts, batch_vectors)`` pairs for ``texts``.
+
+    ``texts`` may be a lazy iterator (e.g. a text splitter generator).  With
+    ``stream`` enabled a batch is encoded on a helper thread while the next
+    batch is being pulled from ``texts``; the encoder releases the GIL during
+    the forward pass, so splitting and embedding overlap.
+
+    With ``use_cache`` (``EMBEDDING_CACHE_ENABLED``) texts that were embedded
+    before, in any document, by the same model and inference backend reuse
+    the vector stored in ``ChunkEmbedding`` and only new texts are encoded.  Cache reads and writes stay on the
+    calling thread.
+    """
+    batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+    if stream is None:
+        stream = settings.EMBEDDING_STREAMING
+    if use_cache is None:
+        use_cache = settings.EMBEDDING_CACHE_ENABLED
+
+    if not stream:
+        for texts_batch in iter_batches(texts, batch_size):
+            batch = _Batch(texts_batch, use_cache)
+            encoded = encode(batch.missing, batch_size) if batch.missing else None
+            yield batch.texts, batch.finish(encoded)
+        return
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='embed') as pool:
+        pending = None
+        for texts_batch in iter_batches(texts, batch_size):
+            batch = _Batch(texts_batch, use_cache)
+            future = pool.submit(encode, batch.missing, batch_size) if batch.missing else None
+            if pending is not None:
+                yield _finish(*pending)
+            pending = (batch, future)
+        if pending is not None:
+            yield _finish(*pending)
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Embedding cache hits, i.e. chunk embeddings that were not computed."""
+    counts = counters.get_many([CACHE_HITS, CACHE_MISSES])
+    lookups = counts[CACHE_HITS] + counts[CACHE_MISSES]
+    return {
+        'hits': counts[CACHE_HITS],
+        'misses': counts[CACHE_MISSES],
+        'hit_rate': counts[CACHE_HITS] / lookups if lookups else 0.0,
+        'embeddings_saved': counts[CACHE_HITS],
+    }
@@ -0,0 +1,95 @@
+"""Page-by-page text extraction for uploaded documents.
+
+Extractors are generators of ``(page_number, text)`` pairs (1-based page
+numbers) so the splitter and the embedder can start on the first pages while
+later ones are still being extracted.  Large PDFs are split into page ranges
+that are extracted in a process pool; ranges are yielded in page order.
+
+This module deliberately imports nothing from Django: pool workers are
+started with ``spawn`` and only need PyPDF2.
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Page = Tuple[int, str]
+
+
+def pdf_page_count(file_path: str) -> int:
+    import PyPDF2
+
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def extract_pdf_range(file_path: str, start: int, stop: int) -> List[str]:
+    """Return the text of pages ``start`` to ``stop - 1`` (0-based)."""
+    import PyPDF2
+
+    with open(file_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        return [reader.pages[i].extract_text() or '' for i in range(start, stop)]
+
+
+def iter_pdf_pages(file_path: str, processes: int = 1, min_parallel_pages: int = 64,
+                   pages_per_task: int = 32) -> Iterator[Page]:
+    """Yield the pages of a PDF, extracting in ``processes`` workers if it is
+    at least ``min_parallel_pages`` long."""
+    import PyPDF2
+
+    with open(file_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        page_count = len(reader.pages)
+        if processes <= 1 or page_count < min_parallel_pages:
+            for number, page in enumerate(reader.pages, start=1):
+                yield number, page.extract_text() or ''
+            return
+
+    ranges = [
+        (start, min(start + pages_per_task, page_count))
+        for start in range(0, page_count, pages_per_task)
+    ]
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(processes, len(ranges)), mp_context=context) as pool:
+        # ``map`` keeps every range in flight but yields them in order, so the
+        # first pages reach the splitter as soon as their range is done.
+        results = pool.map(
+            extract_pdf_range,
+            [file_path] * len(ranges),
+            [start for start, _ in ranges],
+            [stop for _, stop in ranges],
+        )
+        for (start, _), texts in zip(ranges, results):
+            for offset, text in enumerate(texts):
+                yield start + offset + 1, text
+
+
+def iter_docx_pages(file_path: str) -> Iterator[Page]:
+    """Yield DOCX text grouped by page.
+
+    Word files carry no layout, so page numbers only follow explicit page
+    breaks; a paragraph containing one starts the next page.
+    """
+    from docx import Document as DocxDocument
+
+    doc = DocxDocument(file_path)
+    number = 1
+    paragraphs = []
+    for paragraph in doc.paragraphs:
+        if paragraphs and paragraph._p.xpath('.//w:br[@w:type="page"]'):
+            yield number, '\n'.join(paragraphs)
+            number += 1
+            paragraphs = []
+        paragraphs.append(paragraph.text)
+    if paragraphs:
+        yield number, '\n'.join(paragraphs)
+
+
+def default_processes(configured: Optional[int] = None) -> int:
+    if configured:
+        return configured
+    return min(4, os.cpu_count() or 1)
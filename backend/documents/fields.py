@@ -0,0 +1,100 @@
+import base64
+from typing import TYPE_CHECKING
+
+from django.core.exceptions import ValidationError
+from django.db import models
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+class VectorField(models.BinaryField):
+    """Store a 1-D numeric vector as packed little-endian bytes.
+
+    ``dtype`` selects the on-disk format:
+
+    * ``float32`` – raw float32 values (4 bytes per dimension).
+    * ``float16`` – raw float16 values (2 bytes per dimension).
+    * ``int8``    – a float32 scale followed by symmetric int8 codes
+      (1 byte per dimension plus 4 bytes).
+
+    Values read from the database are NumPy arrays.  For ``float32`` and
+    ``float16`` they are zero-copy, read-only views over the fetched bytes;
+    ``int8`` vectors are dequantised into a new float32 array.  Lists, tuples
+    and arrays are accepted on assignment.  NumPy is imported on first use so
+    loading the models does not require it.
+    """
+
+    description = "Packed numeric vector"
+    DTYPES = {
+        'float32': '<f4',
+        'float16': '<f2',
+        'int8': 'i1',
+    }
+
+    def __init__(self, *args, dtype='float32', **kwargs):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported vector dtype '{dtype}'. Choose one of: {', '.join(self.DTYPES)}")
+        self.dtype = dtype
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dtype != 'float32':
+            kwargs['dtype'] = self.dtype
+        return name, path, args, kwargs
+
+    # -- encoding ----------------------------------------------------------
+
+    def encode(self, value) -> bytes:
+        import numpy as np
+
+        vector = np.asarray(value, dtype=np.float32).reshape(-1)
+        if self.dtype == 'int8':
+            peak = float(np.abs(vector).max()) if vector.size else 0.0
+            scale = peak / 127.0 if peak else 1.0
+            codes = np.clip(np.rint(vector / scale), -127, 127).astype(self.DTYPES['int8'])
+            return np.float32(scale).astype('<f4').tobytes() + codes.tobytes()
+        return vector.astype(self.DTYPES[self.dtype], copy=False).tobytes()
+
+    def decode(self, data) -> 'np.ndarray':
+        import numpy as np
+
+        if self.dtype == 'int8':
+            scale = np.frombuffer(data, dtype='<f4', count=1)[0]
+            codes = np.frombuffer(data, dtype=self.DTYPES['int8'], offset=4)
+            return codes.astype(np.float32) * scale
+        return np.frombuffer(data, dtype=self.DTYPES[self.dtype])
+
+    # -- Django field API --------------------------------------------------
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return self.decode(value)
+
+    def to_python(self, value):
+        import numpy as np
+
+        if value is None or isinstance(value, np.ndarray):
+            return value
+        if isinstance(value, str):
+            # Serialized form produced by ``value_to_string`` (dumpdata).
+            return self.decode(base64.b64decode(value.encode('ascii')))
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return self.decode(value)
+        try:
+            return np.asarray(value, dtype=np.float32).reshape(-1)
+        except (TypeError, ValueError):
+            raise ValidationError(f"'{value!r}' is not a valid vector.")
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is not None and not isinstance(value, (bytes, bytearray, memoryview)):
+            value = self.encode(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        value = self.value_from_object(obj)
+        if value is None:
+            return None
+        return base64.b64encode(self.encode(value)).decode('ascii')
@@ -0,0 +1,91 @@
+"""Per-worker LRU cache of ready-to-search document indexes.
+
+Entries are keyed by document id and tagged with ``Document.chunks_version``;
+``process_document`` bumps that version whenever it rewrites the chunks, so a
+worker holding an older index treats it as a miss on the next lookup.  The
+cache is bounded by the approximate memory held by the indexes, not by the
+number of entries.
+"""
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, Optional
+
+from django.conf import settings
+
+
+if TYPE_CHECKING:
+    from .retrieval import DocumentIndex
+
+
+class IndexCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, document_id: int, version: int) -> Optional['DocumentIndex']:
+        with self._lock:
+            entry = self._entries.get(document_id)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    self._discard(document_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(document_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, document_id: int, version: int, index: 'DocumentIndex') -> None:
+        size = index.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(document_id)
+            self._entries[document_id] = (version, index, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def get_or_build(self, document_id: int, version: int, build: Callable[[], 'DocumentIndex']) -> 'DocumentIndex':
+        index = self.get(document_id, version)
+        if index is None:
+            # Built outside the lock; two threads may race to build the same
+            # index, which is harmless and cheaper than serialising all builds.
+            index = build()
+            if len(index):
+                self.put(document_id, version, index)
+        return index
+
+    def invalidate(self, document_id: int) -> None:
+        with self._lock:
+            self._discard(document_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _discard(self, document_id: int) -> None:
+        entry = self._entries.pop(document_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+index_cache = IndexCache(settings.INDEX_CACHE_MAX_BYTES)
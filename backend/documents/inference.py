@@ -0,0 +1,261 @@
+"""CPU inference backends for the embedding model and the local generator.
+
+``INFERENCE_BACKEND`` selects how all-MiniLM-L6-v2 and Flan-T5 run:
+
+* ``torch``      - full-precision PyTorch (the original setup)
+* ``torch_int8`` - PyTorch with ``nn.Linear`` layers dynamically quantized
+  to int8 at load time; no export step
+* ``onnx``       - ONNX Runtime graphs exported by
+  ``manage.py export_onnx_models`` into ``ONNX_MODEL_DIR``
+* ``onnx_int8``  - the same graphs with int8 dynamically quantized weights
+
+``INFERENCE_INTRA_OP_THREADS`` / ``INFERENCE_INTER_OP_THREADS`` set the
+per-process thread pools of whichever runtime is used (0 keeps the library
+default, usually one thread per core; with several workers per machine set
+them so workers x threads does not exceed the cores).
+
+``embedding_drift`` compares a backend's embeddings with full-precision ones;
+the export command runs it and refuses graphs that drift too far.
+"""
+import logging
+import os
+import shutil
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('torch', 'torch_int8', 'onnx', 'onnx_int8')
+EMBEDDING_MAX_LENGTH = 256  # all-MiniLM-L6-v2 ``max_seq_length``
+DRIFT_SAMPLE_TEXTS = [
+    "The supplier shall notify the customer of any security breach within 48 hours.",
+    "Invoices are payable within thirty days of the invoice date.",
+    "Either party may terminate the agreement for convenience with six months notice.",
+    "Clause 14.3(b) covers termination for material breach.",
+    "Quarterly revenue grew 12 percent, driven by subscription renewals.",
+    "The patient was prescribed 20 mg of atorvastatin once daily.",
+    "How long is the initial term of the contract?",
+    "Who is responsible for data protection under GDPR Article 28?",
+]
+
+_threads_configured = False
+_threads_lock = threading.Lock()
+
+
+def configure_torch_threads() -> None:
+    """Apply the configured thread counts to PyTorch, once per process."""
+    global _threads_configured
+    with _threads_lock:
+        if _threads_configured:
+            return
+        _threads_configured = True
+        import torch
+
+        if settings.INFERENCE_INTRA_OP_THREADS:
+            torch.set_num_threads(settings.INFERENCE_INTRA_OP_THREADS)
+        if settings.INFERENCE_INTER_OP_THREADS:
+            try:
+                torch.set_num_interop_threads(settings.INFERENCE_INTER_OP_THREADS)
+            except RuntimeError as e:
+                # Only possible before PyTorch runs its first parallel op.
+                logger.warning(f"Could not set inter-op threads: {str(e)}")
+
+
+def ort_session_options():
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    if settings.INFERENCE_INTRA_OP_THREADS:
+        options.intra_op_num_threads = settings.INFERENCE_INTRA_OP_THREADS
+    if settings.INFERENCE_INTER_OP_THREADS:
+        options.inter_op_num_threads = settings.INFERENCE_INTER_OP_THREADS
+    return options
+
+
+def onnx_model_dir(model_name: str, quantized: bool = False) -> str:
+    name = model_name.replace('/', '--') + ('-int8' if quantized else '')
+    return os.path.join(settings.ONNX_MODEL_DIR, name)
+
+
+def resolve_backend(backend: Optional[str] = None) -> str:
+    backend = backend or settings.INFERENCE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND '{backend}' (expected one of {', '.join(BACKENDS)})")
+    return backend
+
+
+def exported_model_dir(model_name: str, backend: str) -> str:
+    """The ONNX export of ``model_name`` used by ``backend``.
+
+    Fails with a hint instead of a bare import or file error when ONNX Runtime
+    is not installed or the models were never exported.
+    """
+    try:
+        import optimum.onnxruntime  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            f"INFERENCE_BACKEND '{backend}' needs optimum[onnxruntime]: pip install -r requirements-onnx.txt"
+        ) from e
+    model_dir = onnx_model_dir(model_name, quantized=backend == 'onnx_int8')
+    if not os.path.isdir(model_dir):
+        raise ValueError(
+            f"INFERENCE_BACKEND '{backend}' needs an ONNX export of {model_name} in {model_dir}: "
+            "run python manage.py export_onnx_models"
+        )
+    return model_dir
+
+
+def _quantize_linear(model):
+    import torch
+
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class SentenceEmbedder:
+    """LangChain-style embeddings over an ``encode(texts) -> ndarray`` function.
+
+    Also exposes ``encode`` with the sentence-transformers signature, which is
+    what ``embedding.encode`` calls during ingestion.
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], np.ndarray]):
+        self.encode_batch = encode_batch
+
+    def encode(self, texts: List[str], batch_size: int = 32, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack([
+            self.encode_batch(texts[start:start + batch_size])
+            for start in range(0, len(texts), batch_size)
+        ])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+def _onnx_embedder(model_dir: str) -> SentenceEmbedder:
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = ORTModelForFeatureExtraction.from_pretrained(model_dir, session_options=ort_session_options())
+
+    def encode_batch(texts: List[str]) -> np.ndarray:
+        inputs = tokenizer(texts, padding=True, truncation=True, max_length=EMBEDDING_MAX_LENGTH,
+                           return_tensors='np')
+        hidden = model(**inputs).last_hidden_state
+        hidden = np.asarray(hidden, dtype=np.float32)
+        # sentence-transformers pipeline of this model: mean pooling, then L2 norm.
+        mask = inputs['attention_mask'][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+    return SentenceEmbedder(encode_batch)
+
+
+def load_embeddings(backend: Optional[str] = None):
+    """The embedding model for ``backend`` (default ``INFERENCE_BACKEND``)."""
+    backend = resolve_backend(backend)
+    model_name = settings.EMBEDDING_MODEL_NAME
+    if backend in ('onnx', 'onnx_int8'):
+        return _onnx_embedder(exported_model_dir(model_name, backend))
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    configure_torch_threads()
+    embeddings = HuggingFaceEmbeddings(model_name=model_name)
+    if backend == 'torch_int8':
+        _quantize_linear(embeddings.client)
+    return embeddings
+
+
+def load_generator(backend: Optional[str] = None):
+    """Flan-T5 as a LangChain ``HuggingFacePipeline`` for ``backend``."""
+    backend = resolve_backend(backend)
+    model_name = settings.HF_LLM_MODEL_NAME
+    model_dir = exported_model_dir(model_name, backend) if backend in ('onnx', 'onnx_int8') else None
+
+    from langchain_community.llms import HuggingFacePipeline
+    from transformers import AutoTokenizer
+
+    if model_dir is not None:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        from optimum.pipelines import pipeline
+
+        tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        model = ORTModelForSeq2SeqLM.from_pretrained(model_dir, session_options=ort_session_options())
+        hf_pipeline = pipeline("text2text-generation", model=model, tokenizer=tokenizer,
+                               accelerator="ort", max_length=512)
+        return HuggingFacePipeline(pipeline=hf_pipeline)
+
+    from transformers import AutoModelForSeq2SeqLM, pipeline
+
+    configure_torch_threads()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    if backend == 'torch_int8':
+        _quantize_linear(model)
+    hf_pipeline = pipeline(
+        "text2text-generation",
+        model=model,
+        tokenizer=tokenizer,
+        max_length=512,
+    )
+    return HuggingFacePipeline(pipeline=hf_pipeline)
+
+
+def export_onnx(model: str, quantize: bool = True) -> List[str]:
+    """Export ``model`` ('embeddings' or 'generator') to ONNX; return the directories written."""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTModelForSeq2SeqLM
+    from transformers import AutoTokenizer
+
+    if model == 'embeddings':
+        model_name, model_class = settings.EMBEDDING_MODEL_NAME, ORTModelForFeatureExtraction
+    else:
+        model_name, model_class = settings.HF_LLM_MODEL_NAME, ORTModelForSeq2SeqLM
+    target = onnx_model_dir(model_name)
+    model_class.from_pretrained(model_name, export=True).save_pretrained(target)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(target)
+    written = [target]
+    if quantize:
+        written.append(quantize_onnx_dir(target, onnx_model_dir(model_name, quantized=True)))
+    return written
+
+
+def quantize_onnx_dir(source: str, target: str) -> str:
+    """Copy an exported model directory with every graph int8-quantized."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(target, exist_ok=True)
+    for name in os.listdir(source):
+        path = os.path.join(source, name)
+        if name.endswith('.onnx'):
+            quantize_dynamic(path, os.path.join(target, name), weight_type=QuantType.QInt8)
+        elif os.path.isfile(path):
+            shutil.copy2(path, os.path.join(target, name))
+    return target
+
+
+def cosine_similarities(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    return (a * b).sum(axis=1)
+
+
+def embedding_drift(backend: str, texts: Optional[List[str]] = None, reference=None) -> Dict[str, float]:
+    """Cosine similarity of ``backend`` embeddings to full-precision PyTorch ones."""
+    texts = texts or DRIFT_SAMPLE_TEXTS
+    reference = reference or load_embeddings('torch')
+    expected = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    actual = np.asarray(load_embeddings(backend).embed_documents(texts), dtype=np.float32)
+    cosines = cosine_similarities(expected, actual)
+    return {'mean_cosine': float(cosines.mean()), 'min_cosine': float(cosines.min())}
@@ -0,0 +1,236 @@
+"""Database-backed ingestion queue.
+
+Uploads enqueue an ``IngestionJob`` row and return immediately; one or more
+``manage.py ingest_worker`` processes claim jobs, run ``process_document`` and
+record the outcome on the job, where ``DocumentViewSet.status`` reads it.
+
+Claiming is a compare-and-set ``UPDATE`` (plus ``SELECT ... FOR UPDATE SKIP
+LOCKED`` where the database supports it), so any number of workers can share
+the queue.  Failed jobs are retried with exponential backoff, and jobs left
+``running`` by a worker that died are handed back to the queue once their lock
+is older than ``INGESTION_JOB_TIMEOUT``; live workers refresh that lock while
+they run.  A worker only records the outcome of a job it still holds.
+
+A document has at most one active (pending or running) job: ``enqueue``
+returns the active job instead of adding another, and ``claim_next`` never
+starts a job for a document that already has one running.
+"""
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Optional
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import Document, IngestionJob
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+ACTIVE_STATUSES = (IngestionJob.PENDING, IngestionJob.RUNNING)
+
+
+def enqueue(document: Document) -> IngestionJob:
+    """Queue ``document`` for processing unless a job is already waiting to.
+
+    A pending job reads the document's current file when it runs, so it
+    covers this request too.  A running job may have read an older file, so
+    one follow-up job is queued behind it; ``claim_next`` holds it until the
+    running job has finished.
+    """
+    job = document.ingestion_jobs.filter(status=IngestionJob.PENDING).order_by('-created_at', '-id').first()
+    if job is not None:
+        return job
+    return IngestionJob.objects.create(
+        document=document,
+        max_attempts=settings.INGESTION_MAX_ATTEMPTS,
+    )
+
+
+def latest_job(document: Document) -> Optional[IngestionJob]:
+    return document.ingestion_jobs.order_by('-created_at', '-id').first()
+
+
+def queue_depth() -> int:
+    return IngestionJob.objects.filter(status__in=ACTIVE_STATUSES).count()
+
+
+def retry_delay(attempts: int) -> timedelta:
+    seconds = settings.INGESTION_RETRY_BACKOFF * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(seconds, settings.INGESTION_RETRY_BACKOFF_MAX))
+
+
+def claim_next(worker: Optional[str] = None) -> Optional[IngestionJob]:
+    """Atomically claim the next runnable job, or return ``None``."""
+    worker = worker or worker_name()
+    # Documents are ingested by one job at a time.
+    busy = IngestionJob.objects.filter(status=IngestionJob.RUNNING).values('document_id')
+    while True:
+        with transaction.atomic():
+            candidates = IngestionJob.objects.filter(
+                status=IngestionJob.PENDING,
+                run_after__lte=timezone.now(),
+            ).exclude(document_id__in=busy).order_by('run_after', 'id')
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            job = candidates.first()
+            if job is None:
+                return None
+
+            # Compare-and-set keeps this safe on databases without row locks.
+            claimed = IngestionJob.objects.filter(pk=job.pk, status=IngestionJob.PENDING).exclude(
+                document_id__in=busy,
+            ).update(
+                status=IngestionJob.RUNNING,
+                attempts=job.attempts + 1,
+                locked_by=worker,
+                locked_at=timezone.now(),
+            )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def recover_stale_jobs() -> int:
+    """Requeue jobs whose worker stopped heartbeating (crashed or was killed).
+
+    A worker that dies takes no exception path, so this is where such a job
+    is retried with backoff, or failed once it has used up its attempts: a
+    document that kills every worker must not keep cycling through the pool.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.INGESTION_JOB_TIMEOUT)
+    stale = IngestionJob.objects.filter(status=IngestionJob.RUNNING, locked_at__lt=cutoff)
+    recovered = 0
+    for job in stale.only('pk', 'document_id', 'attempts', 'max_attempts', 'locked_by', 'locked_at'):
+        error = f"Worker {job.locked_by} died or stopped responding (attempt {job.attempts})"
+        owned = IngestionJob.objects.filter(pk=job.pk, status=IngestionJob.RUNNING, locked_at=job.locked_at)
+        if job.attempts >= job.max_attempts:
+            if owned.update(status=IngestionJob.FAILED, locked_at=None, last_error=error):
+                metrics.INGESTION_JOBS.inc(outcome='failed')
+                logger.error(f"Job {job.pk} for document {job.document_id} failed: {error}")
+                notify(job.document_id, 'error', error)
+            continue
+        recovered += owned.update(
+            status=IngestionJob.PENDING,
+            locked_by='',
+            locked_at=None,
+            run_after=timezone.now() + retry_delay(job.attempts),
+            last_error=error,
+        )
+    if recovered:
+        logger.warning(f"Requeued {recovered} stale ingestion job(s)")
+    return recovered
+
+
+@contextmanager
+def heartbeat(job: IngestionJob):
+    """Keep ``job.locked_at`` fresh from a helper thread while the body runs."""
+    stop = threading.Event()
+    interval = max(settings.INGESTION_JOB_TIMEOUT / 3, 1)
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                _owned(job).update(locked_at=timezone.now())
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, name=f"ingest-heartbeat-{job.pk}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _owned(job: IngestionJob):
+    """``job`` as long as this worker still holds it (not requeued or reclaimed)."""
+    return IngestionJob.objects.filter(pk=job.pk, status=IngestionJob.RUNNING, locked_by=job.locked_by)
+
+
+def _lost(job: IngestionJob) -> None:
+    metrics.INGESTION_JOBS.inc(outcome='lost')
+    logger.warning(f"Job {job.pk} for document {job.document_id} was taken from {job.locked_by}; "
+                   f"not recording its outcome")
+
+
+def run_job(job: IngestionJob) -> None:
+    """Process the job's document and record success, retry or failure."""
+    try:
+        with heartbeat(job):
+            # Imported here so the web process never loads the ingestion stack.
+            from .processors import process_document
+
+            process_document(job.document_id)
+    except Exception as e:
+        logger.error(f"Error processing document {job.document_id} (attempt {job.attempts}): {str(e)}")
+        if job.attempts < job.max_attempts:
+            updated = _owned(job).update(
+                status=IngestionJob.PENDING,
+                run_after=timezone.now() + retry_delay(job.attempts),
+                locked_by='',
+                locked_at=None,
+                last_error=str(e),
+            )
+            if updated:
+                metrics.INGESTION_JOBS.inc(outcome='retry')
+            else:
+                _lost(job)
+        else:
+            updated = _owned(job).update(
+                status=IngestionJob.FAILED,
+                locked_at=None,
+                last_error=str(e),
+            )
+            if updated:
+                metrics.INGESTION_JOBS.inc(outcome='failed')
+                notify(job.document_id, 'error', str(e))
+            else:
+                _lost(job)
+        return
+
+    updated = _owned(job).update(
+        status=IngestionJob.COMPLETED,
+        locked_at=None,
+        last_error='',
+    )
+    if not updated:
+        _lost(job)
+        return
+    metrics.INGESTION_JOBS.inc(outcome='completed')
+    notify(job.document_id, 'completed')
+
+
+def notify(document_id: int, status: str, error: Optional[str] = None) -> None:
+    """Tell the uploader over Channels that processing finished."""
+    from channels.layers import get_channel_layer
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    owner_id = Document.objects.filter(pk=document_id).values_list('uploaded_by_id', flat=True).first()
+    if not owner_id:
+        return
+    message = {
+        "type": "document.processed",
+        "document_id": document_id,
+        "status": status,
+    }
+    if error is not None:
+        message["error"] = error
+    try:
+        async_to_sync(channel_layer.group_send)(f"user_{owner_id}", message)
+    except Exception as e:
+        logger.warning(f"Failed to notify user {owner_id} about document {document_id}: {e}")
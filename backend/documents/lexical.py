@@ -0,0 +1,198 @@
+"""BM25 keyword retrieval over document chunks.
+
+Embedding similarity is poor at exact identifiers (clause numbers, invoice
+ids, names), so queries are also matched lexically and the two rankings are
+fused (see ``DocumentIndex.hybrid_search``).  Two backends:
+
+* ``bm25``     - a per-document inverted index built at ingestion time and
+  stored compressed in ``Document.lexical_index``; queries score it in memory.
+* ``postgres`` - Postgres full-text search over a GIN index on
+  ``to_tsvector(content)`` (created by migration 0011 on Postgres only).
+
+``LEXICAL_BACKEND = 'auto'`` picks ``postgres`` when the database is Postgres.
+"""
+import io
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from .models import Document, DocumentChunk
+from .retrieval import top_k
+
+# Identifiers such as "4.2.1", "INV-2023-001" or "a/b" stay one token; their
+# parts are indexed as well so "2023" still matches.
+TOKEN_RE = re.compile(r"\w+(?:[.\-/]\w+)*")
+PART_RE = re.compile(r"[.\-/]")
+STOPWORDS = frozenset(
+    'a an and are as at be by for from has have in is it its of on or that the this to was '
+    'were what when where which who will with does do did how'.split()
+)
+BM25_K1 = 1.2
+BM25_B = 0.75
+POSTGRES_CONFIG = 'english'
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token not in STOPWORDS:
+            tokens.append(token)
+        parts = PART_RE.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part and part not in STOPWORDS)
+    return tokens
+
+
+class LexicalIndex:
+    """Okapi BM25 over one document's chunks, as CSR posting lists.
+
+    Row ``i`` of the index is the chunk with ``chunk_indexes[i]``; postings of
+    term ``t`` are ``rows[offsets[t]:offsets[t + 1]]`` with matching ``tfs``.
+    """
+
+    def __init__(self, terms: Sequence[str], offsets, rows, tfs, lengths, chunk_indexes, version: int = 0):
+        self.vocabulary: Dict[str, int] = {term: i for i, term in enumerate(terms)}
+        self.terms = list(terms)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.tfs = np.asarray(tfs, dtype=np.float32)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.chunk_indexes = np.asarray(chunk_indexes, dtype=np.int64)
+        self.version = version
+        self.avg_length = float(self.lengths.mean()) if len(self.lengths) else 0.0
+
+    @classmethod
+    def build(cls, texts: Iterable[str], chunk_indexes: Optional[Sequence[int]] = None, version: int = 0):
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((row, tf))
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        rows, tfs = [], []
+        for i, term in enumerate(terms):
+            for row, tf in postings[term]:
+                rows.append(row)
+                tfs.append(tf)
+            offsets[i + 1] = len(rows)
+        if chunk_indexes is None:
+            chunk_indexes = range(len(lengths))
+        return cls(terms, offsets, rows, tfs, lengths, list(chunk_indexes), version)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    @property
+    def nbytes(self) -> int:
+        return (self.offsets.nbytes + self.rows.nbytes + self.tfs.nbytes + self.lengths.nbytes
+                + self.chunk_indexes.nbytes + sum(len(term) for term in self.terms))
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not len(self):
+            return scores
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / self.avg_length)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            rows, tfs = self.rows[start:stop], self.tfs[start:stop]
+            df = stop - start
+            idf = math.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[rows])
+        return scores
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(rows, scores)`` of the ``k`` best matching chunks, best first.
+
+        Chunks that share no term with the query are left out.
+        """
+        scores = self.scores(query)
+        rows = top_k(scores, k)
+        rows = rows[scores[rows] > 0]
+        return rows, scores[rows]
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            terms=np.frombuffer('\n'.join(self.terms).encode('utf-8'), dtype=np.uint8),
+            offsets=self.offsets.astype(np.uint32),
+            rows=self.rows.astype(np.uint32),
+            tfs=self.tfs.astype(np.uint16),
+            lengths=self.lengths.astype(np.uint32),
+            chunk_indexes=self.chunk_indexes.astype(np.uint32),
+            version=np.array([self.version], dtype=np.int64),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'LexicalIndex':
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            terms = arrays['terms'].tobytes().decode('utf-8')
+            return cls(
+                terms.split('\n') if terms else [],
+                arrays['offsets'], arrays['rows'], arrays['tfs'], arrays['lengths'],
+                arrays['chunk_indexes'], int(arrays['version'][0]),
+            )
+
+
+def backend() -> str:
+    configured = settings.LEXICAL_BACKEND
+    if configured == 'auto':
+        return 'postgres' if connection.vendor == 'postgresql' else 'bm25'
+    return configured
+
+
+def build_for_document(document_id: int, version: int) -> None:
+    """Rebuild and store the BM25 index of a document (``bm25`` backend only)."""
+    if backend() != 'bm25':
+        return
+    chunks = DocumentChunk.objects.filter(document_id=document_id).order_by('chunk_index')
+    chunk_indexes, texts = [], []
+    for chunk_index, content in chunks.values_list('chunk_index', 'content').iterator():
+        chunk_indexes.append(chunk_index)
+        texts.append(content)
+    index = LexicalIndex.build(texts, chunk_indexes, version)
+    Document.objects.filter(pk=document_id).update(lexical_index=index.to_bytes())
+
+
+def load_for_document(document: Document) -> Optional[LexicalIndex]:
+    """The stored index of ``document`` if it matches its current chunks."""
+    data = Document.objects.filter(pk=document.pk).values_list('lexical_index', flat=True).first()
+    if not data:
+        return None
+    index = LexicalIndex.from_bytes(bytes(data))
+    return index if index.version == document.chunks_version else None
+
+
+def postgres_search(document_id: int, query: str, k: int) -> List[int]:
+    """Chunk ids of the ``k`` best full-text matches, best first (Postgres only)."""
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+    tokens = sorted(set(tokenize(query)))
+    if not tokens:
+        return []
+    # Any query term may match (OR), unlike websearch/plain queries which
+    # require all of them.
+    search_query = SearchQuery(
+        ' | '.join(f"'{token}'" for token in tokens), config=POSTGRES_CONFIG, search_type='raw'
+    )
+    vector = SearchVector('content', config=POSTGRES_CONFIG)
+    return list(
+        DocumentChunk.objects.filter(document_id=document_id)
+        .annotate(search=vector)
+        .filter(search=search_query)
+        .annotate(rank=SearchRank(vector, search_query))
+        .order_by('-rank', 'chunk_index')
+        .values_list('id', flat=True)[:k]
+    )
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from documents import inference
+
+
+class Command(BaseCommand):
+    help = "Export the embedding model and Flan-T5 to ONNX (plus int8 quantized copies) for INFERENCE_BACKEND=onnx/onnx_int8."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', default='embeddings,generator',
+                            help='Comma-separated subset of: embeddings, generator')
+        parser.add_argument('--no-quantize', action='store_true', help='Skip the int8 copies')
+
+    def handle(self, *args, **options):
+        models = [name.strip() for name in options['models'].split(',') if name.strip()]
+        unknown = set(models) - {'embeddings', 'generator'}
+        if unknown:
+            raise CommandError(f"Unknown models: {', '.join(sorted(unknown))}")
+        try:
+            import optimum.onnxruntime  # noqa: F401
+        except ImportError:
+            raise CommandError("ONNX export needs optimum[onnxruntime]: pip install -r requirements-onnx.txt")
+
+        for model in models:
+            for directory in inference.export_onnx(model, quantize=not options['no_quantize']):
+                self.stdout.write(f"Exported {model} to {directory}")
+
+        if 'embeddings' in models:
+            reference = inference.load_embeddings('torch')
+            backends = ['onnx'] if options['no_quantize'] else ['onnx', 'onnx_int8']
+            for backend in backends:
+                drift = inference.embedding_drift(backend, reference=reference)
+                message = (f"{backend} embeddings vs fp32: mean cosine {drift['mean_cosine']:.4f}, "
+                           f"min {drift['min_cosine']:.4f}")
+                if drift['min_cosine'] < settings.INFERENCE_MIN_COSINE:
+                    raise CommandError(f"{message} (below INFERENCE_MIN_COSINE={settings.INFERENCE_MIN_COSINE})")
+                self.stdout.write(self.style.SUCCESS(message))
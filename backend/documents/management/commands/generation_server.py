@@ -0,0 +1,35 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from documents import batching, model_registry
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Serve the local Flan-T5 model to web workers with dynamic request batching (HF_BATCHING=server)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', default=settings.HF_GENERATION_SERVER_ADDRESS,
+                            help='host:port or Unix socket path (default: HF_GENERATION_SERVER_ADDRESS)')
+        parser.add_argument('--max-batch-size', type=int, default=settings.HF_BATCH_MAX_SIZE)
+        parser.add_argument('--max-wait-ms', type=float, default=settings.HF_BATCH_MAX_WAIT_MS)
+
+    def handle(self, *args, **options):
+        # The server owns the model itself; never proxy to another server.
+        llm = model_registry.load_hf_pipeline()
+        batcher = batching.Batcher(
+            batching.pipeline_generate(llm),
+            max_batch_size=options['max_batch_size'],
+            max_wait=options['max_wait_ms'] / 1000,
+        )
+        self.stdout.write(
+            f"Serving {settings.HF_LLM_MODEL_NAME} on {options['address']} "
+            f"(batches of up to {options['max_batch_size']}, {options['max_wait_ms']}ms wait)"
+        )
+        try:
+            batching.serve(batcher, options['address'], batching.authkey(), stream=batching.pipeline_stream(llm))
+        except KeyboardInterrupt:
+            self.stdout.write("Generation server stopped")
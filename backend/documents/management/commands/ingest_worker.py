@@ -0,0 +1,104 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from documents import embedding, jobs
+
+logger = logging.getLogger(__name__)
+
+CACHE_PRUNE_INTERVAL = 3600  # seconds between embedding cache prunes
+
+
+def work(poll_interval: float, once: bool, stop_event=None) -> int:
+    """Claim and run jobs until stopped; return the number of jobs run."""
+    processed = 0
+    last_recovery = 0.0
+    last_prune = 0.0
+    while stop_event is None or not stop_event.is_set():
+        now = time.monotonic()
+        if now - last_recovery > settings.INGESTION_JOB_TIMEOUT / 2:
+            jobs.recover_stale_jobs()
+            last_recovery = now
+        if now - last_prune > CACHE_PRUNE_INTERVAL:
+            embedding.prune_cache()
+            last_prune = now
+
+        job = jobs.claim_next()
+        if job is None:
+            if once:
+                break
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+
+        logger.info(f"Worker {jobs.worker_name()} running job {job.pk} for document {job.document_id}")
+        jobs.run_job(job)
+        processed += 1
+    return processed
+
+
+def _child_main(poll_interval: float, stop_event) -> None:
+    # Let the parent coordinate shutdown; finish the current job first.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    try:
+        work(poll_interval, once=False, stop_event=stop_event)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Run background document ingestion workers that consume the IngestionJob queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.INGESTION_WORKER_PROCESSES,
+                            help='Number of worker processes (default: INGESTION_WORKER_PROCESSES)')
+        parser.add_argument('--poll-interval', type=float, default=settings.INGESTION_POLL_INTERVAL,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue in this process and exit')
+
+    def handle(self, *args, **options):
+        poll_interval = options['poll_interval']
+        if options['once'] or options['processes'] <= 1:
+            processed = work(poll_interval, once=options['once'])
+            self.stdout.write(f"Processed {processed} job(s)")
+            return
+
+        # Children must not inherit the parent's database connections.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        stop_event = context.Event()
+
+        def spawn():
+            process = context.Process(target=_child_main, args=(poll_interval, stop_event), daemon=False)
+            process.start()
+            return process
+
+        def shutdown(*_):
+            stop_event.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        processes = [spawn() for _ in range(options['processes'])]
+        self.stdout.write(f"Started {len(processes)} ingestion worker process(es)")
+        while not stop_event.is_set():
+            # Replace children that died (e.g. OOM-killed mid-document); their
+            # job is requeued by recover_stale_jobs once its lock expires.
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    logger.warning(f"Ingestion worker {process.pid} exited with {process.exitcode}; restarting")
+                    processes[i] = spawn()
+            stop_event.wait(1.0)
+
+        for process in processes:
+            process.join()
+        self.stdout.write("Ingestion workers stopped")
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from documents import profiling, qa
+from documents.index_cache import index_cache
+from documents.models import Document
+
+DEFAULT_QUESTIONS = [
+    "What is this document about?",
+    "What are the key dates and deadlines?",
+    "Who are the parties involved?",
+]
+
+
+class Command(BaseCommand):
+    help = "Profile the query pipeline against one document and write the profile to PROFILING_DIR."
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_id', type=int)
+        parser.add_argument('--query', action='append', dest='queries',
+                            help='Question to ask (repeatable; default: a few generic ones)')
+        parser.add_argument('--repeat', type=int, default=5, help='Times to ask each question')
+        parser.add_argument('--mode', choices=['sampling', 'cprofile'], default=None,
+                            help='Default: PROFILING_MODE')
+        parser.add_argument('--generate', action='store_true',
+                            help='Also call the LLM (default: stop after retrieval and prompt building)')
+        parser.add_argument('--cold', action='store_true',
+                            help='Drop the cached document index before every question')
+
+    def handle(self, *args, **options):
+        try:
+            document = Document.objects.get(pk=options['document_id'])
+        except Document.DoesNotExist:
+            raise CommandError(f"Document {options['document_id']} does not exist")
+        questions = options['queries'] or DEFAULT_QUESTIONS
+
+        with profiling.Profile(f"document-{document.id}", mode=options['mode']) as profile:
+            for _ in range(options['repeat']):
+                for question in questions:
+                    if options['cold']:
+                        index_cache.invalidate(document.id)
+                    # Answers are never stored here, so repeats do not hit the answer cache.
+                    prepared = qa.prepare_query(document, question, use_semantic_cache=False)
+                    if options['generate'] and prepared.cached_result is None:
+                        qa.generate_answer(prepared)
+
+        profile_id = profile.save({
+            'document_id': document.id,
+            'questions': questions,
+            'repeat': options['repeat'],
+            'generate': options['generate'],
+            'cold': options['cold'],
+        })
+        self.stdout.write(self.style.SUCCESS(
+            f"Profiled {options['repeat'] * len(questions)} queries in {profile.duration:.2f}s "
+            f"({len(profile.queries)} SQL queries): {settings.PROFILING_DIR}/{profile_id}.*"
+        ))
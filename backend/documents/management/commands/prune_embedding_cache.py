@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from documents.embedding import prune_cache
+
+
+class Command(BaseCommand):
+    help = "Delete expired entries from the chunk embedding cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=float, default=None,
+                            help='Delete entries older than this (default: EMBEDDING_CACHE_TTL_DAYS; 0 = none by age)')
+        parser.add_argument('--other-models', action='store_true',
+                            help='Also delete entries of other embedding models and inference backends')
+
+    def handle(self, *args, **options):
+        deleted = prune_cache(options['max_age_days'], other_models=options['other_models'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} cached embedding(s)"))
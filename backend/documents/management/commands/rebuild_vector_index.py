@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from documents.models import Document
+from documents.vector_store import get_vector_store, index_document
+
+
+class Command(BaseCommand):
+    help = "Rebuild the cross-document vector index from stored chunk embeddings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nlist', type=int, default=None,
+                            help='Number of inverted lists (default: sqrt(#vectors))')
+        parser.add_argument('--skip-load', action='store_true',
+                            help='Only retrain the quantiser over vectors already in the index')
+
+    def handle(self, *args, **options):
+        store = get_vector_store()
+        if not options['skip_load']:
+            existing = set(Document.objects.values_list('id', flat=True))
+            for document_id in store.document_ids():
+                if document_id not in existing:
+                    store.remove_document(document_id)
+
+            document_ids = Document.objects.filter(chunks__isnull=False).distinct().values_list('id', flat=True)
+            for count, document_id in enumerate(document_ids.iterator(), start=1):
+                index_document(document_id)
+                if count % 100 == 0:
+                    self.stdout.write(f"Indexed {count} documents")
+        store.train(nlist=options['nlist'])
+        self.stdout.write(self.style.SUCCESS(f"Vector index rebuilt: {store.stats()}"))
@@ -0,0 +1,386 @@
+"""Counters and latency histograms exposed in Prometheus text format.
+
+Recording a value only updates a dict in this process under a lock.  A daemon
+thread writes the process's totals to the shared cache every
+``METRICS_FLUSH_INTERVAL`` seconds as one entry, and ``/metrics`` adds up the
+entries of every process (web workers, ingestion workers, the generation
+server), so one scrape covers the whole deployment when ``CACHE_URL`` points
+at Redis or a database.  When a process stops publishing (it exited or was
+recycled) its last totals are folded into a persistent aggregate, so exported
+counters never decrease.  Gauges such as the ingestion queue depth and the
+shared ``counters`` are read when the endpoint is scraped.
+"""
+import atexit
+import hmac
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+PROCESS_KEY_PREFIX = 'metrics:process'
+REGISTRY_KEY = 'metrics:registry'
+REGISTRY_LOCK_KEY = 'metrics:registry:lock'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+_lock = threading.Lock()
+# (metric name, label values) -> counter value, or per-bucket counts + [sum, count]
+_values: Dict[Tuple[str, LabelValues], object] = {}
+_metrics: Dict[str, 'Metric'] = {}
+_flusher_pid = None
+# Bumped when this process's entry was retired while it was still alive
+_generation = 0
+# Totals already counted under an earlier generation, and the last ones published
+_baseline: Dict[Tuple[str, LabelValues], object] = {}
+_published: Dict[Tuple[str, LabelValues], object] = {}
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _metrics[name] = self
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, LabelValues]:
+        return self.name, tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        _ensure_flusher()
+        with _lock:
+            _values[key] = _values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        position = bisect_left(self.buckets, value)
+        _ensure_flusher()
+        with _lock:
+            counts = _values.get(key)
+            if counts is None:
+                # One slot per bucket, one for +Inf, then sum and count.
+                counts = _values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            counts[position] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+QUERY_STAGE_SECONDS = Histogram(
+    'smartdocs_query_stage_seconds', 'Time spent in each stage of answering a query.', ['stage'])
+QUERIES = Counter(
+    'smartdocs_queries_total', 'Answered queries by where the answer came from.', ['answered_by'])
+LLM_FALLBACKS = Counter(
+    'smartdocs_llm_fallbacks_total', 'Primary LLM failures answered by the local model instead.', ['model'])
+INGESTION_STAGE_SECONDS = Histogram(
+    'smartdocs_ingestion_stage_seconds', 'Time spent in each stage of processing a document.', ['stage'])
+INGESTION_CHUNKS = Counter(
+    'smartdocs_ingestion_chunks_total', 'Chunks written by document processing.', ['result'])
+INGESTION_JOBS = Counter(
+    'smartdocs_ingestion_jobs_total', 'Finished ingestion job attempts by outcome.', ['outcome'])
+MODEL_LOAD_SECONDS = Histogram(
+    'smartdocs_model_load_seconds', 'Time taken to load a model into a worker process.', ['model'],
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+
+
+# ---------------------------------------------------------------------------
+# Sharing between processes
+# ---------------------------------------------------------------------------
+
+def _process_key() -> str:
+    return f'{PROCESS_KEY_PREFIX}:{socket.gethostname()}:{os.getpid()}:{_generation}'
+
+
+def _ensure_flusher() -> None:
+    global _flusher_pid, _generation, _baseline, _published
+    if _flusher_pid == os.getpid() or not settings.METRICS_ENABLED:
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        if _flusher_pid is not None:
+            # Forked child: the parent's totals are reported by the parent.
+            _values.clear()
+            _generation, _baseline, _published = 0, {}, {}
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        flush()
+        try:
+            retire_exited()
+        except Exception as e:
+            logger.warning(f"Failed to retire exited metrics processes: {str(e)}")
+
+
+def snapshot() -> Dict[Tuple[str, LabelValues], object]:
+    with _lock:
+        return {key: list(value) if isinstance(value, list) else value for key, value in _values.items()}
+
+
+def _combine(totals: Dict[Tuple[str, LabelValues], object], values: Dict[Tuple[str, LabelValues], object],
+             sign: int = 1) -> None:
+    """Add (or with ``sign=-1`` subtract) ``values`` into ``totals`` in place."""
+    for key, value in values.items():
+        if isinstance(value, list):
+            current = totals.get(key) or [0] * len(value)
+            totals[key] = [a + sign * b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + sign * value
+
+
+def _stale_after() -> float:
+    # Live processes flush every interval, so this leaves room for a few misses.
+    return settings.METRICS_FLUSH_INTERVAL * 4
+
+
+def _registry() -> dict:
+    """Published processes, the totals of retired ones, and when they retired."""
+    return cache.get(REGISTRY_KEY) or {'processes': [], 'retired': {}, 'retiring': {}}
+
+
+@contextmanager
+def _registry_lock(timeout: float = 5.0):
+    """Serialise read-modify-write of the registry across processes."""
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + timeout
+    while not cache.add(REGISTRY_LOCK_KEY, token, timeout=30):
+        if time.monotonic() > deadline:
+            raise TimeoutError("metrics registry is locked")
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        if cache.get(REGISTRY_LOCK_KEY) == token:
+            cache.delete(REGISTRY_LOCK_KEY)
+
+
+def flush() -> None:
+    """Publish this process's totals to the shared cache."""
+    global _generation, _baseline, _published
+    try:
+        registry = _registry()
+        if _process_key() in registry['retiring']:
+            # This process stalled long enough to be taken for exited and its
+            # published totals were retired; publish only what came after.
+            with _lock:
+                _combine(_baseline, _published)
+                _generation += 1
+        current = snapshot()
+        values = dict(current)
+        _combine(values, _baseline, sign=-1)
+        key = _process_key()
+        cache.set(key, {'seen': time.time(), 'values': values}, timeout=None)
+        _published = values
+        if key not in registry['processes']:
+            with _registry_lock():
+                registry = _registry()
+                registry['processes'].append(key)
+                cache.set(REGISTRY_KEY, registry, timeout=None)
+    except Exception as e:
+        logger.warning(f"Failed to publish metrics: {str(e)}")
+
+
+@atexit.register
+def _flush_at_exit() -> None:
+    if _flusher_pid == os.getpid():
+        flush()
+
+
+def retire_exited() -> None:
+    """Fold the totals of processes that stopped publishing into ``retired``.
+
+    Counters must never go down, so an exited worker's last totals stay in
+    the sum.  Its entry is only deleted one stale period later, so a scrape
+    that read the registry before the fold still finds it.
+    """
+    now = time.time()
+    registry = _registry()
+    entries = cache.get_many(registry['processes'])
+    stale = [key for key in registry['processes'] if now - entries.get(key, {}).get('seen', 0) > _stale_after()]
+    expired = [key for key, retired_at in registry['retiring'].items() if now - retired_at > _stale_after()]
+    if not stale and not expired:
+        return
+    with _registry_lock():
+        registry = _registry()
+        entries = cache.get_many(registry['processes'])
+        for key in list(registry['processes']):
+            entry = entries.get(key)
+            if entry is not None and now - entry['seen'] <= _stale_after():
+                continue
+            if entry is not None:
+                _combine(registry['retired'], entry['values'])
+            registry['processes'].remove(key)
+            registry['retiring'][key] = now
+        expired = [key for key, retired_at in registry['retiring'].items() if now - retired_at > _stale_after()]
+        for key in expired:
+            del registry['retiring'][key]
+        cache.set(REGISTRY_KEY, registry, timeout=None)
+    cache.delete_many(expired)
+
+
+def collect() -> Dict[Tuple[str, LabelValues], object]:
+    """Totals over every process that ever published, this one included."""
+    flush()
+    try:
+        retire_exited()
+    except Exception as e:
+        logger.warning(f"Failed to retire exited metrics processes: {str(e)}")
+    registry = _registry()
+    totals = dict(registry['retired'])
+    for entry in cache.get_many(registry['processes']).values():
+        _combine(totals, entry['values'])
+    return totals
+
+
+# ---------------------------------------------------------------------------
+# Exposition
+# ---------------------------------------------------------------------------
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _header(lines: List[str], name: str, kind: str, documentation: str) -> None:
+    lines.append(f'# HELP {name} {documentation}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def _shared_metrics(lines: List[str]) -> None:
+    """Gauges and shared counters read at scrape time."""
+    from . import answer_cache, counters, dedup, embedding, jobs, rerank, semantic_cache
+
+    caches = {
+        'answer': (answer_cache.HITS, answer_cache.MISSES),
+        'semantic': (semantic_cache.HITS, semantic_cache.MISSES),
+        'embedding': (embedding.CACHE_HITS, embedding.CACHE_MISSES),
+        'rerank': (rerank.CACHE_HITS, rerank.CACHE_MISSES),
+    }
+    counts = counters.get_many(
+        [name for pair in caches.values() for name in pair]
+        + [dedup.UPLOADS, dedup.UPLOAD_HITS, rerank.SKIPPED_LOAD, rerank.SKIPPED_BUDGET]
+    )
+    _header(lines, 'smartdocs_cache_requests_total', 'counter', 'Cache lookups by cache and result.')
+    for cache_name, (hits, misses) in caches.items():
+        lines.append(f'smartdocs_cache_requests_total{{cache="{cache_name}",result="hit"}} {counts[hits]}')
+        lines.append(f'smartdocs_cache_requests_total{{cache="{cache_name}",result="miss"}} {counts[misses]}')
+    _header(lines, 'smartdocs_uploads_total', 'counter', 'Uploaded files by whether they duplicated a stored one.')
+    lines.append(f'smartdocs_uploads_total{{duplicate="true"}} {counts[dedup.UPLOAD_HITS]}')
+    lines.append(f'smartdocs_uploads_total{{duplicate="false"}} '
+                 f'{max(counts[dedup.UPLOADS] - counts[dedup.UPLOAD_HITS], 0)}')
+    _header(lines, 'smartdocs_rerank_skipped_total', 'counter', 'Reranks skipped under load or over budget.')
+    lines.append(f'smartdocs_rerank_skipped_total{{reason="load"}} {counts[rerank.SKIPPED_LOAD]}')
+    lines.append(f'smartdocs_rerank_skipped_total{{reason="budget"}} {counts[rerank.SKIPPED_BUDGET]}')
+
+    try:
+        depth = jobs.queue_depth()
+    except Exception as e:
+        logger.warning(f"Failed to read ingestion queue depth: {str(e)}")
+    else:
+        _header(lines, 'smartdocs_ingestion_queue_depth', 'gauge', 'Ingestion jobs pending or running.')
+        lines.append(f'smartdocs_ingestion_queue_depth {depth}')
+
+
+def render() -> str:
+    totals = collect()
+    lines: List[str] = []
+    for metric in _metrics.values():
+        series = sorted((labels, value) for (name, labels), value in totals.items() if name == metric.name)
+        _header(lines, metric.name, metric.kind, metric.documentation)
+        for labels, value in series:
+            if metric.kind == 'counter':
+                lines.append(f'{metric.name}{_labels(metric.labelnames, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (float('inf'),), value):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f'{metric.name}_bucket{_labels(metric.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{metric.name}_sum{_labels(metric.labelnames, labels)} {_number(value[-2])}')
+            lines.append(f'{metric.name}_count{_labels(metric.labelnames, labels)} {value[-1]}')
+    _shared_metrics(lines)
+    return '\n'.join(lines) + '\n'
+
+
+def _allowed_address(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    for network in settings.METRICS_ALLOWED_IPS:
+        try:
+            if ip in ipaddress.ip_network(network, strict=False):
+                return True
+        except ValueError:
+            logger.warning(f"Ignoring invalid METRICS_ALLOWED_IPS entry '{network}'")
+    return False
+
+
+def metrics_view(request):
+    """``GET /metrics``.
+
+    Needs ``Authorization: Bearer <METRICS_TOKEN>`` if a token is set;
+    otherwise only clients in ``METRICS_ALLOWED_IPS`` (loopback by default)
+    may scrape.
+    """
+    if not settings.METRICS_ENABLED:
+        return HttpResponse(status=404)
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            return HttpResponse(status=401)
+    elif not _allowed_address(request.META.get('REMOTE_ADDR', '')):
+        return HttpResponse(status=403)
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
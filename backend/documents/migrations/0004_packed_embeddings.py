@@ -0,0 +1,71 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:00
+
+from django.db import migrations
+import documents.fields
+
+BATCH_SIZE = 1000
+
+
+def _convert(apps, source, target):
+    for model_name in ("Document", "DocumentChunk"):
+        model = apps.get_model("documents", model_name)
+        batch = []
+        rows = model.objects.exclude(**{f"{source}__isnull": True}).only("pk", source)
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            value = getattr(row, source)
+            if target == "embedding":
+                # Back to JSON: plain Python floats.
+                value = [float(x) for x in value]
+            setattr(row, target, value)
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, [target])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, [target])
+
+
+def json_to_packed(apps, schema_editor):
+    _convert(apps, "embedding", "embedding_packed")
+
+
+def packed_to_json(apps, schema_editor):
+    _convert(apps, "embedding_packed", "embedding")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("documents", "0003_query"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="embedding_packed",
+            field=documents.fields.VectorField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="documentchunk",
+            name="embedding_packed",
+            field=documents.fields.VectorField(blank=True, null=True),
+        ),
+        migrations.RunPython(json_to_packed, packed_to_json),
+        migrations.RemoveField(
+            model_name="document",
+            name="embedding",
+        ),
+        migrations.RemoveField(
+            model_name="documentchunk",
+            name="embedding",
+        ),
+        migrations.RenameField(
+            model_name="document",
+            old_name="embedding_packed",
+            new_name="embedding",
+        ),
+        migrations.RenameField(
+            model_name="documentchunk",
+            old_name="embedding_packed",
+            new_name="embedding",
+        ),
+    ]
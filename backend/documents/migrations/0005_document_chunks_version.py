@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_packed_embeddings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='chunks_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
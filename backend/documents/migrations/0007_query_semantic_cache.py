@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:10
+
+from django.db import migrations, models
+import documents.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='query',
+            name='document_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='query',
+            name='model_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='query',
+            name='question_embedding',
+            field=documents.fields.VectorField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='query',
+            index=models.Index(fields=['document', 'document_version', 'model_name'], name='documents_q_documen_45de59_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:24
+
+import hashlib
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def hash_existing_chunks(apps, schema_editor):
+    DocumentChunk = apps.get_model("documents", "DocumentChunk")
+    batch = []
+    rows = DocumentChunk.objects.filter(content_hash="").only("pk", "content")
+    for chunk in rows.iterator(chunk_size=BATCH_SIZE):
+        chunk.content_hash = hashlib.sha256(chunk.content.encode("utf-8")).hexdigest()
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            DocumentChunk.objects.bulk_update(batch, ["content_hash"])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_content_hash_dedup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(hash_existing_chunks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:41
+
+from django.db import migrations, models
+
+# Must match what ``SearchVector('content', config='english')`` compiles to,
+# or Postgres will not use the index for ``lexical.postgres_search``.
+CREATE_FTS_INDEX = (
+    "CREATE INDEX IF NOT EXISTS documents_chunk_content_fts ON documents_documentchunk "
+    "USING gin (to_tsvector('english'::regconfig, COALESCE(content, '')))"
+)
+DROP_FTS_INDEX = "DROP INDEX IF EXISTS documents_chunk_content_fts"
+
+
+def create_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_FTS_INDEX)
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_FTS_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_chunk_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='lexical_index',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
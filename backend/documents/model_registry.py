@@ -0,0 +1,214 @@
+"""Process-wide registry for the embedding and generation models.
+
+Every model is loaded lazily on first use and then shared by all requests and
+background jobs running in the same worker process.  Loading is guarded by a
+per-model lock so concurrent requests never load the same model twice.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS = 'embeddings'
+HF_LLM = 'hf_llm'
+HF_TOKENIZER = 'hf_tokenizer'
+GEMINI_LLM = 'gemini_llm'
+RERANKER = 'reranker'
+
+_loaders: Dict[str, Callable[[], Any]] = {}
+_models: Dict[str, Any] = {}
+_stats: Dict[str, Dict[str, Any]] = {}
+_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def _current_rss() -> Optional[int]:
+    """Return the current resident set size of this process in bytes (None if unknown)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # No /proc (e.g. macOS); ru_maxrss would only give the peak.
+        return None
+
+
+def register(name: str, loader: Callable[[], Any]) -> None:
+    """Register (or replace) the loader used for ``name``."""
+    with _registry_lock:
+        _loaders[name] = loader
+        _locks.setdefault(name, threading.Lock())
+
+
+def get(name: str) -> Any:
+    """Return the model registered under ``name``, loading it on first use."""
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    if name not in _loaders:
+        raise KeyError(f"No model registered under '{name}'")
+
+    with _locks[name]:
+        # Another thread may have finished loading while we waited.
+        model = _models.get(name)
+        if model is not None:
+            return model
+
+        rss_before = _current_rss()
+        started = time.perf_counter()
+        model = _loaders[name]()
+        load_seconds = time.perf_counter() - started
+        rss_after = _current_rss()
+
+        known = rss_before is not None and rss_after is not None
+        _stats[name] = {
+            'load_seconds': round(load_seconds, 3),
+            'rss_delta_bytes': max(rss_after - rss_before, 0) if known else None,
+            'rss_after_bytes': rss_after,
+            'loaded_at': time.time(),
+        }
+        _models[name] = model
+        metrics.MODEL_LOAD_SECONDS.observe(load_seconds, model=name)
+        memory = (
+            f" (RSS +{_stats[name]['rss_delta_bytes'] / 1024 / 1024:.1f}MB, now {rss_after / 1024 / 1024:.1f}MB)"
+            if known else ""
+        )
+        logger.info(f"Loaded model '{name}' in {load_seconds:.2f}s{memory}")
+        return model
+
+
+def is_loaded(name: str) -> bool:
+    return name in _models
+
+
+def unload(name: str) -> None:
+    """Drop a loaded model so the next ``get`` reloads it."""
+    with _locks.get(name, _registry_lock):
+        _models.pop(name, None)
+        _stats.pop(name, None)
+
+
+def warm_models(names: Optional[Iterable[str]] = None) -> None:
+    """Eagerly load ``names`` (defaults to ``settings.WARM_MODELS``).
+
+    Called from the WSGI/ASGI entry points so each gunicorn/daphne worker pays
+    the load cost at boot instead of on its first request.
+    """
+    names = list(names if names is not None else settings.WARM_MODELS)
+    for name in names:
+        try:
+            get(name)
+        except Exception as e:
+            logger.error(f"Failed to warm model '{name}': {str(e)}")
+
+
+def stats() -> Dict[str, Any]:
+    """Return load time and memory figures for every loaded model."""
+    result = {
+        'rss_bytes': _current_rss(),
+        'models': {name: dict(values) for name, values in _stats.items()},
+    }
+    batcher = getattr(_models.get(HF_LLM), 'batcher', None)
+    if batcher is not None:
+        result['hf_batcher'] = batcher.stats()
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Built-in loaders
+# ---------------------------------------------------------------------------
+
+def _load_embeddings():
+    from .inference import load_embeddings
+    return load_embeddings()
+
+
+def load_hf_pipeline():
+    """Flan-T5 as a LangChain ``HuggingFacePipeline`` (no batching)."""
+    from .inference import load_generator
+    return load_generator()
+
+
+def _load_hf_llm():
+    if settings.HF_BATCHING == 'off':
+        return load_hf_pipeline()
+    from .batching import BatchedLLM, RemoteBatcher, authkey, batcher_from_settings, pipeline_stream
+    if settings.HF_BATCHING == 'server':
+        return BatchedLLM(remote=RemoteBatcher(settings.HF_GENERATION_SERVER_ADDRESS, authkey()))
+    llm = load_hf_pipeline()
+    return BatchedLLM(batcher=batcher_from_settings(llm), stream=pipeline_stream(llm))
+
+
+def _load_hf_tokenizer():
+    # Share the pipeline's tokenizer when Flan-T5 is already loaded here.
+    hf_pipeline = getattr(_models.get(HF_LLM), 'pipeline', None)
+    if hf_pipeline is not None:
+        return hf_pipeline.tokenizer
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(settings.HF_LLM_MODEL_NAME)
+
+
+def _load_reranker():
+    from sentence_transformers import CrossEncoder
+    from .inference import configure_torch_threads
+    configure_torch_threads()
+    return CrossEncoder(settings.RERANK_MODEL_NAME, max_length=512)
+
+
+def _load_gemini_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        model=settings.GEMINI_MODEL,
+        temperature=0.2,
+        max_output_tokens=512,
+        n=1,
+        verbose=False,
+    )
+
+
+register(EMBEDDINGS, _load_embeddings)
+register(HF_LLM, _load_hf_llm)
+register(HF_TOKENIZER, _load_hf_tokenizer)
+register(GEMINI_LLM, _load_gemini_llm)
+register(RERANKER, _load_reranker)
+
+
+def get_embeddings():
+    return get(EMBEDDINGS)
+
+
+def get_hf_llm():
+    return get(HF_LLM)
+
+
+def get_hf_tokenizer():
+    return get(HF_TOKENIZER)
+
+
+def get_gemini_llm():
+    return get(GEMINI_LLM)
+
+
+def get_reranker():
+    return get(RERANKER)
+
+
+def get_default_llm():
+    """Prefer Gemini when ``GOOGLE_API_KEY`` is configured, else local Flan-T5."""
+    if os.environ.get("GOOGLE_API_KEY"):
+        return get_gemini_llm()
+    return get_hf_llm()
+
+
+def default_llm_name() -> str:
+    """Model name of the LLM ``get_default_llm`` returns, without loading it."""
+    if os.environ.get("GOOGLE_API_KEY"):
+        return settings.GEMINI_MODEL
+    return settings.HF_LLM_MODEL_NAME
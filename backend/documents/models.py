@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from .fields import VectorField
 
 class Document(models.Model):
     title = models.CharField(max_length=255)
@@ -9,7 +11,10 @@ class Document(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     content = models.TextField(blank=True)  # Extracted text content
-    embedding = models.JSONField(null=True, blank=True)  # Store document embeddings
+    embedding = VectorField(null=True, blank=True)  # Packed float32 document embedding
+    chunks_version = models.PositiveIntegerField(default=0)  # Bumped whenever chunks are rewritten
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # SHA-256 of the uploaded file
+    lexical_index = models.BinaryField(null=True, blank=True, editable=False)  # Compressed BM25 index of the chunks
     
     class Meta:
         ordering = ['-uploaded_at']
@@ -21,7 +26,11 @@ class DocumentChunk(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
     content = models.TextField()
     chunk_index = models.IntegerField()
-    embedding = models.JSONField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)  # SHA-256 of ``content``
+    # First and last source page of the chunk (1-based)
+    page_start = models.PositiveIntegerField(null=True, blank=True)
+    page_end = models.PositiveIntegerField(null=True, blank=True)
+    embedding = VectorField(null=True, blank=True)  # Packed float32 chunk embedding
     
     class Meta:
         ordering = ['chunk_index']
@@ -30,12 +39,62 @@ class DocumentChunk(models.Model):
     def __str__(self):
         return f"{self.document.title} - Chunk {self.chunk_index}"
 
+class ChunkEmbedding(models.Model):
+    """Embedding of a chunk text, shared by every chunk with the same text."""
+    text_hash = models.CharField(max_length=64)  # SHA-256 of the chunk text
+    model_name = models.CharField(max_length=255)
+    embedding = VectorField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['text_hash', 'model_name']
+
+    def __str__(self):
+        return f"{self.model_name} - {self.text_hash[:12]}"
+
 class Query(models.Model):
     document = models.ForeignKey(Document, related_name='queries', on_delete=models.CASCADE)
     user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
     question = models.TextField()
     answer = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Semantic answer cache: question embedding, chunk version and LLM that answered
+    question_embedding = VectorField(null=True, blank=True)
+    document_version = models.PositiveIntegerField(default=0)
+    model_name = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['document', 'document_version', 'model_name'])]
+
+class IngestionJob(models.Model):
+    """A queued request to (re-)process a document, run by ``manage.py ingest_worker``."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    ]
+
+    document = models.ForeignKey(Document, related_name='ingestion_jobs', on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)  # Earliest time the job may be claimed
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"{self.document.title} - {self.status}"
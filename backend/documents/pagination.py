@@ -0,0 +1,8 @@
+from rest_framework.pagination import CursorPagination
+
+class ChunkCursorPagination(CursorPagination):
+    """Cursor pagination over a document's chunks in reading order."""
+    ordering = 'chunk_index'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -1,81 +1,341 @@
 import os
-from typing import List, Dict, Any
-import PyPDF2
-from docx import Document as DocxDocument
-import numpy as np
+import logging
+import time
+import zlib
+from bisect import bisect_right
+from collections import defaultdict, deque
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from .models import Document, DocumentChunk
+from . import dedup, lexical, metrics
+from .index_cache import index_cache
+from .embedding import embed_texts, text_hash
+from .extraction import default_processes, iter_docx_pages, iter_pdf_pages
+from .vector_store import index_document_changes
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# Text is handed to the splitter in windows of this many chunks so chunks can
+# be embedded while the rest of the document is still being split.
+SPLIT_WINDOW_CHUNKS = 32
 
 class DocumentProcessor:
     def __init__(self, document: Document):
         self.document = document
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
             length_function=len,
         )
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
 
     def extract_text(self) -> str:
         """Extract text content from different file types."""
+        return "\n".join(text for _, text in self.iter_pages())
+
+    def iter_pages(self) -> Iterator[Tuple[int, str]]:
+        """Yield ``(page_number, text)`` for each page of the document."""
         file_path = self.document.file.path
         file_type = self.document.file_type.lower()
 
         if file_type == 'pdf':
-            return self._extract_from_pdf(file_path)
+            return iter_pdf_pages(
+                file_path,
+                processes=default_processes(settings.PDF_EXTRACT_PROCESSES),
+                min_parallel_pages=settings.PDF_PARALLEL_MIN_PAGES,
+                pages_per_task=settings.PDF_PAGES_PER_TASK,
+            )
         elif file_type in ['docx', 'doc']:
-            return self._extract_from_docx(file_path)
+            return iter_docx_pages(file_path)
         else:
             raise ValueError(f"Unsupported file type: {file_type}")
 
-    def _extract_from_pdf(self, file_path: str) -> str:
-        """Extract text from PDF files."""
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+    def iter_chunks(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, int, int]]:
+        """Split a stream of pages into ``(chunk, page_start, page_end)``.
 
-    def _extract_from_docx(self, file_path: str) -> str:
-        """Extract text from DOCX files."""
-        doc = DocxDocument(file_path)
-        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        The splitter runs over a bounded window of text; every chunk but the
+        last is final and yielded straight away, the last one is carried over
+        and re-split together with the following pages.  Chunk positions in
+        the window are mapped back to the pages they came from.
+
+        Pages picked by a hash of their own text (about one in
+        ``CHUNK_ANCHOR_PAGES``) end a segment: no chunk spans past them, so
+        an edit re-chunks only its own segment and re-indexing stays local.
+        """
+        window = CHUNK_SIZE * SPLIT_WINDOW_CHUNKS
+        anchor_pages = settings.CHUNK_ANCHOR_PAGES
+        buffer = ""
+        buffer_offset = 0  # position of ``buffer`` in the whole document
+        page_offsets: List[int] = []
+        page_numbers: List[int] = []
+
+        def located(chunks):
+            cursor = 0
+            for chunk in chunks:
+                position = buffer.find(chunk, cursor)
+                if position < 0:
+                    position = cursor
+                cursor = position + 1
+                start = buffer_offset + position
+                yield (
+                    chunk,
+                    page_numbers[max(bisect_right(page_offsets, start) - 1, 0)],
+                    page_numbers[max(bisect_right(page_offsets, start + len(chunk) - 1) - 1, 0)],
+                )
+
+        for number, text in pages:
+            if page_offsets:
+                buffer += "\n"
+            page_offsets.append(buffer_offset + len(buffer))
+            page_numbers.append(number)
+            buffer += text
+            if anchor_pages and zlib.crc32(text.encode('utf-8')) % anchor_pages == 0:
+                # Anchor page: close the segment so chunk boundaries after it
+                # do not depend on anything before it.
+                yield from located(self.text_splitter.split_text(buffer))
+                buffer_offset += len(buffer)
+                buffer = ""
+                continue
+            if len(buffer) < window:
+                continue
+            chunks = self.text_splitter.split_text(buffer)
+            if not chunks:
+                buffer_offset += len(buffer)
+                buffer = ""
+                continue
+            yield from located(chunks[:-1])
+            carry = buffer.rfind(chunks[-1])
+            buffer_offset += carry
+            buffer = buffer[carry:]
+        if buffer.strip():
+            yield from located(self.text_splitter.split_text(buffer))
 
     def process_document(self) -> None:
-        """Process the document: extract text, chunk it, and generate embeddings."""
-        # Extract text
-        text_content = self.extract_text()
-        self.document.content = text_content
-        self.document.save()
-
-        # Split into chunks
-        chunks = self.text_splitter.split_text(text_content)
-        
-        # Delete existing chunks
-        self.document.chunks.all().delete()
-        
-        # Create new chunks with embeddings
-        for i, chunk_text in enumerate(chunks):
-            # Generate embedding
-            embedding = self.embeddings.embed_query(chunk_text)
-            
-            # Create chunk
-            DocumentChunk.objects.create(
+        """Process the document: extract text, chunk it, and generate embeddings.
+
+        Re-processing is incremental: new chunks are matched to the stored
+        ones by content hash, and only chunks whose text is new get embedded.
+        """
+        plan = ChunkPlan(self.document)
+        source = dedup.processed_source(self.document)
+        if source is not None:
+            self._copy_from(source, plan)
+            return
+
+        # Pages stream through the splitter into the embedder, so embedding
+        # starts while later pages are still being extracted.  Splitting is
+        # timed as producing the texts minus extracting the pages, embedding
+        # as the whole loop minus producing the texts.
+        page_texts = []
+        to_embed = []
+        produced = {}
+
+        def pages():
+            for number, text in _timed(self.iter_pages(), produced, 'extract'):
+                page_texts.append(text)
+                yield number, text
+
+        def texts_to_embed():
+            for chunk_text, page_start, page_end in self.iter_chunks(pages()):
+                chunk = plan.add(chunk_text, page_start, page_end)
+                if chunk.pk is None:
+                    to_embed.append(chunk)
+                    yield chunk_text
+
+        embedded = 0
+        started = time.perf_counter()
+        for _, batch_embeddings in embed_texts(_timed(texts_to_embed(), produced, 'texts')):
+            for embedding in batch_embeddings:
+                to_embed[embedded].embedding = embedding
+                embedded += 1
+        embedding_loop = time.perf_counter() - started
+        text_content = "\n".join(page_texts)
+        del page_texts
+
+        with metrics.INGESTION_STAGE_SECONDS.time(stage='persist'):
+            self._apply(text_content, plan)
+        extract = produced.get('extract', 0.0)
+        split = produced.get('texts', 0.0) - extract
+        metrics.INGESTION_STAGE_SECONDS.observe(extract, stage='extract')
+        metrics.INGESTION_STAGE_SECONDS.observe(max(split, 0.0), stage='split')
+        metrics.INGESTION_STAGE_SECONDS.observe(max(embedding_loop - produced.get('texts', 0.0), 0.0), stage='embed')
+        metrics.INGESTION_CHUNKS.inc(len(plan.chunks) - len(plan.new), result='reused')
+        metrics.INGESTION_CHUNKS.inc(len(plan.new), result='embedded')
+
+    def _copy_from(self, source: Document, plan: 'ChunkPlan') -> None:
+        """Reuse the text and chunks of an identical, already processed file."""
+        for chunk in source.chunks.all().iterator():
+            plan.add(chunk.content, chunk.page_start, chunk.page_end,
+                     embedding=chunk.embedding, content_hash=chunk.content_hash)
+        logger.info(f"Document {self.document.id} is a copy of {source.id}; reusing {len(plan.chunks)} chunks")
+        with metrics.INGESTION_STAGE_SECONDS.time(stage='persist'):
+            self._apply(source.content, plan)
+        metrics.INGESTION_CHUNKS.inc(len(plan.chunks), result='reused')
+        dedup.record_reuse(len(plan.chunks))
+
+    def _apply(self, text_content: str, plan: 'ChunkPlan') -> None:
+        """Write the planned chunk set: delete stale, renumber moved, insert new."""
+        stale_ids = [chunk.pk for chunk in plan.stale]
+        moved = plan.moved
+        changed = bool(plan.new or stale_ids or moved)
+
+        # One transaction so readers never see a half-indexed document.
+        with transaction.atomic():
+            self.document.content = text_content
+            # Only the extracted text: a revision uploaded while this job ran
+            # has already replaced the file fields.
+            self.document.save(update_fields=['content', 'updated_at'])
+            if changed:
+                DocumentChunk.objects.filter(pk__in=stale_ids).delete()
+                if moved:
+                    # Park moved chunks on negative indexes first so no
+                    # intermediate state breaks unique (document, chunk_index),
+                    # then shift each run of chunks that moved together with
+                    # one UPDATE.
+                    shifts, irregular = plan.shifts(moved)
+                    for ids in _batches([chunk.pk for chunk in moved]):
+                        DocumentChunk.objects.filter(pk__in=ids).update(chunk_index=-1 - F('chunk_index'))
+                    for (index_delta, start_delta, end_delta), chunk_ids in shifts.items():
+                        for ids in _batches(chunk_ids):
+                            DocumentChunk.objects.filter(pk__in=ids).update(
+                                chunk_index=index_delta - 1 - F('chunk_index'),
+                                page_start=F('page_start') + start_delta,
+                                page_end=F('page_end') + end_delta,
+                            )
+                    DocumentChunk.objects.bulk_update(
+                        irregular, ['chunk_index', 'page_start', 'page_end'],
+                        batch_size=settings.CHUNK_BULK_BATCH_SIZE,
+                    )
+                DocumentChunk.objects.bulk_create(
+                    plan.new, batch_size=settings.CHUNK_BULK_BATCH_SIZE
+                )
+                Document.objects.filter(pk=self.document.pk).update(chunks_version=F('chunks_version') + 1)
+                self.document.refresh_from_db(fields=['chunks_version'])
+                if settings.HYBRID_RETRIEVAL_ENABLED:
+                    lexical.build_for_document(self.document.pk, self.document.chunks_version)
+                document_id = self.document.pk
+                transaction.on_commit(lambda: index_cache.invalidate(document_id))
+
+        logger.info(
+            f"Document {self.document.id}: {len(plan.chunks) - len(plan.new)} chunks kept "
+            f"({len(moved)} renumbered), {len(plan.new)} added, {len(stale_ids)} removed"
+        )
+        if not changed:
+            # Same chunks as before: cached indexes and answers stay valid.
+            return
+
+        if settings.VECTOR_INDEX_ENABLED:
+            try:
+                index_document_changes(self.document.id, [chunk.pk for chunk in plan.new], stale_ids)
+            except Exception as e:
+                # The document is still queryable on its own; the cross-document
+                # index can be rebuilt with ``manage.py rebuild_vector_index``.
+                logger.error(f"Failed to update vector index for document {self.document.id}: {str(e)}")
+
+
+class ChunkPlan:
+    """The new chunk sequence of a document, matched against its stored chunks.
+
+    Each added chunk reuses a stored chunk with the same content hash (keeping
+    its row, id and embedding) when one is left; otherwise a new, unsaved
+    ``DocumentChunk`` is created.  Stored chunks that were never matched are
+    stale.
+    """
+
+    def __init__(self, document: Document):
+        self.document = document
+        self.chunks: List[DocumentChunk] = []
+        self.new: List[DocumentChunk] = []
+        self._unmatched: Dict[str, deque] = defaultdict(deque)
+        self._original: Dict[int, Tuple[int, Any, Any]] = {}
+        stored = document.chunks.only('id', 'document', 'chunk_index', 'content_hash', 'page_start', 'page_end')
+        for chunk in stored.order_by('chunk_index'):
+            self._unmatched[chunk.content_hash].append(chunk)
+            self._original[chunk.pk] = (chunk.chunk_index, chunk.page_start, chunk.page_end)
+
+    def add(self, content: str, page_start, page_end, embedding=None, content_hash: str = '') -> DocumentChunk:
+        content_hash = content_hash or text_hash(content)
+        matches = self._unmatched.get(content_hash)
+        if matches:
+            chunk = matches.popleft()
+        else:
+            chunk = DocumentChunk(
                 document=self.document,
-                content=chunk_text,
-                chunk_index=i,
-                embedding=embedding
+                content=content,
+                content_hash=content_hash,
+                embedding=embedding,
             )
+            self.new.append(chunk)
+        chunk.chunk_index = len(self.chunks)
+        chunk.page_start = page_start
+        chunk.page_end = page_end
+        self.chunks.append(chunk)
+        return chunk
+
+    @property
+    def stale(self) -> List[DocumentChunk]:
+        return [chunk for chunks in self._unmatched.values() for chunk in chunks]
+
+    @property
+    def moved(self) -> List[DocumentChunk]:
+        """Reused chunks whose index or pages changed."""
+        return [
+            chunk for chunk in self.chunks
+            if chunk.pk is not None
+            and self._original[chunk.pk] != (chunk.chunk_index, chunk.page_start, chunk.page_end)
+        ]
+
+    def shifts(self, moved: List[DocumentChunk]) -> Tuple[Dict[Tuple[int, int, int], List[int]], List[DocumentChunk]]:
+        """Group ``moved`` chunks by how far their index and pages moved.
+
+        Returns ``({(index_delta, page_start_delta, page_end_delta): [ids]},
+        irregular)``; chunks whose page numbers appeared or vanished cannot be
+        expressed as a shift and are returned as ``irregular``.
+        """
+        shifts: Dict[Tuple[int, int, int], List[int]] = defaultdict(list)
+        irregular = []
+        for chunk in moved:
+            old_index, old_start, old_end = self._original[chunk.pk]
+            if (old_start is None) != (chunk.page_start is None) or (old_end is None) != (chunk.page_end is None):
+                irregular.append(chunk)
+                continue
+            key = (
+                chunk.chunk_index - old_index,
+                (chunk.page_start or 0) - (old_start or 0),
+                (chunk.page_end or 0) - (old_end or 0),
+            )
+            shifts[key].append(chunk.pk)
+        return shifts, irregular
+
+
+def _timed(items: Iterable[Any], totals: Dict[str, float], key: str) -> Iterator[Any]:
+    """Yield ``items``, adding the time spent producing them to ``totals[key]``."""
+    iterator = iter(items)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            totals[key] = totals.get(key, 0.0) + time.perf_counter() - started
+            return
+        totals[key] = totals.get(key, 0.0) + time.perf_counter() - started
+        yield item
+
+
+def _batches(items: List[Any]) -> Iterator[List[Any]]:
+    size = settings.CHUNK_BULK_BATCH_SIZE
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
 
 def process_document(document_id: int) -> None:
     """Process a document by its ID."""
     try:
-        document = Document.objects.get(id=document_id)
+        document = Document.objects.defer('lexical_index').get(id=document_id)
         processor = DocumentProcessor(document)
         processor.process_document()
     except Document.DoesNotExist:
@@ -0,0 +1,326 @@
+"""Opt-in profiling of individual requests to the documents endpoints.
+
+With ``PROFILING_ENABLED`` the ``ProfilingMiddleware`` profiles requests under
+``PROFILING_PATH_PREFIX`` that are either picked at random
+(``PROFILING_SAMPLE_RATE``) or carry the ``X-SmartDocs-Profile`` header and
+come from a staff user.  A process profiles one request at a time and at
+most ``PROFILING_MAX_PER_MINUTE`` per minute; every other request runs
+untouched, so sampling stays cheap under load.
+
+Each profile is written to ``PROFILING_DIR`` under an id that is returned in
+the ``X-Profile-Id`` response header:
+
+* ``<id>.folded`` - ``PROFILING_MODE=sampling`` (default): stacks sampled
+  every ``PROFILING_INTERVAL_MS`` in collapsed format, for flamegraph.pl,
+  inferno or speedscope.  Sync requests sample the request thread; async
+  requests sample every thread, so executor work shows up (as does that of
+  concurrent requests), with one tower per thread name.
+* ``<id>.prof`` - ``PROFILING_MODE=cprofile``: deterministic ``cProfile``
+  stats of the request thread, for snakeviz or flameprof.
+* ``<id>.json`` - the request, its duration and status, the SQL statements
+  it ran (without parameters) and, with ``PROFILING_TRACEMALLOC``, the
+  biggest allocation sites.
+
+Streaming responses are profiled until the response object is returned, not
+while the body streams.  ``manage.py profile_document`` profiles a
+document's query pipeline from the command line with the same output.
+"""
+import cProfile
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-SmartDocs-Profile'
+RESPONSE_HEADER = 'X-Profile-Id'
+TRACEMALLOC_TOP = 25
+
+# SQL statements of the profile running in the current context.  Context
+# variables follow the request into ``sync_to_async`` and executor threads.
+_sql: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar('profiling_sql', default=None)
+
+_busy = threading.Lock()
+_window_lock = threading.Lock()
+_recent: deque = deque()
+
+
+def try_acquire() -> bool:
+    """Claim this process's profiling slot, within the per-minute limit."""
+    if not _busy.acquire(blocking=False):
+        return False
+    now = time.monotonic()
+    with _window_lock:
+        while _recent and now - _recent[0] > 60:
+            _recent.popleft()
+        if len(_recent) >= settings.PROFILING_MAX_PER_MINUTE:
+            _busy.release()
+            return False
+        _recent.append(now)
+    return True
+
+
+def release() -> None:
+    _busy.release()
+
+
+# ---------------------------------------------------------------------------
+# SQL capture
+# ---------------------------------------------------------------------------
+
+def _record_sql(execute, sql, params, many, context):
+    queries = _sql.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.append({
+            'sql': sql,
+            'ms': round((time.perf_counter() - started) * 1000, 3),
+            'many': many,
+            'thread': threading.current_thread().name,
+        })
+
+
+def _install(connection, **kwargs) -> None:
+    if _record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_sql)
+
+
+def install_sql_recorder() -> None:
+    """Record SQL of profiled requests on every connection opened from now on."""
+    connection_created.connect(_install, dispatch_uid='documents.profiling')
+
+
+# ---------------------------------------------------------------------------
+# Profilers
+# ---------------------------------------------------------------------------
+
+class Sampler:
+    """Count the stacks of some or all threads on a background thread."""
+
+    def __init__(self, interval: float, thread_ids: Optional[List[int]] = None):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (self.thread_ids is not None and ident not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, f'thread-{ident}'))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path: str) -> None:
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+
+class Profile:
+    """Profile the enclosed block, then ``save`` the result to ``PROFILING_DIR``."""
+
+    def __init__(self, label: str, mode: Optional[str] = None, thread_ids: Optional[List[int]] = None):
+        self.label = label
+        self.mode = mode or settings.PROFILING_MODE
+        self.thread_ids = thread_ids
+        self.queries: List[Dict[str, Any]] = []
+        self.duration = 0.0
+        self.allocations: Optional[Dict[str, Any]] = None
+        self._profiler = None
+        self._started_tracemalloc = False
+
+    def __enter__(self) -> 'Profile':
+        for connection in connections.all():
+            _install(connection)
+        self._sql_token = _sql.set(self.queries)
+        if settings.PROFILING_TRACEMALLOC and not tracemalloc.is_tracing():
+            tracemalloc.start(settings.PROFILING_TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+        if self.mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._profiler = Sampler(settings.PROFILING_INTERVAL_MS / 1000, self.thread_ids)
+            self._profiler.start()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.duration = time.perf_counter() - self._started
+        if self.mode == 'cprofile':
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            self.allocations = {
+                'traced_peak_kb': round(peak / 1024, 1),
+                'top': [
+                    {'where': str(stat.traceback[0]), 'kb': round(stat.size / 1024, 1), 'count': stat.count}
+                    for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]
+                ],
+            }
+        _sql.reset(self._sql_token)
+
+    def save(self, details: Dict[str, Any]) -> str:
+        """Write the profile files and return the profile id."""
+        directory = settings.PROFILING_DIR
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', self.label).strip('-')[:60]
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{uuid.uuid4().hex[:6]}"
+        base = os.path.join(directory, profile_id)
+        if self.mode == 'cprofile':
+            self._profiler.dump_stats(base + '.prof')
+        else:
+            self._profiler.write(base + '.folded')
+        summary = dict(details)
+        summary.update({
+            'id': profile_id,
+            'mode': self.mode,
+            'duration_ms': round(self.duration * 1000, 2),
+            'sql_count': len(self.queries),
+            'sql_ms': round(sum(query['ms'] for query in self.queries), 3),
+            'sql': self.queries,
+            'allocations': self.allocations,
+        })
+        with open(base + '.json', 'w') as file:
+            json.dump(summary, file, indent=2, default=str)
+        _prune(directory)
+        return profile_id
+
+
+def _prune(directory: str) -> None:
+    """Keep the newest ``PROFILING_MAX_PROFILES`` profiles."""
+    summaries = [entry for entry in os.scandir(directory) if entry.name.endswith('.json')]
+    summaries.sort(key=lambda entry: entry.stat().st_mtime)
+    ids = [entry.name[:-len('.json')] for entry in summaries]
+    for profile_id in ids[:max(len(ids) - settings.PROFILING_MAX_PROFILES, 0)]:
+        for suffix in ('.json', '.folded', '.prof'):
+            try:
+                os.remove(os.path.join(directory, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+# ---------------------------------------------------------------------------
+# Middleware
+# ---------------------------------------------------------------------------
+
+def _is_staff(request) -> bool:
+    """Authenticate like the DRF views do (token or session) and check staff."""
+    from rest_framework.exceptions import APIException
+    from rest_framework.request import Request
+    from rest_framework.settings import api_settings
+
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    try:
+        return bool(drf_request.user and drf_request.user.is_staff)
+    except APIException:
+        return False
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install_sql_recorder()
+
+    def _reason(self, request) -> Optional[str]:
+        if not request.path.startswith(settings.PROFILING_PATH_PREFIX):
+            return None
+        if request.headers.get(HEADER):
+            return 'header'
+        if random.random() < settings.PROFILING_SAMPLE_RATE:
+            return 'sample'
+        return None
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        reason = self._reason(request)
+        if reason is None or (reason == 'header' and not _is_staff(request)) or not try_acquire():
+            return self.get_response(request)
+        try:
+            with Profile(f'{request.method} {request.path}', thread_ids=[threading.get_ident()]) as profile:
+                response = self.get_response(request)
+            self._save(profile, request, response, reason)
+        finally:
+            release()
+        return response
+
+    async def __acall__(self, request):
+        reason = self._reason(request)
+        if reason == 'header' and not await sync_to_async(_is_staff)(request):
+            reason = None
+        if reason is None or not try_acquire():
+            return await self.get_response(request)
+        try:
+            with Profile(f'{request.method} {request.path}') as profile:
+                response = await self.get_response(request)
+            await sync_to_async(self._save)(profile, request, response, reason)
+        finally:
+            release()
+        return response
+
+    def _save(self, profile: Profile, request, response, reason: str) -> None:
+        try:
+            profile_id = profile.save({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'reason': reason,
+            })
+        except OSError as e:
+            logger.error(f"Failed to write profile for {request.path}: {str(e)}")
+            return
+        response[RESPONSE_HEADER] = profile_id
+        logger.info(f"Profiled {request.method} {request.path} ({reason}) as {profile_id}")
@@ -0,0 +1,178 @@
+"""Token-budgeted prompt assembly for question answering.
+
+The prompt must fit the model's input window (Flan-T5 silently truncates at
+512 tokens) and every extra token costs latency.  ``build_prompt`` counts
+tokens with the model's own tokenizer where one is available locally (Flan-T5)
+and estimates them otherwise (Gemini, or when ``transformers`` is missing).
+It then fills the budget in this order:
+
+1. the template and the question;
+2. the most recent chat turns, up to ``PROMPT_HISTORY_TOKENS`` and at most a
+   quarter of the room left; older turns are dropped with a note saying how
+   many;
+3. retrieved chunks in rank order, in document order in the prompt, with the
+   text that adjacent chunks share through the splitter overlap kept once.
+"""
+import logging
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+from django.conf import settings
+
+from . import model_registry
+from .retrieval import RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+QA_PROMPT = (
+    "You are an AI assistant that answers questions strictly based on the provided context. "
+    "Do not invent information. If the answer is not contained in the context, say you do not know."
+    "\n\nContext:\n{context}\n\n{history}Question: {question}\nHelpful answer (use complete sentences):"
+)
+HISTORY_BLOCK = "Conversation so far:\n{turns}\n\n"
+ROLE_LABELS = {'user': 'User', 'assistant': 'Assistant'}
+
+# Rough ratio for models without a local tokenizer.
+CHARS_PER_TOKEN = 4
+# Longest text adjacent chunks can share (``processors.CHUNK_OVERLAP``).
+MAX_CHUNK_OVERLAP = 200
+
+_tokenizer_failed = False
+
+
+class Prompt(NamedTuple):
+    text: str
+    tokens: int
+    chunks: List[RetrievedChunk]  # chunks that made it into the prompt, in rank order
+    history_turns: int
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def token_counter(model_name: str) -> Callable[[str], int]:
+    """Return a function counting prompt tokens for ``model_name``."""
+    global _tokenizer_failed
+    if model_name == settings.HF_LLM_MODEL_NAME and not _tokenizer_failed:
+        try:
+            tokenizer = model_registry.get_hf_tokenizer()
+        except Exception as e:
+            # Do not retry the import/download on every request.
+            _tokenizer_failed = True
+            logger.warning(f"Tokenizer for {model_name} unavailable, estimating prompt tokens: {str(e)}")
+        else:
+            return lambda text: len(tokenizer.encode(text))
+    return estimate_tokens
+
+
+def token_budget(model_name: str) -> int:
+    if model_name == settings.HF_LLM_MODEL_NAME:
+        return settings.HF_PROMPT_MAX_TOKENS
+    return settings.PROMPT_MAX_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int, count: Callable[[str], int]) -> str:
+    """Longest prefix of ``text`` (cut at a word boundary) within ``max_tokens``."""
+    if max_tokens <= 0:
+        return ''
+    if count(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text.rfind(' ', 0, low)
+    return text[:cut if cut > 0 else low]
+
+
+def _shared_overlap(previous: str, text: str) -> int:
+    """Length of the longest suffix of ``previous`` that starts ``text``."""
+    for size in range(min(MAX_CHUNK_OVERLAP, len(previous), len(text)), 0, -1):
+        if previous.endswith(text[:size]):
+            return size
+    return 0
+
+
+def render_context(chunks: Sequence[RetrievedChunk]) -> str:
+    """Join chunks in document order, keeping text shared by neighbours once."""
+    ordered = sorted(
+        chunks, key=lambda chunk: (chunk.chunk_index is None, chunk.chunk_index or 0)
+    )
+    parts: List[str] = []
+    previous = None
+    for chunk in ordered:
+        text = chunk.text
+        if previous is not None and previous.chunk_index is not None and chunk.chunk_index == previous.chunk_index + 1:
+            overlap = _shared_overlap(previous.text, text)
+            if overlap and parts:
+                # Continue the previous passage instead of repeating the overlap.
+                rest = text[overlap:]
+                parts[-1] += rest if not rest or rest[0].isspace() else ' ' + rest
+                previous = chunk
+                continue
+        if text:
+            parts.append(text)
+        previous = chunk
+    return "\n\n".join(parts)
+
+
+def compact_history(chat_history: List[Dict[str, Any]], max_tokens: int,
+                    count: Callable[[str], int]) -> Tuple[str, int]:
+    """Render the newest turns that fit ``max_tokens``; return ``(text, turns)``."""
+    messages = [
+        message for message in chat_history
+        if message.get('role') in ROLE_LABELS and message.get('content')
+    ]
+    if not messages or max_tokens <= 0:
+        return '', 0
+    lines: List[str] = []
+    used = count(HISTORY_BLOCK.format(turns=''))
+    for message in reversed(messages):
+        line = f"{ROLE_LABELS[message['role']]}: {message['content'].strip()}"
+        cost = count(line + "\n")
+        if used + cost > max_tokens:
+            if not lines:
+                # Keep at least the start of the latest turn.
+                line = truncate_to_tokens(line, max_tokens - used, count)
+                if line:
+                    lines.append(line + " ...")
+            break
+        lines.append(line)
+        used += cost
+    kept = len(lines)
+    if not kept:
+        return '', 0
+    if kept < len(messages):
+        lines.append(f"({len(messages) - kept} earlier messages omitted)")
+    return HISTORY_BLOCK.format(turns="\n".join(reversed(lines))), kept
+
+
+def build_prompt(question: str, chunks: Sequence[RetrievedChunk], chat_history: List[Dict[str, Any]],
+                 model_name: str) -> Prompt:
+    count = token_counter(model_name)
+    budget = token_budget(model_name)
+
+    base = count(QA_PROMPT.format(context='', history='', question=question))
+    history, history_turns = compact_history(
+        chat_history, min(settings.PROMPT_HISTORY_TOKENS, (budget - base) // 4), count
+    )
+
+    def render(selected: Sequence[RetrievedChunk]) -> str:
+        return QA_PROMPT.format(context=render_context(selected), history=history, question=question)
+
+    selected: List[RetrievedChunk] = []
+    for chunk in chunks:
+        candidate = selected + [chunk]
+        if count(render(candidate)) <= budget:
+            selected = candidate
+        elif not selected:
+            # Even the best chunk alone is too long: keep as much as fits.
+            room = budget - count(render([]))
+            text = truncate_to_tokens(chunk.text, room, count)
+            if text:
+                selected = [chunk._replace(text=text)]
+    text = render(selected)
+    return Prompt(text, count(text), selected, history_turns)
@@ -0,0 +1,481 @@
+"""Question answering pipeline shared by the blocking and streaming query views.
+
+``prepare_query`` does everything up to the LLM call: exact and semantic
+answer cache lookups, loading (or reusing) the document index, retrieval and
+prompt construction.  ``generate_answer`` / ``stream_answer`` then run the
+preferred LLM with a fallback to the local Flan-T5 model, and ``finalize``
+caches and persists the answer.  Each stage's wall time is recorded in
+``PreparedQuery.timings``.  The ``a``-prefixed functions at the end are
+the async equivalents used by the ASGI query view.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import answer_cache, lexical, metrics, model_registry, prompting, rerank, semantic_cache
+from .index_cache import index_cache
+from .models import Document, Query
+from .retrieval import DEFAULT_TOP_K, DocumentIndex, RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+class DocumentNotReady(Exception):
+    """The document has no chunks yet (still processing or failed)."""
+
+
+class PreparedQuery:
+    """State carried from retrieval to answer generation for one question."""
+
+    def __init__(self, document: Document, question: str, chat_history: List[Dict[str, Any]], user=None):
+        self.document = document
+        self.question = question
+        self.chat_history = chat_history or []
+        self.user = user
+        self.model_name = model_registry.default_llm_name()
+        self.cache_key = answer_cache.make_key(
+            document.id, document.chunks_version, question, self.chat_history, self.model_name
+        )
+        self.query_embedding = None
+        self.relevant_chunks: List[RetrievedChunk] = []
+        self.prompt = ''
+        self.prompt_tokens = 0
+        self.rerank_outcome: Optional[str] = None
+        # Milliseconds spent per stage (embed, index, retrieve, rerank, prompt, generate).
+        self.timings: Dict[str, float] = {}
+        # Set when the answer came from a cache; no LLM call is needed then.
+        self.cached_result: Optional[Dict[str, Any]] = None
+        self.cache_source: Optional[str] = None
+
+    @contextmanager
+    def timed(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[stage] = round(self.timings.get(stage, 0.0) + elapsed * 1000, 2)
+            metrics.QUERY_STAGE_SECONDS.observe(elapsed, stage=stage)
+
+    def server_timing(self) -> str:
+        """The timings as a ``Server-Timing`` header value."""
+        return ', '.join(f'{stage};dur={ms}' for stage, ms in self.timings.items())
+
+    @property
+    def sources(self) -> List[Dict[str, Any]]:
+        return [
+            {'chunk_id': chunk.chunk_id, 'chunk_index': chunk.chunk_index, 'score': chunk.score}
+            for chunk in self.relevant_chunks
+        ]
+
+
+def prepare_query(document: Document, question: str, chat_history=None, user=None,
+                  use_semantic_cache: bool = True) -> PreparedQuery:
+    prepared = PreparedQuery(document, question, chat_history, user)
+    if _check_answer_cache(prepared):
+        return prepared
+
+    with prepared.timed('embed'):
+        embeddings_model = model_registry.get_embeddings()
+        prepared.query_embedding = embeddings_model.embed_query(question)
+    if use_semantic_cache and _check_semantic_cache(prepared):
+        return prepared
+
+    _retrieve(prepared, embeddings_model)
+    return prepared
+
+
+def _check_answer_cache(prepared: PreparedQuery) -> bool:
+    # Repeat questions skip retrieval and the LLM entirely
+    cached_result = answer_cache.lookup(prepared.cache_key)
+    if cached_result:
+        prepared.cached_result = cached_result
+        prepared.cache_source = 'answer_cache'
+        metrics.QUERIES.inc(answered_by='answer_cache')
+        return True
+    return False
+
+
+def _check_semantic_cache(prepared: PreparedQuery) -> bool:
+    # Paraphrases of earlier stand-alone questions reuse their answer
+    if not settings.SEMANTIC_CACHE_ENABLED or prepared.chat_history:
+        return False
+    match = semantic_cache.find(prepared.document, prepared.query_embedding, prepared.model_name)
+    if match is None:
+        return False
+    prepared.cached_result = {
+        "answer": match.answer,
+        "chat_history": [{"role": "assistant", "content": match.answer}],
+    }
+    prepared.cache_source = 'semantic_cache'
+    metrics.QUERIES.inc(answered_by='semantic_cache')
+    answer_cache.store(prepared.cache_key, prepared.cached_result)
+    save_query(prepared, match.answer, prepared.model_name, store_embedding=False)
+    return True
+
+
+def _retrieve(prepared: PreparedQuery, embeddings_model) -> None:
+    document = prepared.document
+    # Reuse this worker's index for the current chunk version if we have one;
+    # otherwise load the chunks once and cache the index.
+    with prepared.timed('index'):
+        document_index = index_cache.get_or_build(
+            document.id,
+            document.chunks_version,
+            lambda: _build_index(document, embeddings_model),
+        )
+    if not len(document_index):
+        raise DocumentNotReady()
+
+    # With reranking on, over-fetch and let the cross-encoder pick the top chunks.
+    k = max(DEFAULT_TOP_K, settings.RERANK_CANDIDATES) if settings.RERANK_ENABLED else DEFAULT_TOP_K
+    with prepared.timed('retrieve'):
+        if settings.HYBRID_RETRIEVAL_ENABLED:
+            candidates = max(k, settings.HYBRID_CANDIDATES)
+            if lexical.backend() == 'postgres':
+                lexical_rows = document_index.rows_for_chunk_ids(
+                    lexical.postgres_search(document.id, prepared.question, candidates)
+                )
+            else:
+                lexical_rows = document_index.lexical_search(prepared.question, candidates)
+            prepared.relevant_chunks = document_index.hybrid_search(
+                prepared.query_embedding, lexical_rows, k=k, candidates=candidates
+            )
+        else:
+            prepared.relevant_chunks = document_index.search(prepared.query_embedding, k=k)
+    if settings.RERANK_ENABLED:
+        with prepared.timed('rerank'):
+            prepared.relevant_chunks, prepared.rerank_outcome = rerank.rerank(
+                prepared.question, prepared.relevant_chunks, settings.RERANK_TOP_K
+            )
+    with prepared.timed('prompt'):
+        _build_prompt(prepared)
+
+
+def _build_prompt(prepared: PreparedQuery) -> None:
+    retrieved = len(prepared.relevant_chunks)
+    prompt = prompting.build_prompt(
+        prepared.question, prepared.relevant_chunks, prepared.chat_history, prepared.model_name
+    )
+    prepared.prompt = prompt.text
+    prepared.prompt_tokens = prompt.tokens
+    prepared.relevant_chunks = prompt.chunks
+    rerank_note = f" (rerank: {prepared.rerank_outcome})" if prepared.rerank_outcome else ""
+    logger.info(
+        f"Prompt for document {prepared.document.id}: {prompt.tokens} tokens ({prepared.model_name}), "
+        f"{len(prompt.chunks)}/{retrieved} chunks{rerank_note}, "
+        f"{prompt.history_turns}/{len(prepared.chat_history)} history turns"
+    )
+
+
+def fallback_prompt(prepared: PreparedQuery) -> str:
+    """The prompt re-fitted to the local Flan-T5 model's smaller window."""
+    if prepared.model_name == settings.HF_LLM_MODEL_NAME:
+        return prepared.prompt
+    return prompting.build_prompt(
+        prepared.question, prepared.relevant_chunks, prepared.chat_history, settings.HF_LLM_MODEL_NAME
+    ).text
+
+
+def _build_index(document: Document, embeddings_model) -> DocumentIndex:
+    document_index = DocumentIndex.from_chunks(
+        document.chunks.all().order_by('chunk_index'),
+        embed_fn=embeddings_model.embed_query,
+    )
+    if settings.HYBRID_RETRIEVAL_ENABLED and lexical.backend() == 'bm25':
+        # Documents ingested before the keyword index existed get one built
+        # from the chunks already in memory.
+        lexical_index = lexical.load_for_document(document) or lexical.LexicalIndex.build(
+            document_index.texts, document_index.chunk_indexes, document.chunks_version
+        )
+        document_index.attach_lexical(lexical_index)
+    return document_index
+
+
+def invoke_llm(llm, prompt: str) -> str:
+    if hasattr(llm, "invoke"):
+        response = llm.invoke(prompt)
+        return response.content if hasattr(response, "content") else str(response)
+    # HuggingFacePipeline is callable and returns str
+    return llm(prompt)
+
+
+def stream_llm(llm, prompt: str) -> Iterator[str]:
+    """Yield answer text as the LLM produces it."""
+    hf_pipeline = getattr(llm, 'pipeline', None)
+    if hf_pipeline is not None and hasattr(hf_pipeline, 'model'):
+        yield from _stream_hf_pipeline(hf_pipeline, prompt)
+        return
+    if hasattr(llm, 'stream'):
+        for chunk in llm.stream(prompt):
+            text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+            if text:
+                yield text
+        return
+    yield invoke_llm(llm, prompt)
+
+
+def _stream_hf_pipeline(hf_pipeline, prompt: str) -> Iterator[str]:
+    """Stream a local transformers model via ``TextIteratorStreamer``."""
+    from transformers import TextIteratorStreamer
+
+    tokenizer = hf_pipeline.tokenizer
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    inputs = tokenizer(prompt, return_tensors='pt', truncation=True)
+    errors = []
+
+    def generate():
+        try:
+            hf_pipeline.model.generate(**inputs, max_length=512, streamer=streamer)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    thread = threading.Thread(target=generate, name='hf-stream', daemon=True)
+    thread.start()
+    for text in streamer:
+        if text:
+            yield text
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def generate_answer(prepared: PreparedQuery) -> Tuple[str, str]:
+    """Return ``(answer, model_name)``, falling back to Flan-T5 on failure."""
+    with prepared.timed('generate'):
+        llm = model_registry.get_default_llm()
+        try:
+            return invoke_llm(llm, prepared.prompt), prepared.model_name
+        except Exception as primary_err:
+            logger.warning(
+                f"Primary LLM ({llm.__class__.__name__}) failed: {primary_err}. Falling back to local HuggingFace model."
+            )
+            metrics.LLM_FALLBACKS.inc(model=prepared.model_name)
+            return invoke_llm(model_registry.get_hf_llm(), fallback_prompt(prepared)), settings.HF_LLM_MODEL_NAME
+
+
+def stream_answer(prepared: PreparedQuery, answered_by: List[str]) -> Iterator[str]:
+    """Stream the answer; falls back to Flan-T5 if the primary LLM fails
+    before producing any text.  The model used is appended to ``answered_by``.
+    """
+    with prepared.timed('generate'):
+        yield from _stream_answer(prepared, answered_by)
+
+
+def _stream_answer(prepared: PreparedQuery, answered_by: List[str]) -> Iterator[str]:
+    llm = model_registry.get_default_llm()
+    produced = False
+    try:
+        for text in stream_llm(llm, prepared.prompt):
+            produced = True
+            yield text
+        answered_by.append(prepared.model_name)
+        return
+    except Exception as primary_err:
+        if produced:
+            raise
+        logger.warning(
+            f"Primary LLM ({llm.__class__.__name__}) failed: {primary_err}. Falling back to local HuggingFace model."
+        )
+        metrics.LLM_FALLBACKS.inc(model=prepared.model_name)
+    yield from stream_llm(model_registry.get_hf_llm(), fallback_prompt(prepared))
+    answered_by.append(settings.HF_LLM_MODEL_NAME)
+
+
+def format_history(chat_history: List[Dict[str, Any]], answer: str) -> List[Dict[str, str]]:
+    history = [
+        {"role": message.get("role"), "content": message.get("content", "")}
+        for message in chat_history
+        if message.get("role") in ("user", "assistant")
+    ]
+    history.append({"role": "assistant", "content": answer})
+    return history
+
+
+def finalize(prepared: PreparedQuery, answer: str, answered_by: str) -> Dict[str, Any]:
+    """Cache and persist a freshly generated answer and build the response."""
+    result = {
+        "answer": answer,
+        "chat_history": format_history(prepared.chat_history, answer),
+    }
+    answer_cache.store(prepared.cache_key, result)
+    # Stand-alone questions also become semantic cache candidates.
+    save_query(prepared, answer, answered_by, store_embedding=not prepared.chat_history)
+    metrics.QUERIES.inc(answered_by=answered_by)
+    logger.info(
+        f"Answered query for document {prepared.document.id} with {answered_by} "
+        f"({prepared.prompt_tokens} prompt tokens): "
+        + ', '.join(f"{stage} {ms:.1f}ms" for stage, ms in prepared.timings.items())
+    )
+    return result
+
+
+def save_query(prepared: PreparedQuery, answer: str, model_name: str, store_embedding: bool) -> None:
+    """Record the query in the user's history; failures are only logged."""
+    question_embedding = prepared.query_embedding if store_embedding else None
+    try:
+        Query.objects.create(
+            document=prepared.document,
+            user=prepared.user,
+            question=prepared.question,
+            answer=answer,
+            question_embedding=question_embedding,
+            document_version=prepared.document.chunks_version,
+            model_name=model_name,
+        )
+        if question_embedding is not None:
+            semantic_cache.evict(prepared.document, model_name)
+    except Exception as e:
+        logger.warning(f"Failed to save query history: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Async pipeline (ASGI)
+# ---------------------------------------------------------------------------
+#
+# The same steps as above for the async query view.  Cache and database work
+# goes through ``sync_to_async``; embedding, index building and local model
+# inference are CPU bound and run on a small bounded thread pool so they
+# cannot starve the event loop or oversubscribe the CPU.  Remote LLMs are
+# awaited with ``ainvoke``.
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.QA_EXECUTOR_WORKERS,
+                    thread_name_prefix='qa-cpu',
+                )
+    return _executor
+
+
+async def run_blocking(fn, *args):
+    """Run ``fn(*args)`` on the bounded CPU executor."""
+    loop = asyncio.get_running_loop()
+    # Carry the request's context variables (e.g. an active profile) into the worker thread.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(context.run, fn, *args))
+
+
+def _retrieve_in_executor(prepared: PreparedQuery) -> None:
+    try:
+        _retrieve(prepared, model_registry.get_embeddings())
+    finally:
+        # Executor threads outlive the request, so drop their stale connections.
+        close_old_connections()
+
+
+async def aprepare_query(document: Document, question: str, chat_history=None, user=None,
+                         use_semantic_cache: bool = True) -> PreparedQuery:
+    prepared = PreparedQuery(document, question, chat_history, user)
+    if await sync_to_async(_check_answer_cache)(prepared):
+        return prepared
+
+    with prepared.timed('embed'):
+        embeddings_model = await run_blocking(model_registry.get_embeddings)
+        prepared.query_embedding = await run_blocking(embeddings_model.embed_query, question)
+    if use_semantic_cache and await sync_to_async(_check_semantic_cache)(prepared):
+        return prepared
+
+    await run_blocking(_retrieve_in_executor, prepared)
+    return prepared
+
+
+async def ainvoke_llm(llm, prompt: str) -> str:
+    # Local pipelines would only run in asyncio's default executor; keep
+    # them on ours so the number of concurrent generations stays bounded.
+    if getattr(llm, 'pipeline', None) is not None or not hasattr(llm, 'ainvoke'):
+        return await run_blocking(invoke_llm, llm, prompt)
+    response = await llm.ainvoke(prompt)
+    return response.content if hasattr(response, "content") else str(response)
+
+
+async def agenerate_answer(prepared: PreparedQuery) -> Tuple[str, str]:
+    with prepared.timed('generate'):
+        llm = await run_blocking(model_registry.get_default_llm)
+        try:
+            return await ainvoke_llm(llm, prepared.prompt), prepared.model_name
+        except Exception as primary_err:
+            logger.warning(
+                f"Primary LLM ({llm.__class__.__name__}) failed: {primary_err}. Falling back to local HuggingFace model."
+            )
+            metrics.LLM_FALLBACKS.inc(model=prepared.model_name)
+            hf_llm = await run_blocking(model_registry.get_hf_llm)
+            prompt = await run_blocking(fallback_prompt, prepared)
+            return await ainvoke_llm(hf_llm, prompt), settings.HF_LLM_MODEL_NAME
+
+
+async def afinalize(prepared: PreparedQuery, answer: str, answered_by: str) -> Dict[str, Any]:
+    return await sync_to_async(finalize)(prepared, answer, answered_by)
+
+
+async def aiter_blocking(iterator: Iterator[str]) -> AsyncIterator[str]:
+    """Iterate a blocking iterator from async code, one ``next`` per executor hop."""
+    done = object()
+    try:
+        while True:
+            item = await run_blocking(next, iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            try:
+                await run_blocking(close)
+            except ValueError:
+                # Still running on the executor after a cancellation.
+                pass
+
+
+async def astream_llm(llm, prompt: str) -> AsyncIterator[str]:
+    """Async ``stream_llm``: remote LLMs stream natively, local ones on our executor."""
+    if getattr(llm, 'pipeline', None) is not None or not hasattr(llm, 'astream'):
+        async for text in aiter_blocking(stream_llm(llm, prompt)):
+            yield text
+        return
+    async for chunk in llm.astream(prompt):
+        text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+        if text:
+            yield text
+
+
+async def astream_answer(prepared: PreparedQuery, answered_by: List[str]) -> AsyncIterator[str]:
+    """Async ``stream_answer``, with the same fallback to Flan-T5."""
+    with prepared.timed('generate'):
+        llm = await run_blocking(model_registry.get_default_llm)
+        produced = False
+        try:
+            async for text in astream_llm(llm, prepared.prompt):
+                produced = True
+                yield text
+            answered_by.append(prepared.model_name)
+            return
+        except Exception as primary_err:
+            if produced:
+                raise
+            logger.warning(
+                f"Primary LLM ({llm.__class__.__name__}) failed: {primary_err}. Falling back to local HuggingFace model."
+            )
+            metrics.LLM_FALLBACKS.inc(model=prepared.model_name)
+        hf_llm = await run_blocking(model_registry.get_hf_llm)
+        prompt = await run_blocking(fallback_prompt, prepared)
+        async for text in astream_llm(hf_llm, prompt):
+            yield text
+        answered_by.append(settings.HF_LLM_MODEL_NAME)
@@ -0,0 +1,168 @@
+"""Request handling shared by the DRF query actions and the async query views.
+
+``DocumentViewSet`` and ``async_views`` scope documents to their owner,
+throttle, read the request body, shape their errors and format answer
+streams through these helpers, so the two entry points cannot drift apart.
+"""
+import json
+import logging
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.exceptions import Throttled
+from rest_framework.renderers import BaseRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .models import Document
+from .throttling import AnonQueryRateThrottle, QueryRateThrottle
+
+logger = logging.getLogger(__name__)
+
+# (body, status) of the query endpoints' error responses
+NO_QUERY = ({'error': 'No query provided'}, status.HTTP_400_BAD_REQUEST)
+NOT_READY = ({'error': 'Document is still being processed'}, status.HTTP_400_BAD_REQUEST)
+QUERY_FAILED = ({'error': 'An error occurred while processing your query'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def document_queryset(user, with_content: bool = False):
+    """Documents ``user`` may access.
+
+    Authenticated users see only their own documents; anonymous requests see
+    documents uploaded without an owner (``uploaded_by`` is NULL), so the
+    ForeignKey is never compared to an ``AnonymousUser``.  The embedding is
+    never loaded, the extracted text only ``with_content``.
+    """
+    if user.is_authenticated:
+        queryset = Document.objects.filter(uploaded_by=user)
+    else:
+        queryset = Document.objects.filter(uploaded_by__isnull=True)
+    if with_content:
+        return queryset.defer('embedding', 'lexical_index')
+    return queryset.defer('embedding', 'content', 'lexical_index')
+
+
+def query_throttles(user) -> list:
+    if user.is_authenticated:
+        return [QueryRateThrottle()]
+    return [AnonQueryRateThrottle()]
+
+
+def authenticate(request):
+    """Authenticate and throttle a plain Django ``request`` like the DRF query actions."""
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    user = drf_request.user
+    for throttle in query_throttles(user):
+        if not throttle.allow_request(drf_request, None):
+            raise Throttled(throttle.wait())
+    return user
+
+
+class QueryParams(NamedTuple):
+    question: str
+    chat_history: List[Dict[str, Any]]
+    use_semantic_cache: bool
+
+
+def parse_query(data) -> Optional[QueryParams]:
+    """The parameters of a query request body, or ``None`` if it has no question."""
+    question = data.get('query')
+    if not question:
+        return None
+    return QueryParams(
+        question=question,
+        chat_history=data.get('chat_history', []),
+        use_semantic_cache=str(data.get('semantic_cache', True)).lower() not in ('false', '0'),
+    )
+
+
+def query_user(user):
+    """The user to record a query for (``None`` when anonymous)."""
+    return user if user.is_authenticated else None
+
+
+def sse(event: str, data) -> str:
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Accept ``text/event-stream`` on the DRF streaming action.
+
+    Answer streams are ``StreamingHttpResponse`` objects and never pass
+    through a renderer; error responses are rendered as one ``error`` event.
+    """
+
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b''
+        return sse('error', data).encode(self.charset)
+
+
+def event_stream_response(events) -> StreamingHttpResponse:
+    """Stream ``events`` (a sync or, under ASGI, an async iterator) as SSE."""
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class AnswerEvents:
+    """The Server-Sent Events of one streamed answer.
+
+    Events are ``sources`` (the retrieved chunks, sent before generation
+    starts), one ``token`` per piece of generated text, and finally ``done``
+    with the full answer, chat history and timings, or ``error``.  Cached
+    answers are sent as a single ``token`` event.
+    """
+
+    def __init__(self, prepared, started: float):
+        self.prepared = prepared
+        self.started = started
+        self.ttft_ms: Optional[float] = None
+        self.parts: List[str] = []
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    @property
+    def answer(self) -> str:
+        return ''.join(self.parts)
+
+    def opening(self) -> List[str]:
+        """``sources``, plus the whole answer when it came from a cache."""
+        cached = self.prepared.cached_result
+        events = [sse('sources', {'sources': self.prepared.sources, 'cached': cached is not None})]
+        if cached:
+            ttft_ms = self.elapsed_ms()
+            events.append(sse('token', {'text': cached['answer']}))
+            events.append(sse('done', dict(cached, ttft_ms=ttft_ms, total_ms=self.elapsed_ms())))
+        return events
+
+    def token(self, text: str) -> str:
+        if self.ttft_ms is None:
+            self.ttft_ms = self.elapsed_ms()
+        self.parts.append(text)
+        return sse('token', {'text': text})
+
+    def done(self, result: Dict[str, Any], answered_by: str) -> str:
+        total_ms = self.elapsed_ms()
+        logger.info(
+            f"Streamed answer for document {self.prepared.document.id} "
+            f"(ttft {self.ttft_ms}ms, total {total_ms}ms, model {answered_by})"
+        )
+        return sse('done', dict(result, ttft_ms=self.ttft_ms, total_ms=total_ms, stages=self.prepared.timings))
+
+    def error(self, error: Exception) -> str:
+        logger.error(f"Error streaming answer for document {self.prepared.document.id}: {str(error)}")
+        return sse('error', QUERY_FAILED[0])
@@ -0,0 +1,170 @@
+"""Cross-encoder reranking of retrieved chunks.
+
+With ``RERANK_ENABLED`` retrieval over-fetches ``RERANK_CANDIDATES`` chunks,
+a small local cross-encoder (``RERANK_MODEL_NAME``) scores every
+(question, chunk) pair in one batch, and only the best ``RERANK_TOP_K`` go
+into the prompt.  Scores are cached in the shared cache per normalised
+question and chunk id; chunk ids are never reused for different text, so
+entries stay valid until they expire.
+
+Reranking is best effort.  It is skipped when ``RERANK_MAX_CONCURRENT``
+reranks are already running in this process, and when the estimated cost of
+the uncached pairs exceeds ``RERANK_BUDGET_MS`` only the leading candidates
+that fit are rescored; the others keep their retrieval order behind them.
+The estimate is a moving average of the measured cost per pair.
+"""
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import answer_cache, counters, model_registry
+from .retrieval import RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'rerank:v1'
+RERANKED = 'rerank.reranked'
+SKIPPED_LOAD = 'rerank.skipped_load'
+SKIPPED_BUDGET = 'rerank.skipped_budget'
+PARTIAL = 'rerank.partial'
+CACHE_HITS = 'rerank.cache_hits'
+CACHE_MISSES = 'rerank.cache_misses'
+
+# Weight of the newest measurement in the per-pair cost average.
+COST_SMOOTHING = 0.2
+
+_state_lock = threading.Lock()
+_in_flight = 0
+_pair_ms = None
+
+
+def question_hash(question: str) -> str:
+    payload = f'{settings.RERANK_MODEL_NAME}\n{answer_cache.normalize_question(question)}'
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _key(digest: str, chunk_id) -> str:
+    return f'{KEY_PREFIX}:{digest}:{chunk_id}'
+
+
+def _acquire() -> bool:
+    global _in_flight
+    with _state_lock:
+        if _in_flight >= settings.RERANK_MAX_CONCURRENT:
+            return False
+        _in_flight += 1
+        return True
+
+
+def _release() -> None:
+    global _in_flight
+    with _state_lock:
+        _in_flight -= 1
+
+
+def _record_cost(pairs: int, elapsed_ms: float) -> None:
+    global _pair_ms
+    per_pair = elapsed_ms / pairs
+    with _state_lock:
+        _pair_ms = per_pair if _pair_ms is None else (
+            COST_SMOOTHING * per_pair + (1 - COST_SMOOTHING) * _pair_ms
+        )
+
+
+def _affordable_pairs() -> int:
+    """Uncached pairs that fit in the latency budget (unbounded until measured)."""
+    if _pair_ms is None or _pair_ms <= 0:
+        return settings.RERANK_CANDIDATES
+    return int(settings.RERANK_BUDGET_MS / _pair_ms)
+
+
+def score_pairs(question: str, texts: List[str]) -> List[float]:
+    """Cross-encoder relevance of each text to ``question``, in one batch."""
+    model = model_registry.get_reranker()
+    scores = model.predict(
+        [(question, text) for text in texts],
+        batch_size=len(texts),
+        show_progress_bar=False,
+    )
+    return [float(score) for score in scores]
+
+
+def rerank(question: str, chunks: List[RetrievedChunk], top_k: int) -> Tuple[List[RetrievedChunk], str]:
+    """Reorder ``chunks`` by cross-encoder score and keep ``top_k``.
+
+    Returns the chunks and an outcome: ``reranked``, ``partial`` (budget
+    limited), ``skipped_load``, ``skipped_budget`` or ``failed``.  Unless
+    reranked, the first ``top_k`` chunks are returned in retrieval order.
+    """
+    if not chunks:
+        return chunks, 'reranked'
+    if not _acquire():
+        counters.incr(SKIPPED_LOAD)
+        return chunks[:top_k], 'skipped_load'
+    try:
+        return _rerank(question, chunks, top_k)
+    finally:
+        _release()
+
+
+def _rerank(question: str, chunks: List[RetrievedChunk], top_k: int) -> Tuple[List[RetrievedChunk], str]:
+    digest = question_hash(question)
+    keys = [_key(digest, chunk.chunk_id) for chunk in chunks]
+    cached = cache.get_many(keys)
+    if cached:
+        counters.incr(CACHE_HITS, len(cached))
+    if len(cached) < len(keys):
+        counters.incr(CACHE_MISSES, len(keys) - len(cached))
+
+    # Rescore the longest prefix of candidates whose uncached pairs fit the budget.
+    affordable = _affordable_pairs()
+    prefix = 0
+    uncached = []
+    for position, key in enumerate(keys):
+        if key not in cached:
+            if len(uncached) == affordable:
+                break
+            uncached.append(position)
+        prefix = position + 1
+
+    if prefix == 0:
+        counters.incr(SKIPPED_BUDGET)
+        return chunks[:top_k], 'skipped_budget'
+
+    scores = {key: cached[key] for key in keys[:prefix] if key in cached}
+    if uncached:
+        started = time.perf_counter()
+        try:
+            new_scores = score_pairs(question, [chunks[position].text for position in uncached])
+        except Exception as e:
+            logger.warning(f"Reranking failed, keeping retrieval order: {str(e)}")
+            return chunks[:top_k], 'failed'
+        _record_cost(len(uncached), (time.perf_counter() - started) * 1000)
+        fresh = {keys[position]: score for position, score in zip(uncached, new_scores)}
+        cache.set_many(fresh, timeout=settings.RERANK_CACHE_TTL)
+        scores.update(fresh)
+
+    head = sorted(range(prefix), key=lambda position: -scores[keys[position]])
+    ordered = [chunks[position] for position in head] + list(chunks[prefix:])
+    outcome = 'reranked' if prefix == len(chunks) else 'partial'
+    counters.incr(RERANKED if outcome == 'reranked' else PARTIAL)
+    return ordered[:top_k], outcome
+
+
+def stats() -> Dict[str, Any]:
+    counts = counters.get_many([RERANKED, PARTIAL, SKIPPED_LOAD, SKIPPED_BUDGET, CACHE_HITS, CACHE_MISSES])
+    hits = counts[CACHE_HITS]
+    lookups = hits + counts[CACHE_MISSES]
+    return {
+        'reranked': counts[RERANKED],
+        'partial': counts[PARTIAL],
+        'skipped_load': counts[SKIPPED_LOAD],
+        'skipped_budget': counts[SKIPPED_BUDGET],
+        'cache_hit_rate': hits / lookups if lookups else 0.0,
+        'pair_ms': _pair_ms,
+    }
@@ -0,0 +1,199 @@
+"""In-memory retrieval over document chunk embeddings.
+
+``VectorIndex`` keeps every embedding L2-normalised in one contiguous float32
+matrix, so cosine similarity for a query is a single matrix-vector product and
+top-k selection is an ``argpartition`` instead of a full sort.
+``DocumentIndex.hybrid_search`` fuses that ranking with a keyword (BM25)
+ranking by reciprocal rank fusion.
+"""
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .lexical import LexicalIndex
+
+DEFAULT_TOP_K = 5
+RRF_K = 60
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` highest ``scores`` along the last axis, best first."""
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape).copy()
+    candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+    order = np.argsort(-candidate_scores, axis=-1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[int]], k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Fuse ranked lists of ids into one: ``score(id) = sum(1 / (k + rank))``.
+
+    Ranks start at 1; ids missing from a ranking contribute nothing to it.
+    Returns ``(id, score)`` pairs, best first.
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda pair: -pair[1])
+
+
+class VectorIndex:
+    """Exact cosine-similarity search over a pre-normalised float32 matrix."""
+
+    def __init__(self, embeddings):
+        if isinstance(embeddings, np.ndarray) and embeddings.ndim == 2:
+            matrix = np.array(embeddings, dtype=np.float32, order='C')
+        else:
+            embeddings = list(embeddings)
+            matrix = (
+                np.vstack([np.asarray(e, dtype=np.float32) for e in embeddings])
+                if embeddings else np.empty((0, 0), dtype=np.float32)
+            )
+        self.matrix = _normalize(matrix)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    def scores(self, query_embedding) -> np.ndarray:
+        query = _normalize(np.array(query_embedding, dtype=np.float32).reshape(-1))
+        return self.matrix @ query
+
+    def search(self, query_embedding, k: int = DEFAULT_TOP_K) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(indices, scores)`` of the ``k`` most similar rows, best first."""
+        if not len(self):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        scores = self.scores(query_embedding)
+        indices = top_k(scores, k)
+        return indices, scores[indices]
+
+    def search_batch(self, query_embeddings, k: int = DEFAULT_TOP_K) -> Tuple[np.ndarray, np.ndarray]:
+        """Score several queries with one matrix product.
+
+        Returns ``(indices, scores)`` arrays of shape ``(n_queries, k)``.
+        """
+        queries = _normalize(np.array(query_embeddings, dtype=np.float32, ndmin=2))
+        if not len(self):
+            empty = (queries.shape[0], 0)
+            return np.empty(empty, dtype=np.intp), np.empty(empty, dtype=np.float32)
+        scores = queries @ self.matrix.T
+        indices = top_k(scores, k)
+        return indices, np.take_along_axis(scores, indices, axis=-1)
+
+
+class RetrievedChunk(NamedTuple):
+    text: str
+    score: float
+    chunk_id: Optional[int] = None
+    chunk_index: Optional[int] = None
+
+
+class DocumentIndex:
+    """Searchable chunks of one document: texts, chunk metadata and vectors."""
+
+    def __init__(
+        self,
+        texts: Sequence[str],
+        embeddings,
+        chunk_ids: Optional[Sequence[int]] = None,
+        chunk_indexes: Optional[Sequence[int]] = None,
+    ):
+        self.texts = list(texts)
+        self.chunk_ids = list(chunk_ids) if chunk_ids is not None else [None] * len(self.texts)
+        self.chunk_indexes = list(chunk_indexes) if chunk_indexes is not None else list(range(len(self.texts)))
+        self.vectors = VectorIndex(embeddings)
+        self.lexical: Optional['LexicalIndex'] = None
+        self._lexical_rows: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable, embed_fn: Optional[Callable[[str], List[float]]] = None):
+        """Build an index from ``DocumentChunk`` rows.
+
+        Chunks without a stored embedding are embedded with ``embed_fn``.
+        """
+        texts, embeddings, chunk_ids, chunk_indexes = [], [], [], []
+        for chunk in chunks:
+            embedding = chunk.embedding
+            if embedding is None:
+                if embed_fn is None:
+                    continue
+                embedding = embed_fn(chunk.content)
+            texts.append(chunk.content)
+            embeddings.append(embedding)
+            chunk_ids.append(chunk.id)
+            chunk_indexes.append(chunk.chunk_index)
+        return cls(texts, embeddings, chunk_ids, chunk_indexes)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @property
+    def nbytes(self) -> int:
+        lexical = self.lexical.nbytes if self.lexical is not None else 0
+        return self.vectors.nbytes + lexical + sum(len(text) for text in self.texts)
+
+    def attach_lexical(self, lexical: 'LexicalIndex') -> None:
+        """Use ``lexical`` (built over the same chunks) for keyword search."""
+        row_of = {chunk_index: row for row, chunk_index in enumerate(self.chunk_indexes)}
+        self.lexical = lexical
+        self._lexical_rows = np.array(
+            [row_of.get(int(chunk_index), -1) for chunk_index in lexical.chunk_indexes], dtype=np.intp
+        )
+
+    def lexical_search(self, query: str, k: int) -> List[int]:
+        """Rows of the ``k`` best keyword matches for ``query``, best first."""
+        if self.lexical is None:
+            return []
+        lexical_rows, _ = self.lexical.search(query, k)
+        rows = self._lexical_rows[lexical_rows]
+        return [int(row) for row in rows if row >= 0]
+
+    def rows_for_chunk_ids(self, chunk_ids: Iterable[int]) -> List[int]:
+        row_of = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+        return [row_of[chunk_id] for chunk_id in chunk_ids if chunk_id in row_of]
+
+    def _results(self, indices, scores) -> List[RetrievedChunk]:
+        return [
+            RetrievedChunk(self.texts[i], float(s), self.chunk_ids[i], self.chunk_indexes[i])
+            for i, s in zip(indices, scores)
+        ]
+
+    def search(self, query_embedding, k: int = DEFAULT_TOP_K) -> List[RetrievedChunk]:
+        indices, scores = self.vectors.search(query_embedding, k)
+        return self._results(indices, scores)
+
+    def hybrid_search(self, query_embedding, lexical_rows: Sequence[int], k: int = DEFAULT_TOP_K,
+                      candidates: int = 20) -> List[RetrievedChunk]:
+        """Fuse the top ``candidates`` vector matches with ``lexical_rows``.
+
+        ``lexical_rows`` is a keyword ranking of rows (see ``lexical_search``).
+        The returned chunks carry their fused RRF score.
+        """
+        vector_rows, _ = self.vectors.search(query_embedding, max(k, candidates))
+        fused = reciprocal_rank_fusion([vector_rows.tolist(), lexical_rows])[:k]
+        return [
+            RetrievedChunk(self.texts[row], score, self.chunk_ids[row], self.chunk_indexes[row])
+            for row, score in fused
+        ]
+
+    def search_batch(self, query_embeddings, k: int = DEFAULT_TOP_K) -> List[List[RetrievedChunk]]:
+        indices, scores = self.vectors.search_batch(query_embeddings, k)
+        return [self._results(row_indices, row_scores) for row_indices, row_scores in zip(indices, scores)]
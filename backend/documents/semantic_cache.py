@@ -0,0 +1,76 @@
+"""Semantic answer cache over earlier ``Query`` rows.
+
+A new question is embedded with the shared MiniLM model and compared with the
+stored question embeddings of recent queries on the same document, chunk
+version and LLM.  If the best match is at least ``SEMANTIC_CACHE_THRESHOLD``
+cosine-similar, its stored answer is reused and no LLM call is made.
+
+Only stand-alone questions take part: a question asked with chat history
+depends on that history, so it is neither looked up nor used as a candidate.
+Each document keeps at most ``SEMANTIC_CACHE_MAX_ENTRIES`` candidate
+embeddings; older ones are cleared so the scan stays small.
+"""
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+from . import counters
+from .models import Document, Query
+from .retrieval import VectorIndex
+
+HITS = 'semantic_cache.hits'
+MISSES = 'semantic_cache.misses'
+LLM_CALLS_AVOIDED = 'semantic_cache.llm_calls_avoided'
+
+
+def _candidates(document: Document, model_name: str):
+    return (
+        Query.objects.filter(
+            document=document,
+            document_version=document.chunks_version,
+            model_name=model_name,
+            question_embedding__isnull=False,
+        )
+        .order_by('-created_at', '-id')
+        .only('id', 'answer', 'question_embedding')
+    )
+
+
+def find(document: Document, question_embedding, model_name: str) -> Optional[Query]:
+    """Return the earlier query whose question best matches, if close enough."""
+    candidates = list(_candidates(document, model_name)[:settings.SEMANTIC_CACHE_MAX_ENTRIES])
+    match = None
+    if candidates:
+        index = VectorIndex([candidate.question_embedding for candidate in candidates])
+        positions, scores = index.search(question_embedding, k=1)
+        if len(positions) and scores[0] >= settings.SEMANTIC_CACHE_THRESHOLD:
+            match = candidates[int(positions[0])]
+
+    if match is None:
+        counters.incr(MISSES)
+    else:
+        counters.incr(HITS)
+        counters.incr(LLM_CALLS_AVOIDED)
+    return match
+
+
+def evict(document: Document, model_name: str) -> int:
+    """Drop candidate embeddings beyond the per-document limit (oldest first)."""
+    stale_ids = list(
+        _candidates(document, model_name)
+        .values_list('id', flat=True)[settings.SEMANTIC_CACHE_MAX_ENTRIES:]
+    )
+    if not stale_ids:
+        return 0
+    return Query.objects.filter(id__in=stale_ids).update(question_embedding=None)
+
+
+def stats() -> Dict[str, Any]:
+    counts = counters.get_many([HITS, MISSES, LLM_CALLS_AVOIDED])
+    lookups = counts[HITS] + counts[MISSES]
+    return {
+        'hits': counts[HITS],
+        'misses': counts[MISSES],
+        'hit_rate': counts[HITS] / lookups if lookups else 0.0,
+        'llm_calls_avoided': counts[LLM_CALLS_AVOIDED],
+    }
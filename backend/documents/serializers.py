@@ -1,24 +1,51 @@
 from rest_framework import serializers
 from .models import Document, DocumentChunk, Query
 
+class VectorSerializerField(serializers.Field):
+    """Render a packed ``VectorField`` as a plain list of floats."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return value.tolist()
+
 class DocumentChunkSerializer(serializers.ModelSerializer):
     class Meta:
         model = DocumentChunk
-        fields = ['id', 'content', 'chunk_index', 'embedding']
-        read_only_fields = ['embedding']
+        fields = ['id', 'content', 'chunk_index', 'page_start', 'page_end']
+
+class DocumentChunkEmbeddingSerializer(DocumentChunkSerializer):
+    """Chunk representation including its embedding (opt-in, ~8 KB per chunk as JSON)."""
+    embedding = VectorSerializerField()
+
+    class Meta(DocumentChunkSerializer.Meta):
+        fields = DocumentChunkSerializer.Meta.fields + ['embedding']
+
+class DocumentListSerializer(serializers.ModelSerializer):
+    """Lightweight representation for listing documents: no text, chunks or vectors."""
+    uploaded_by = serializers.ReadOnlyField(source='uploaded_by.username')
+    
+    class Meta:
+        model = Document
+        fields = [
+            'id', 'title', 'file', 'file_type', 'uploaded_at',
+            'updated_at', 'uploaded_by', 'chunks_version'
+        ]
+        read_only_fields = fields
 
 class DocumentSerializer(serializers.ModelSerializer):
-    chunks = DocumentChunkSerializer(many=True, read_only=True)
     uploaded_by = serializers.ReadOnlyField(source='uploaded_by.username')
     
     class Meta:
         model = Document
         fields = [
             'id', 'title', 'file', 'file_type', 'uploaded_at', 
-            'updated_at', 'uploaded_by', 'content', 'embedding', 'chunks'
+            'updated_at', 'uploaded_by', 'chunks_version', 'content'
         ]
         read_only_fields = ['file_type', 'uploaded_at', 'updated_at', 
-                           'uploaded_by', 'content', 'embedding', 'chunks']
+                           'uploaded_by', 'chunks_version', 'content']
         extra_kwargs = {
             'file': {'required': False, 'allow_null': True},
             'title': {'required': False, 'allow_blank': True},
@@ -1,3 +1,1127 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import PyPDF2
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import F
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncRequestFactory, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import (
+    answer_cache, async_views, batching, embedding, extraction, inference, jobs, metrics, model_registry, prompting,
+    profiling, query_api, rerank, semantic_cache, vector_store,
+)
+from .embedding import text_hash
+from .fields import VectorField
+from .index_cache import IndexCache
+from .lexical import LexicalIndex
+from .models import ChunkEmbedding, Document, DocumentChunk, IngestionJob, Query
+from .processors import ChunkPlan, DocumentProcessor
+from .retrieval import DocumentIndex, RetrievedChunk, reciprocal_rank_fusion
+from .uploadhandlers import HashingUploadHandler
+from .vector_store import ANONYMOUS_OWNER, VectorStore
+
+
+class FakeEmbeddings:
+    """Deterministic embedder: the same text always gets the same vector."""
+
+    dim = 16
+
+    def embed_query(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:4], 'little')
+        return np.random.default_rng(seed).standard_normal(self.dim).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        return np.array(self.embed_documents(list(texts)), dtype=np.float32).reshape(-1, self.dim)
+
+
+class WhitespaceTokenizer:
+    def encode(self, text):
+        return text.split()
+
+
+def use_models(testcase, **loaders):
+    """Serve stand-in models from the registry for the duration of ``testcase``."""
+    for registry in (model_registry._loaders, model_registry._models, model_registry._stats):
+        patcher = mock.patch.dict(registry)
+        patcher.start()
+        testcase.addCleanup(patcher.stop)
+    model_registry._models.clear()
+    loaders.setdefault(model_registry.EMBEDDINGS, FakeEmbeddings)
+    loaders.setdefault(model_registry.HF_TOKENIZER, WhitespaceTokenizer)
+    for name, loader in loaders.items():
+        model_registry.register(name, loader)
+    environ = mock.patch.dict('os.environ')
+    environ.start()
+    testcase.addCleanup(environ.stop)
+    # Answer with the local model, never a remote one.
+    os.environ.pop('GOOGLE_API_KEY', None)
+
+
+def make_document(owner=None, texts=None, title='contract.pdf'):
+    texts = texts if texts is not None else [f'chunk {i} about clause {i}' for i in range(10)]
+    document = Document.objects.create(title=title, file=f'documents/{title}', file_type='PDF', uploaded_by=owner)
+    embeddings = FakeEmbeddings()
+    DocumentChunk.objects.bulk_create([
+        DocumentChunk(document=document, content=text, chunk_index=index, content_hash=text_hash(text),
+                      embedding=embeddings.embed_query(text))
+        for index, text in enumerate(texts)
+    ])
+    return document
+
+
+class GatedLLM:
+    """Streams one token, then waits until the test has received it."""
+
+    def __init__(self):
+        self.first_token_sent = threading.Event()
+        self.flushed = None
+
+    def stream(self, prompt):
+        yield 'first'
+        self.flushed = self.first_token_sent.wait(5)
+        yield ' second'
+
+    def invoke(self, prompt):
+        return 'first second'
+
+
+class AsyncQueryStreamTests(TransactionTestCase):
+    def test_first_token_is_sent_before_generation_finishes(self):
+        llm = GatedLLM()
+        use_models(self, **{model_registry.HF_LLM: lambda: llm})
+        document = make_document()
+        request = AsyncRequestFactory().post(
+            f'/api/documents/{document.id}/query/stream/',
+            {'query': 'what does clause 3 say?'},
+            content_type='application/json',
+        )
+
+        async def consume():
+            response = await async_views.query_stream(request, document.id)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            events = []
+            # Iterated the way Django's ASGI handler sends a streaming body.
+            async for chunk in response:
+                events.append(chunk.decode())
+                if chunk.startswith(b'event: token'):
+                    llm.first_token_sent.set()
+            return events
+
+        events = asyncio.run(consume())
+
+        self.assertTrue(llm.flushed, 'the first token was buffered until generation finished')
+        self.assertEqual(
+            [event.split('\n', 1)[0] for event in events],
+            ['event: sources', 'event: token', 'event: token', 'event: done'],
+        )
+        self.assertIn('"answer": "first second"', events[-1])
+
+
+class QueryStreamViewTests(TransactionTestCase):
+    def post(self, document, data):
+        return APIClient().post(
+            f'/api/documents/{document.id}/query/stream/', data, format='json', HTTP_ACCEPT='text/event-stream',
+        )
+
+    def test_event_stream_clients_get_the_answer_events(self):
+        llm = GatedLLM()
+        llm.first_token_sent.set()
+        use_models(self, **{model_registry.HF_LLM: lambda: llm})
+        document = make_document()
+
+        response = self.post(document, {'query': 'what does clause 3 say?'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = b''.join(response.streaming_content).decode().split('\n\n')[:-1]
+        self.assertEqual(
+            [event.split('\n', 1)[0] for event in events],
+            ['event: sources', 'event: token', 'event: token', 'event: done'],
+        )
+
+    def test_errors_are_sent_as_an_error_event(self):
+        response = self.post(make_document(), {})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.content, b'event: error\ndata: {"error": "No query provided"}\n\n')
+
+
+class VectorFieldTests(SimpleTestCase):
+    vector = np.array([0.5, -1.25, 3.0, 0.0, -0.001], dtype=np.float32)
+
+    def test_float32_round_trip_is_exact(self):
+        field = VectorField()
+        data = field.encode(self.vector.tolist())
+        self.assertEqual(len(data), 4 * len(self.vector))
+        np.testing.assert_array_equal(field.decode(data), self.vector)
+
+    def test_float16_round_trip_is_close(self):
+        field = VectorField(dtype='float16')
+        data = field.encode(self.vector)
+        self.assertEqual(len(data), 2 * len(self.vector))
+        np.testing.assert_allclose(field.decode(data), self.vector, atol=1e-3)
+
+    def test_int8_round_trip_is_within_one_step(self):
+        field = VectorField(dtype='int8')
+        data = field.encode(self.vector)
+        self.assertEqual(len(data), 4 + len(self.vector))
+        decoded = field.decode(data)
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_allclose(decoded, self.vector, atol=3.0 / 127)
+
+    def test_serialized_form_round_trips(self):
+        for dtype in VectorField.DTYPES:
+            field = VectorField(dtype=dtype)
+            chunk = DocumentChunk(embedding=self.vector)
+            field.attname = 'embedding'
+            np.testing.assert_array_equal(field.to_python(field.value_to_string(chunk)),
+                                          field.decode(field.encode(self.vector)))
+
+    def test_unknown_dtype_is_rejected(self):
+        with self.assertRaises(ValueError):
+            VectorField(dtype='float64')
+
+
+class VectorFieldDatabaseTests(TestCase):
+    def test_embeddings_are_read_back_as_float32_arrays(self):
+        document = make_document(texts=['only chunk'])
+        stored = DocumentChunk.objects.get(document=document)
+        self.assertIsInstance(stored.embedding, np.ndarray)
+        self.assertEqual(stored.embedding.dtype, np.float32)
+        np.testing.assert_allclose(stored.embedding, FakeEmbeddings().embed_query('only chunk'), rtol=1e-6)
+
+
+class PackedEmbeddingsMigrationTests(TransactionTestCase):
+    before = [('documents', '0003_query')]
+    after = [('documents', '0004_packed_embeddings')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def setUp(self):
+        self.addCleanup(self.migrate, MigrationExecutor(connection).loader.graph.leaf_nodes())
+        apps = self.migrate(self.before)
+        document = apps.get_model('documents', 'Document').objects.create(
+            title='old.pdf', file='documents/old.pdf', file_type='PDF', embedding=[0.5, -0.25],
+        )
+        chunk_model = apps.get_model('documents', 'DocumentChunk')
+        chunk_model.objects.create(document=document, content='a', chunk_index=0, embedding=[1.0, 2.0, -3.5])
+        chunk_model.objects.create(document=document, content='b', chunk_index=1, embedding=None)
+        self.document_id = document.id
+
+    def test_json_embeddings_are_packed_and_unpacked(self):
+        apps = self.migrate(self.after)
+        chunks = apps.get_model('documents', 'DocumentChunk').objects.order_by('chunk_index')
+        document = apps.get_model('documents', 'Document').objects.get(pk=self.document_id)
+        np.testing.assert_array_equal(document.embedding, np.array([0.5, -0.25], dtype=np.float32))
+        np.testing.assert_array_equal(chunks[0].embedding, np.array([1.0, 2.0, -3.5], dtype=np.float32))
+        self.assertIsNone(chunks[1].embedding)
+
+        apps = self.migrate(self.before)
+        chunks = apps.get_model('documents', 'DocumentChunk').objects.order_by('chunk_index')
+        document = apps.get_model('documents', 'Document').objects.get(pk=self.document_id)
+        self.assertEqual(document.embedding, [0.5, -0.25])
+        self.assertEqual(chunks[0].embedding, [1.0, 2.0, -3.5])
+        self.assertIsNone(chunks[1].embedding)
+
+
+@override_settings(VECTOR_INDEX_ENABLED=False, HYBRID_RETRIEVAL_ENABLED=False)
+class ChunkPlanTests(TestCase):
+    def setUp(self):
+        self.document = make_document(texts=['alpha', 'beta', 'gamma'])
+        self.stored = {chunk.content: chunk for chunk in self.document.chunks.all()}
+
+    def plan(self, texts, document=None):
+        plan = ChunkPlan(document or self.document)
+        for text in texts:
+            plan.add(text, None, None, embedding=FakeEmbeddings().embed_query(text))
+        return plan
+
+    def test_unchanged_chunks_are_reused_moved_and_stale_ones_dropped(self):
+        plan = self.plan(['inserted', 'alpha', 'beta'])
+
+        self.assertEqual(
+            [chunk.pk for chunk in plan.chunks],
+            [None, self.stored['alpha'].pk, self.stored['beta'].pk],
+        )
+        self.assertEqual(plan.new, plan.chunks[:1])
+        self.assertEqual({chunk.pk for chunk in plan.moved}, {self.stored['alpha'].pk, self.stored['beta'].pk})
+        self.assertEqual([chunk.pk for chunk in plan.stale], [self.stored['gamma'].pk])
+
+    def test_same_chunks_in_place_are_not_moved(self):
+        plan = self.plan(['alpha', 'beta', 'gamma'])
+        self.assertEqual((plan.new, plan.moved, plan.stale), ([], [], []))
+
+    def test_apply_writes_the_plan_and_keeps_reused_embeddings(self):
+        version = self.document.chunks_version
+        alpha_embedding = self.stored['alpha'].embedding.copy()
+
+        DocumentProcessor(self.document)._apply('inserted alpha beta', self.plan(['inserted', 'alpha', 'beta']))
+
+        chunks = list(self.document.chunks.order_by('chunk_index'))
+        self.assertEqual([chunk.content for chunk in chunks], ['inserted', 'alpha', 'beta'])
+        self.assertEqual(chunks[1].pk, self.stored['alpha'].pk)
+        np.testing.assert_array_equal(chunks[1].embedding, alpha_embedding)
+        self.assertFalse(DocumentChunk.objects.filter(pk=self.stored['gamma'].pk).exists())
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.chunks_version, version + 1)
+        self.assertEqual(self.document.content, 'inserted alpha beta')
+
+    def test_apply_keeps_the_file_of_a_revision_uploaded_meanwhile(self):
+        processor = DocumentProcessor(Document.objects.get(pk=self.document.pk))
+        Document.objects.filter(pk=self.document.pk).update(file='documents/revised.pdf', content_hash='revised')
+
+        processor._apply('alpha beta gamma', self.plan(['alpha', 'beta', 'gamma'], processor.document))
+
+        self.document.refresh_from_db()
+        self.assertEqual((self.document.file.name, self.document.content_hash), ('documents/revised.pdf', 'revised'))
+        self.assertEqual(self.document.content, 'alpha beta gamma')
+
+
+class IngestionJobTests(TestCase):
+    def setUp(self):
+        self.document = make_document()
+
+    def test_enqueue_coalesces_with_a_pending_job(self):
+        job = jobs.enqueue(self.document)
+        self.assertEqual(jobs.enqueue(self.document), job)
+        self.assertEqual(self.document.ingestion_jobs.count(), 1)
+
+    def test_revision_during_a_running_job_waits_for_it(self):
+        jobs.enqueue(self.document)
+        running = jobs.claim_next('worker-1')
+
+        follow_up = jobs.enqueue(self.document)
+        self.assertNotEqual(follow_up, running)
+        self.assertEqual(jobs.enqueue(self.document), follow_up)
+        self.assertIsNone(jobs.claim_next('worker-2'))
+
+        with mock.patch('documents.processors.process_document'):
+            jobs.run_job(running)
+        self.assertEqual(jobs.claim_next('worker-2'), follow_up)
+
+    def test_claim_takes_runnable_jobs_in_order(self):
+        other = make_document(title='other.pdf')
+        later = IngestionJob.objects.create(document=other, run_after=timezone.now() + timedelta(hours=1))
+        first = jobs.enqueue(self.document)
+
+        claimed = jobs.claim_next('worker-1')
+        self.assertEqual(claimed, first)
+        self.assertEqual((claimed.status, claimed.attempts, claimed.locked_by),
+                         (IngestionJob.RUNNING, 1, 'worker-1'))
+        self.assertIsNone(jobs.claim_next('worker-1'))
+        IngestionJob.objects.filter(pk=later.pk).update(run_after=timezone.now())
+        self.assertEqual(jobs.claim_next('worker-1'), later)
+
+    @override_settings(INGESTION_RETRY_BACKOFF=30)
+    def test_failures_are_retried_with_backoff_until_max_attempts(self):
+        job = IngestionJob.objects.create(document=self.document, max_attempts=2)
+        with mock.patch('documents.processors.process_document', side_effect=RuntimeError('boom')):
+            jobs.run_job(jobs.claim_next('worker-1'))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.locked_by, job.last_error),
+                             (IngestionJob.PENDING, 1, '', 'boom'))
+            self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=20))
+
+            IngestionJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            jobs.run_job(jobs.claim_next('worker-1'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (IngestionJob.FAILED, 2))
+
+    def abandon(self, job):
+        IngestionJob.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(minutes=5))
+
+    @override_settings(INGESTION_JOB_TIMEOUT=60, INGESTION_RETRY_BACKOFF=30)
+    def test_stale_job_is_requeued_with_backoff(self):
+        jobs.enqueue(self.document)
+        self.abandon(jobs.claim_next('worker-1'))
+
+        self.assertEqual(jobs.recover_stale_jobs(), 1)
+        job = self.document.ingestion_jobs.get()
+        self.assertEqual((job.status, job.locked_by), (IngestionJob.PENDING, ''))
+        self.assertIn('worker-1', job.last_error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=20))
+        self.assertIsNone(jobs.claim_next('worker-2'))
+
+    @override_settings(INGESTION_JOB_TIMEOUT=60)
+    def test_stale_job_out_of_attempts_fails(self):
+        IngestionJob.objects.create(document=self.document, max_attempts=1)
+        self.abandon(jobs.claim_next('worker-1'))
+
+        with self.assertLogs('documents.jobs', 'ERROR'):
+            self.assertEqual(jobs.recover_stale_jobs(), 0)
+        job = self.document.ingestion_jobs.get()
+        self.assertEqual(job.status, IngestionJob.FAILED)
+        self.assertIn('died', job.last_error)
+        self.assertIsNone(jobs.claim_next('worker-2'))
+
+    @override_settings(INGESTION_JOB_TIMEOUT=60, INGESTION_RETRY_BACKOFF=0)
+    def test_stale_job_is_requeued_and_its_first_worker_cannot_finish_it(self):
+        jobs.enqueue(self.document)
+        abandoned = jobs.claim_next('worker-1')
+        self.abandon(abandoned)
+
+        self.assertEqual(jobs.recover_stale_jobs(), 1)
+        reclaimed = jobs.claim_next('worker-2')
+        self.assertEqual((reclaimed.pk, reclaimed.attempts), (abandoned.pk, 2))
+
+        with mock.patch('documents.processors.process_document'), self.assertLogs('documents.jobs', 'WARNING'):
+            jobs.run_job(abandoned)
+        reclaimed.refresh_from_db()
+        self.assertEqual((reclaimed.status, reclaimed.locked_by), (IngestionJob.RUNNING, 'worker-2'))
+
+
+class VectorStoreTests(SimpleTestCase):
+    dim = 16
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = VectorStore(directory.name)
+        rng = np.random.default_rng(0)
+        self.owners = {document_id: 1 for document_id in range(1, 41)}
+        self.owners.update({7: 2, 8: None})
+        self.vectors = {}
+        for document_id, owner_id in self.owners.items():
+            embeddings = rng.standard_normal((10, self.dim)).astype(np.float32)
+            chunk_ids = [document_id * 100 + i for i in range(10)]
+            self.vectors.update(zip(chunk_ids, embeddings))
+            self.store.replace_document(document_id, owner_id, chunk_ids, embeddings)
+        self.store.train(nlist=16)
+        self.query = rng.standard_normal(self.dim)
+
+    def exact(self, k, document_ids):
+        chunk_ids = [chunk_id for chunk_id in self.vectors if chunk_id // 100 in document_ids]
+        matrix = np.array([self.vectors[chunk_id] for chunk_id in chunk_ids])
+        scores = matrix @ self.query / np.linalg.norm(matrix, axis=1)
+        return [chunk_ids[i] for i in np.argsort(-scores)[:k]]
+
+    def test_probing_every_list_is_exact(self):
+        results = self.store.search(self.query, k=5, nprobe=16)
+        self.assertEqual([chunk_id for chunk_id, _, _ in results], self.exact(5, set(self.owners)))
+
+    def test_owner_filter_still_returns_k_results(self):
+        for owner_id, document_id in ((2, 7), (ANONYMOUS_OWNER, 8)):
+            results = self.store.search(self.query, k=5, owner_id=owner_id, nprobe=1)
+            self.assertEqual(len(results), 5)
+            self.assertEqual({result[1] for result in results}, {document_id})
+            scores = [score for _, _, score in results]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_update_keeps_maps_of_untouched_lists(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = VectorStore(directory.name)
+        rng = np.random.default_rng(1)
+        for document_id in range(1, 6):
+            store.replace_document(document_id, 1, [document_id * 100], rng.standard_normal((1, self.dim)))
+        store.search(self.query, k=5)
+
+        with mock.patch.object(vector_store.np, 'load', wraps=np.load) as load:
+            store.update_document(3, 1, [301], rng.standard_normal((1, self.dim)), removed_chunk_ids=[300])
+            store.search(self.query, k=5)
+        list_id = store._manifest['documents']['3'][0]
+        self.assertEqual(
+            {call.args[0] for call in load.call_args_list},
+            set(store._list_files(list_id, store._manifest['lists'][str(list_id)])),
+        )
+
+    def test_owner_filter_excludes_other_owners(self):
+        results = self.store.search(self.query, k=500, owner_id=1, nprobe=16)
+        self.assertEqual(len(results), 380)
+        self.assertFalse({result[1] for result in results} & {7, 8})
+
+
+class HybridRetrievalTests(SimpleTestCase):
+    texts = [
+        'Payment is due within thirty days.',
+        'Termination fees apply on early termination.',
+        'Either party may terminate; termination fees are waived.',
+        'The agreement is governed by Swiss law.',
+    ]
+
+    def test_bm25_ranks_matching_chunks_by_term_weight(self):
+        index = LexicalIndex.build(self.texts)
+        rows, scores = index.search('termination fees', k=4)
+        self.assertEqual(rows.tolist(), [1, 2])
+        self.assertGreater(scores[0], scores[1])
+
+    def test_rrf_prefers_items_found_by_both_rankings(self):
+        fused = reciprocal_rank_fusion([[1, 2, 3], [3, 4]])
+        self.assertEqual([item for item, _ in fused], [3, 1, 2, 4])
+        self.assertAlmostEqual(fused[0][1], 1 / 63 + 1 / 61)
+
+    def test_hybrid_search_fuses_vector_and_keyword_rankings(self):
+        # Vector ranking: rows 0, 3, 2, 1; keyword ranking: rows 1, 2.
+        embeddings = np.array([[1.0, 0.0], [-1.0, 0.0], [0.0, 1.0], [0.9, 0.5]], dtype=np.float32)
+        index = DocumentIndex(self.texts, embeddings, chunk_ids=[10, 11, 12, 13])
+        index.attach_lexical(LexicalIndex.build(self.texts))
+
+        lexical_rows = index.lexical_search('termination fees', k=4)
+        results = index.hybrid_search([1.0, 0.0], lexical_rows, k=3, candidates=4)
+
+        self.assertEqual(lexical_rows, [1, 2])
+        # 1/61 + 1/64 > 1/62 + 1/63 > 1/61: matches of both rankings come first.
+        self.assertEqual([result.chunk_id for result in results], [11, 12, 10])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.multiple(metrics, _generation=0, _baseline={}, _published={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def publish(self, key, values, seen):
+        cache.set(key, {'seen': seen, 'values': values}, timeout=None)
+        registry = metrics._registry()
+        if key not in registry['processes']:
+            registry['processes'].append(key)
+        cache.set(metrics.REGISTRY_KEY, registry, timeout=None)
+
+    def test_exposition_format(self):
+        metrics.QUERIES.inc(answered_by='exposition-test')
+        metrics.QUERY_STAGE_SECONDS.observe(0.003, stage='exposition-test')
+
+        response = Client().get('/metrics')
+
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        lines = response.content.decode().splitlines()
+        for line in [
+            '# TYPE smartdocs_queries_total counter',
+            'smartdocs_queries_total{answered_by="exposition-test"} 1',
+            '# TYPE smartdocs_query_stage_seconds histogram',
+            'smartdocs_query_stage_seconds_bucket{stage="exposition-test",le="0.005"} 1',
+            'smartdocs_query_stage_seconds_bucket{stage="exposition-test",le="+Inf"} 1',
+            'smartdocs_query_stage_seconds_sum{stage="exposition-test"} 0.003',
+            'smartdocs_query_stage_seconds_count{stage="exposition-test"} 1',
+        ]:
+            self.assertIn(line, lines)
+
+    def test_scrapes_need_a_token_or_an_allowed_address(self):
+        self.assertEqual(Client().get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(Client().get('/metrics').status_code, 401)
+            response = Client().get('/metrics', REMOTE_ADDR='203.0.113.7', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+
+    def test_totals_do_not_drop_when_a_process_exits(self):
+        series = ('smartdocs_queries_total', ('exited-worker',))
+        key = f'{metrics.PROCESS_KEY_PREFIX}:other-host:1:0'
+        self.publish(key, {series: 5}, seen=time.time())
+        self.assertEqual(metrics.collect()[series], 5)
+
+        # The worker exits and its entry goes stale ...
+        self.publish(key, {series: 5}, seen=time.time() - 3600)
+        self.assertEqual(metrics.collect()[series], 5)
+        self.assertNotIn(key, metrics._registry()['processes'])
+
+        # ... and is deleted one stale period after being retired.
+        with mock.patch('documents.metrics.time.time', return_value=time.time() + 3600):
+            self.assertEqual(metrics.collect()[series], 5)
+        self.assertIsNone(cache.get(key))
+
+    def test_process_retired_while_alive_is_not_counted_twice(self):
+        series = ('smartdocs_queries_total', ('stalled-worker',))
+        metrics.QUERIES.inc(answered_by='stalled-worker')
+        metrics.flush()
+        key = metrics._process_key()
+        self.publish(key, cache.get(key)['values'], seen=time.time() - 3600)
+        metrics.retire_exited()
+
+        metrics.QUERIES.inc(answered_by='stalled-worker')
+
+        self.assertEqual(metrics.collect()[series], 2)
+        self.assertNotEqual(metrics._process_key(), key)
+
+    def test_concurrent_flushes_keep_every_process(self):
+        # One "process" per thread, all registering at once.
+        threads = [threading.Thread(target=metrics.flush, name=f'process-{i}') for i in range(8)]
+
+        def process_key():
+            return f'{metrics.PROCESS_KEY_PREFIX}:host:{threading.current_thread().name}:0'
+
+        with mock.patch.object(metrics, '_process_key', side_effect=process_key):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(
+            sorted(metrics._registry()['processes']),
+            sorted(f'{metrics.PROCESS_KEY_PREFIX}:host:{thread.name}:0' for thread in threads),
+        )
+
+
+class IndexCacheTests(SimpleTestCase):
+    def index(self, nbytes):
+        return mock.Mock(nbytes=nbytes, __len__=lambda self: 1)
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        indexes = IndexCache(max_bytes=300)
+        for document_id in (1, 2, 3):
+            indexes.put(document_id, 1, self.index(100))
+        indexes.get(1, 1)
+        indexes.put(4, 1, self.index(100))
+
+        self.assertIsNone(indexes.get(2, 1))
+        self.assertIsNotNone(indexes.get(1, 1))
+        self.assertEqual(indexes.stats()['bytes'], 300)
+        self.assertEqual(indexes.evictions, 1)
+
+    def test_index_larger_than_the_cache_is_not_kept(self):
+        indexes = IndexCache(max_bytes=300)
+        indexes.put(1, 1, self.index(100))
+        indexes.put(2, 1, self.index(400))
+        self.assertIsNone(indexes.get(2, 1))
+        self.assertIsNotNone(indexes.get(1, 1))
+
+    def test_older_chunks_version_is_a_miss(self):
+        indexes = IndexCache(max_bytes=300)
+        indexes.put(1, 1, self.index(100))
+
+        self.assertIsNone(indexes.get(1, 2))
+        self.assertEqual(indexes.stats()['entries'], 0)
+
+        rebuilt = self.index(100)
+        self.assertIs(indexes.get_or_build(1, 2, lambda: rebuilt), rebuilt)
+        self.assertIs(indexes.get_or_build(1, 2, self.fail), rebuilt)
+
+
+class AnswerCacheTests(TestCase):
+    key_args = (1, 3, 'What does  clause 3 say?', [{'role': 'user', 'content': 'Hi'}], 'flan-t5')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_keys_are_the_same_in_every_process(self):
+        script = (
+            'import django; django.setup()\n'
+            'from documents.answer_cache import make_key\n'
+            f'print(make_key(*{self.key_args!r}))\n'
+        )
+        keys = {
+            subprocess.run(
+                [sys.executable, '-c', script], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+                env=dict(os.environ, PYTHONHASHSEED=seed, DJANGO_SETTINGS_MODULE='smartdocs.settings'),
+            ).stdout.splitlines()[-1]
+            for seed in ('1', '2')
+        }
+        self.assertEqual(keys, {answer_cache.make_key(*self.key_args)})
+
+    def test_questions_differing_in_case_and_spacing_share_a_key(self):
+        document_id, version, _, history, model_name = self.key_args
+        self.assertEqual(
+            answer_cache.make_key(document_id, version, ' what does clause 3\nsay? ', history, model_name),
+            answer_cache.make_key(*self.key_args),
+        )
+
+    def test_reprocessed_document_is_answered_again(self):
+        llm = mock.Mock()
+        llm.invoke.return_value = 'Clause 3 covers payment.'
+        use_models(self, **{model_registry.HF_LLM: lambda: llm})
+        document = make_document()
+
+        def ask():
+            response = APIClient().post(
+                f'/api/documents/{document.id}/query/',
+                {'query': 'what does clause 3 say?', 'semantic_cache': False}, format='json',
+            )
+            self.assertEqual(response.data['answer'], 'Clause 3 covers payment.')
+
+        ask()
+        ask()
+        self.assertEqual(llm.invoke.call_count, 1)
+
+        Document.objects.filter(pk=document.pk).update(chunks_version=F('chunks_version') + 1)
+        ask()
+        self.assertEqual(llm.invoke.call_count, 2)
+
+
+@override_settings(SEMANTIC_CACHE_THRESHOLD=0.92, SEMANTIC_CACHE_MAX_ENTRIES=2)
+class SemanticCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.document = make_document()
+
+    def ask_earlier(self, embedding, answer='Earlier answer.'):
+        return Query.objects.create(
+            document=self.document, question='earlier question', answer=answer,
+            question_embedding=embedding, document_version=self.document.chunks_version, model_name='flan-t5',
+        )
+
+    def test_reuses_answers_at_or_above_the_threshold(self):
+        earlier = self.ask_earlier([1.0, 0.0])
+        close, far = np.arccos(0.93), np.arccos(0.9)
+
+        self.assertEqual(semantic_cache.find(self.document, [np.cos(close), np.sin(close)], 'flan-t5'), earlier)
+        self.assertIsNone(semantic_cache.find(self.document, [np.cos(far), np.sin(far)], 'flan-t5'))
+        self.assertIsNone(semantic_cache.find(self.document, [1.0, 0.0], 'another-model'))
+
+    def test_keeps_at_most_max_entries_per_document(self):
+        oldest = self.ask_earlier([1.0, 0.0])
+        self.ask_earlier([0.0, 1.0])
+        self.ask_earlier([1.0, 1.0])
+
+        self.assertEqual(semantic_cache.evict(self.document, 'flan-t5'), 1)
+        oldest.refresh_from_db()
+        self.assertIsNone(oldest.question_embedding)
+        self.assertEqual(Query.objects.filter(question_embedding__isnull=False).count(), 2)
+
+    def test_requests_can_opt_out(self):
+        llm = mock.Mock()
+        llm.invoke.return_value = 'Clause 3 covers payment.'
+        use_models(self, **{model_registry.HF_LLM: lambda: llm})
+
+        def ask(**data):
+            # Forget exact answers so only the semantic cache can answer.
+            cache.clear()
+            response = APIClient().post(
+                f'/api/documents/{self.document.id}/query/', dict(data, query='what does clause 3 say?'),
+                format='json',
+            )
+            self.assertEqual(response.data['answer'], 'Clause 3 covers payment.')
+
+        ask()
+        ask()
+        self.assertEqual(llm.invoke.call_count, 1)
+        ask(semantic_cache=False)
+        self.assertEqual(llm.invoke.call_count, 2)
+
+
+class DocumentSerializationTests(TestCase):
+    def setUp(self):
+        self.document = make_document()
+        Document.objects.filter(pk=self.document.pk).update(content='full text', embedding=[0.5] * 16)
+
+    def test_list_and_detail_leave_out_heavy_fields(self):
+        client = APIClient()
+        with CaptureQueriesContext(connection) as queries:
+            listed = client.get('/api/documents/').data
+            detail = client.get(f'/api/documents/{self.document.id}/').data
+
+        self.assertNotIn('content', listed[0])
+        self.assertNotIn('embedding', listed[0])
+        self.assertEqual(detail['content'], 'full text')
+        self.assertNotIn('embedding', detail)
+        self.assertFalse(any('"embedding"' in query['sql'] for query in queries.captured_queries))
+
+    def test_chunks_are_cursor_paginated_in_reading_order(self):
+        client = APIClient()
+        url = f'/api/documents/{self.document.id}/chunks/?page_size=4'
+        pages = []
+        while url:
+            data = client.get(url).data
+            self.assertTrue(all('embedding' not in chunk for chunk in data['results']))
+            pages.append([chunk['chunk_index'] for chunk in data['results']])
+            url = data['next']
+        self.assertEqual(pages, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+
+    def test_chunk_embeddings_are_opt_in(self):
+        data = APIClient().get(f'/api/documents/{self.document.id}/chunks/?include_embeddings=true').data
+
+        first = data['results'][0]
+        np.testing.assert_allclose(first['embedding'], FakeEmbeddings().embed_query(first['content']), rtol=1e-6)
+
+
+class PageExtractionTests(SimpleTestCase):
+    def pages(self):
+        rng = np.random.default_rng(0)
+        return [
+            (number, ' '.join(f'p{number}w{i}' for i in range(rng.integers(20, 200))))
+            for number in range(1, 31)
+        ]
+
+    def test_chunks_map_to_the_pages_their_text_came_from(self):
+        pages = self.pages()
+        for anchor_pages in (0, 4):
+            with self.subTest(anchor_pages=anchor_pages), override_settings(CHUNK_ANCHOR_PAGES=anchor_pages), \
+                    mock.patch('documents.processors.SPLIT_WINDOW_CHUNKS', 2):
+                chunks = list(DocumentProcessor(Document()).iter_chunks(iter(pages)))
+
+                words = set()
+                for text, page_start, page_end in chunks:
+                    numbers = [int(word[1:word.index('w')]) for word in text.split()]
+                    self.assertEqual((page_start, page_end), (numbers[0], numbers[-1]))
+                    words.update(text.split())
+                self.assertEqual(words, {word for _, text in pages for word in text.split()})
+                starts = [page_start for _, page_start, _ in chunks]
+                self.assertEqual(starts, sorted(starts))
+
+    def test_parallel_pdf_extraction_yields_pages_in_order(self):
+        def extract_range(file_path, start, stop):
+            # Later ranges finish first.
+            time.sleep(0.01 * (10 - start))
+            return [f'page {number + 1}' for number in range(start, stop)]
+
+        writer = PyPDF2.PdfWriter()
+        for _ in range(9):
+            writer.add_blank_page(width=72, height=72)
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf:
+            writer.write(pdf)
+            pdf.flush()
+            with mock.patch.object(extraction, 'extract_pdf_range', extract_range), \
+                    mock.patch.object(extraction, 'ProcessPoolExecutor',
+                                      lambda max_workers, mp_context: ThreadPoolExecutor(max_workers)):
+                pages = list(extraction.iter_pdf_pages(pdf.name, processes=4, min_parallel_pages=2, pages_per_task=2))
+
+        self.assertEqual(pages, [(number, f'page {number}') for number in range(1, 10)])
+
+
+class UploadDedupTests(TestCase):
+    data = b'%PDF-1.4 the same contract, uploaded twice'
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        enqueue = mock.patch.object(jobs, 'enqueue')
+        enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+    def test_upload_handler_digests_the_streamed_file(self):
+        request = mock.Mock(spec=[])
+        handler = HashingUploadHandler(request)
+        handler.new_file('file', 'contract.pdf', 'application/pdf', len(self.data))
+        for start in range(0, len(self.data), 8):
+            self.assertEqual(handler.receive_data_chunk(self.data[start:start + 8], start), self.data[start:start + 8])
+        self.assertIsNone(handler.file_complete(len(self.data)))
+
+        self.assertEqual(request.upload_digests, {'file': hashlib.sha256(self.data).hexdigest()})
+
+    def test_repeat_upload_shares_the_stored_file(self):
+        def upload():
+            response = APIClient().post('/api/documents/', {'file': SimpleUploadedFile('contract.pdf', self.data)})
+            self.assertEqual(response.status_code, 201)
+            return Document.objects.get(pk=response.data['id'])
+
+        first, second = upload(), upload()
+
+        self.assertEqual(first.content_hash, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(second.content_hash, first.content_hash)
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(os.listdir(os.path.dirname(first.file.path)), [os.path.basename(first.file.name)])
+
+    def test_processing_a_copy_reuses_the_source_chunks(self):
+        source = make_document(texts=['alpha', 'beta'])
+        Document.objects.filter(pk=source.pk).update(content='alpha beta', content_hash='same', chunks_version=1)
+        copy = Document.objects.create(title='copy.pdf', file=source.file.name, file_type='PDF', content_hash='same')
+
+        with mock.patch('documents.processors.embed_texts') as embed_texts:
+            DocumentProcessor(copy).process_document()
+
+        embed_texts.assert_not_called()
+        copy.refresh_from_db()
+        self.assertEqual(copy.content, 'alpha beta')
+        for original, copied in zip(source.chunks.order_by('chunk_index'), copy.chunks.order_by('chunk_index')):
+            self.assertEqual(copied.content, original.content)
+            np.testing.assert_array_equal(copied.embedding, original.embedding)
+
+
+class EmbeddingCacheTests(TestCase):
+    def test_cached_vectors_are_reused_per_backend(self):
+        use_models(self)
+
+        def embed(backend):
+            with override_settings(INFERENCE_BACKEND=backend), \
+                    mock.patch.object(embedding, 'encode', wraps=embedding.encode) as encode:
+                (texts, vectors), = embedding.embed_texts(['alpha', 'beta', 'alpha'], stream=False, use_cache=True)
+            return [call.args[0] for call in encode.call_args_list], vectors
+
+        encoded, vectors = embed('torch')
+        self.assertEqual(encoded, [['alpha', 'beta']])
+        np.testing.assert_array_equal(vectors[0], vectors[2])
+
+        encoded, cached = embed('torch')
+        self.assertEqual(encoded, [])
+        np.testing.assert_array_equal(cached, vectors)
+
+        encoded, _ = embed('onnx')
+        self.assertEqual(encoded, [['alpha', 'beta']])
+        self.assertEqual(
+            sorted(ChunkEmbedding.objects.values_list('model_name', flat=True).distinct()),
+            [f'{settings.EMBEDDING_MODEL_NAME}@onnx', f'{settings.EMBEDDING_MODEL_NAME}@torch'],
+        )
+
+
+@override_settings(PROMPT_MAX_TOKENS=300, PROMPT_HISTORY_TOKENS=512)
+class PromptBudgetTests(SimpleTestCase):
+    model_name = 'gemini-pro'  # no local tokenizer: tokens are estimated
+
+    def chunk(self, index, text=None):
+        return RetrievedChunk(text or f'clause {index} ' * 40, 1.0 - index / 100, chunk_id=index, chunk_index=index)
+
+    def test_chunks_fill_the_budget_in_rank_order(self):
+        chunks = [self.chunk(index) for index in (4, 1, 3, 0, 2)]
+
+        prompt = prompting.build_prompt('what about clause 3?', chunks, [], self.model_name)
+
+        self.assertEqual(prompt.chunks, chunks[:2])
+        self.assertLessEqual(prompt.tokens, 300)
+        self.assertLess(prompt.text.index('clause 1 '), prompt.text.index('clause 4 '))
+
+    def test_a_chunk_longer_than_the_budget_is_truncated(self):
+        prompt = prompting.build_prompt('what about clause 3?', [self.chunk(0, 'word ' * 1000)], [], self.model_name)
+
+        self.assertEqual(len(prompt.chunks), 1)
+        self.assertLess(len(prompt.chunks[0].text), 5000)
+        self.assertLessEqual(prompt.tokens, 300)
+
+    def test_oldest_history_turns_are_dropped_first(self):
+        history = [
+            {'role': 'user' if turn % 2 == 0 else 'assistant', 'content': f'turn {turn} ' + 'x' * 60}
+            for turn in range(10)
+        ]
+
+        prompt = prompting.build_prompt('and clause 3?', [], history, self.model_name)
+
+        kept = prompt.history_turns
+        self.assertTrue(0 < kept < 10)
+        self.assertIn(f'({10 - kept} earlier messages omitted)', prompt.text)
+        for turn in range(10):
+            self.assertEqual(f'turn {turn} ' in prompt.text, turn >= 10 - kept)
+        self.assertLessEqual(prompt.tokens, 300)
+
+    def test_overlap_between_adjacent_chunks_is_kept_once(self):
+        shared = 'the supplier shall deliver within thirty days'
+        first = self.chunk(3, 'Clause 3. Payment terms apply; ' + shared)
+        second = self.chunk(4, shared + ' of the order date.')
+
+        context = prompting.render_context([second, first])
+
+        self.assertEqual(context, 'Clause 3. Payment terms apply; ' + shared + ' of the order date.')
+
+
+class BatcherTests(SimpleTestCase):
+    def test_waiting_requests_are_generated_together(self):
+        started, release = threading.Event(), threading.Event()
+        batches = []
+
+        def generate(prompts):
+            batches.append(prompts)
+            started.set()
+            release.wait(5)
+            return [prompt.upper() for prompt in prompts]
+
+        batcher = batching.Batcher(generate, max_batch_size=3, max_wait=0.05)
+        first = batcher.submit('a')
+        self.assertTrue(started.wait(5))
+        waiting = [batcher.submit(prompt) for prompt in 'bcd']
+        release.set()
+
+        self.assertEqual([future.result(5) for future in [first] + waiting], ['A', 'B', 'C', 'D'])
+        self.assertEqual(batches, [['a'], ['b', 'c', 'd']])
+        self.assertEqual(batcher.stats()['mean_batch_size'], 2.0)
+
+    def test_generation_errors_reach_every_request_of_the_batch(self):
+        def generate(prompts):
+            if 'fail' in prompts:
+                raise ValueError('out of memory')
+            return prompts
+
+        batcher = batching.Batcher(generate, max_batch_size=2, max_wait=0.05)
+        futures = [batcher.submit('ok'), batcher.submit('fail')]
+
+        for future in futures:
+            with self.assertRaisesRegex(ValueError, 'out of memory'):
+                future.result(5)
+        self.assertEqual(batcher.submit('still running').result(5), 'still running')
+
+    def test_generation_server_round_trip(self):
+        def generate(prompts):
+            if 'fail' in prompts:
+                raise ValueError('out of memory')
+            return [prompt.upper() for prompt in prompts]
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            address = f'127.0.0.1:{probe.getsockname()[1]}'
+        server = threading.Thread(
+            target=batching.serve, args=(batching.Batcher(generate, max_wait=0), address, b'key'), daemon=True,
+        )
+        server.start()
+        llm = batching.BatchedLLM(remote=batching.RemoteBatcher(address, b'key'))
+        for _ in range(500):
+            try:
+                answer = llm.invoke('ok')
+                break
+            except ConnectionRefusedError:
+                # The server is not listening yet.
+                time.sleep(0.01)
+
+        self.assertEqual(answer, 'OK')
+        with self.assertRaisesRegex(RuntimeError, 'ValueError: out of memory'):
+            llm.invoke('fail')
+
+
+class InferenceBackendTests(TestCase):
+    def test_unknown_backend_lists_the_choices(self):
+        for load in (inference.load_embeddings, inference.load_generator):
+            with self.subTest(load=load.__name__), \
+                    self.assertRaisesRegex(ValueError, "Unknown INFERENCE_BACKEND 'cuda'.*torch, torch_int8, onnx"):
+                load('cuda')
+
+    def test_onnx_backend_without_onnx_runtime_names_the_requirements(self):
+        with mock.patch.dict(sys.modules, {'optimum': None, 'optimum.onnxruntime': None}):
+            for load in (inference.load_embeddings, inference.load_generator):
+                with self.subTest(load=load.__name__), self.assertRaisesRegex(ImportError, 'requirements-onnx.txt'):
+                    load('onnx')
+
+    def test_onnx_backend_without_an_export_names_the_command(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        optimum = mock.MagicMock()
+        with override_settings(ONNX_MODEL_DIR=directory.name), \
+                mock.patch.dict(sys.modules, {'optimum': optimum, 'optimum.onnxruntime': optimum.onnxruntime}):
+            for load in (inference.load_embeddings, inference.load_generator):
+                with self.subTest(load=load.__name__), self.assertRaisesRegex(ValueError, 'export_onnx_models'):
+                    load('onnx_int8')
+
+    def test_queries_fail_cleanly_and_the_failed_load_is_not_kept(self):
+        use_models(self, **{model_registry.EMBEDDINGS: model_registry._load_embeddings})
+        document = make_document()
+
+        def ask():
+            return APIClient().post(f'/api/documents/{document.id}/query/', {'query': 'clause 3?'}, format='json')
+
+        with override_settings(INFERENCE_BACKEND='cuda'):
+            response = ask()
+        self.assertEqual((response.status_code, response.data), (500, query_api.QUERY_FAILED[0]))
+        self.assertFalse(model_registry.is_loaded(model_registry.EMBEDDINGS))
+
+
+@override_settings(RERANK_MAX_CONCURRENT=1, RERANK_BUDGET_MS=20)
+class RerankTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.multiple(rerank, _in_flight=0, _pair_ms=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.reranker = mock.Mock()
+        # Longer texts are more relevant.
+        self.reranker.predict.side_effect = lambda pairs, **kwargs: [len(text) for _, text in pairs]
+        use_models(self, **{model_registry.RERANKER: lambda: self.reranker})
+        self.chunks = [
+            RetrievedChunk('x' * length, 1.0 - rank / 10, chunk_id=rank) for rank, length in enumerate((1, 3, 2, 4))
+        ]
+
+    def chunk_ids(self, chunks):
+        return [chunk.chunk_id for chunk in chunks]
+
+    def test_candidates_are_reordered_and_scores_cached(self):
+        chunks, outcome = rerank.rerank('clause 3?', self.chunks, top_k=3)
+        self.assertEqual((self.chunk_ids(chunks), outcome), ([3, 1, 2], 'reranked'))
+
+        chunks, outcome = rerank.rerank('Clause  3?', self.chunks, top_k=3)
+        self.assertEqual((self.chunk_ids(chunks), outcome), ([3, 1, 2], 'reranked'))
+        self.assertEqual(self.reranker.predict.call_count, 1)
+
+    def test_skipped_when_too_many_reranks_are_running(self):
+        with mock.patch.object(rerank, '_in_flight', 1):
+            chunks, outcome = rerank.rerank('clause 3?', self.chunks, top_k=3)
+
+        self.assertEqual((self.chunk_ids(chunks), outcome), ([0, 1, 2], 'skipped_load'))
+        self.reranker.predict.assert_not_called()
+
+    def test_only_candidates_within_the_budget_are_rescored(self):
+        with mock.patch.object(rerank, '_pair_ms', 10.0):
+            chunks, outcome = rerank.rerank('clause 3?', self.chunks, top_k=4)
+        self.assertEqual((self.chunk_ids(chunks), outcome), ([1, 0, 2, 3], 'partial'))
+
+        with mock.patch.object(rerank, '_pair_ms', 100.0):
+            chunks, outcome = rerank.rerank('another question', self.chunks, top_k=3)
+        self.assertEqual((self.chunk_ids(chunks), outcome), ([0, 1, 2], 'skipped_budget'))
+
+    def test_failures_fall_back_to_retrieval_order(self):
+        self.reranker.predict.side_effect = RuntimeError('model crashed')
+
+        chunks, outcome = rerank.rerank('clause 3?', self.chunks, top_k=3)
+
+        self.assertEqual((self.chunk_ids(chunks), outcome), ([0, 1, 2], 'failed'))
+        self.assertEqual(rerank._in_flight, 0)
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0, PROFILING_MAX_PER_MINUTE=10)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        profiles = override_settings(PROFILING_DIR=self.directory)
+        profiles.enable()
+        self.addCleanup(profiles.disable)
+        patcher = mock.patch.object(profiling, '_recent', deque())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, **headers):
+        return Client().get('/api/documents/', **headers)
+
+    def staff_headers(self, is_staff=True):
+        user = User.objects.create_user(f'staff-{is_staff}', password='x', is_staff=is_staff)
+        return {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(user).access_token}',
+                'HTTP_X_SMARTDOCS_PROFILE': '1'}
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled_requests_are_saved_under_the_returned_id(self):
+        response = self.get()
+
+        profile_id = response[profiling.RESPONSE_HEADER]
+        self.assertTrue(os.path.exists(os.path.join(self.directory, profile_id + '.folded')))
+        with open(os.path.join(self.directory, profile_id + '.json')) as file:
+            summary = json.load(file)
+        self.assertEqual((summary['path'], summary['status'], summary['reason']), ('/api/documents/', 200, 'sample'))
+        self.assertGreater(summary['sql_count'], 0)
+
+    def test_only_staff_can_ask_for_a_profile(self):
+        self.assertNotIn(profiling.RESPONSE_HEADER, self.get(**self.staff_headers(is_staff=False)))
+        self.assertIn(profiling.RESPONSE_HEADER, self.get(**self.staff_headers()))
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_MAX_PER_MINUTE=2)
+    def test_profiles_are_rate_limited_and_one_at_a_time(self):
+        self.assertEqual(
+            [profiling.RESPONSE_HEADER in self.get() for _ in range(3)],
+            [True, True, False],
+        )
+        profiling._recent.clear()
+        with profiling._busy:
+            self.assertNotIn(profiling.RESPONSE_HEADER, self.get())
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_MAX_PROFILES=2)
+    def test_only_the_newest_profiles_are_kept(self):
+        profile_ids = [self.get()[profiling.RESPONSE_HEADER] for _ in range(3)]
+
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            sorted(f'{profile_id}{suffix}' for profile_id in profile_ids[1:] for suffix in ('.folded', '.json')),
+        )
@@ -0,0 +1,39 @@
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """SHA-256 every uploaded file while it streams in.
+
+    Must come first in ``FILE_UPLOAD_HANDLERS``: it passes each chunk on
+    unchanged to the memory/temporary-file handlers that actually store the
+    upload.  Digests end up in ``request.upload_digests`` keyed by field name.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_digests'):
+            self.request.upload_digests = {}
+        self.request.upload_digests[self.field_name] = self.hasher.hexdigest()
+        # Let the next handler build the file object.
+        return None
+
+
+def file_digest(request, field_name: str, file) -> str:
+    """Digest recorded by ``HashingUploadHandler``, or computed from ``file``."""
+    digest = getattr(request, 'upload_digests', {}).get(field_name)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
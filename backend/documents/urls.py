@@ -1,11 +1,22 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import DocumentViewSet, QueryViewSet
 
 router = DefaultRouter()
 router.register(r'documents', DocumentViewSet, basename='document')
 router.register(r'queries', QueryViewSet, basename='query')
 
-urlpatterns = [
+urlpatterns = []
+if settings.ASYNC_QUERY_VIEW and settings.SERVING_ASGI:
+    # Takes over the router's ``query`` actions when serving through ASGI;
+    # under WSGI the async views would run on a per-request event loop.
+    urlpatterns += [
+        path('documents/<int:pk>/query/', async_views.query, name='document-query-async'),
+        path('documents/<int:pk>/query/stream/', async_views.query_stream, name='document-query-stream-async'),
+    ]
+
+urlpatterns += [
     path('', include(router.urls)),
-] 
\ No newline at end of file
+] 
@@ -0,0 +1,472 @@
+"""Persistent approximate-nearest-neighbour (IVF) index over chunk embeddings.
+
+Chunks from every document are partitioned into ``nlist`` inverted lists by a
+spherical k-means coarse quantiser.  A search scores the query against the
+centroids, probes the ``nprobe`` closest lists and ranks only their vectors,
+so latency grows with ``n / nlist * nprobe`` instead of with ``n``.  Until the
+index holds ``VECTOR_INDEX_TRAIN_THRESHOLD`` vectors there are no centroids and
+every list is searched (exact search); each document's vectors then form a
+list of their own, so adding a document writes only its vectors.
+
+On-disk layout (``settings.VECTOR_INDEX_DIR``)::
+
+    manifest.json                 dim, list generations, document -> lists map
+    centroids-<gen>.npy           (nlist, dim) float32
+    list-<id>-<gen>.vectors.npy   (m, dim) float32, L2-normalised
+    list-<id>-<gen>.ids.npy       (m, 3) int64: chunk id, document id, owner id
+
+Files are never modified in place: an update writes new generations of the
+touched lists and then atomically replaces the manifest, so readers in other
+worker processes always see a consistent snapshot.  List files are memory
+mapped, letting workers share them through the page cache.  Writers serialise
+on an ``fcntl`` lock file.
+"""
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .retrieval import top_k
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ANONYMOUS_OWNER = -1
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 256
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.array(matrix, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means over (a sample of) normalised ``vectors``."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * KMEANS_SAMPLES_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = np.bincount(assignments, minlength=nlist) == 0
+        # Re-seed empty lists so every centroid stays useful.
+        sums[empty] = sample[rng.integers(len(sample), size=int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class _StaleSnapshot(Exception):
+    """The manifest was reloaded while a search was probing lists."""
+
+
+class VectorStore:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._manifest: Optional[dict] = None
+        self._manifest_mtime = None
+        self._centroids: Optional[np.ndarray] = None
+        self._centroids_generation: Optional[int] = None
+        # (list id, generation) -> memory-mapped (vectors, ids)
+        self._lists: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]] = {}
+
+    # -- disk ---------------------------------------------------------------
+
+    @property
+    def _manifest_path(self) -> Path:
+        return self.path / 'manifest.json'
+
+    def _empty_manifest(self) -> dict:
+        return {'dim': None, 'generation': 0, 'centroids': None, 'lists': {}, 'documents': {}}
+
+    def _refresh(self) -> None:
+        """Reload the manifest if another process replaced it."""
+        try:
+            mtime = self._manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._manifest is not None and mtime == self._manifest_mtime:
+            return
+        if mtime is None:
+            manifest = self._empty_manifest()
+        else:
+            with open(self._manifest_path) as f:
+                manifest = json.load(f)
+        if self._manifest is not None and manifest['generation'] < self._manifest['generation']:
+            # The index was rebuilt from scratch; generation numbers restart.
+            self._lists = {}
+            self._centroids_generation = None
+        self._manifest = manifest
+        self._manifest_mtime = mtime
+        if manifest['centroids'] != self._centroids_generation:
+            self._centroids = (
+                np.load(self.path / f"centroids-{manifest['centroids']}.npy")
+                if manifest['centroids'] is not None else None
+            )
+            self._centroids_generation = manifest['centroids']
+        # Keep the maps of lists this manifest did not rewrite: below the
+        # training threshold there is one list per document, and a search
+        # should not reopen all of them after every ingestion.
+        live = {(int(list_id), generation) for list_id, generation in manifest['lists'].items()}
+        self._lists = {key: data for key, data in self._lists.items() if key in live}
+
+    def _list_files(self, list_id: int, generation: int) -> Tuple[Path, Path]:
+        stem = f'list-{list_id}-{generation}'
+        return self.path / f'{stem}.vectors.npy', self.path / f'{stem}.ids.npy'
+
+    def _get_list(self, list_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        generation = self._manifest['lists'].get(str(list_id))
+        if generation is None:
+            return np.empty((0, self._manifest['dim'] or 0), dtype=np.float32), np.empty((0, 3), dtype=np.int64)
+        cached = self._lists.get((list_id, generation))
+        if cached is not None:
+            return cached
+        vectors_path, ids_path = self._list_files(list_id, generation)
+        data = (np.load(vectors_path, mmap_mode='r'), np.load(ids_path, mmap_mode='r'))
+        self._lists[(list_id, generation)] = data
+        return data
+
+    def _write_npy(self, path: Path, array: np.ndarray) -> None:
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.path / '.lock', 'w') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._refresh()
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _commit(self, manifest: dict, new_lists: Dict[int, Tuple[np.ndarray, np.ndarray]],
+                centroids: Optional[np.ndarray] = None) -> None:
+        """Write new list generations, then swap the manifest and drop old files."""
+        generation = manifest['generation'] + 1
+        old_files = []
+        if centroids is not None:
+            self._write_npy(self.path / f'centroids-{generation}.npy', centroids.astype(np.float32))
+            if manifest['centroids'] is not None:
+                old_files.append(self.path / f"centroids-{manifest['centroids']}.npy")
+            manifest['centroids'] = generation
+        for list_id, (vectors, ids) in new_lists.items():
+            old_generation = manifest['lists'].get(str(list_id))
+            if old_generation is not None:
+                old_files.extend(self._list_files(list_id, old_generation))
+            if len(ids):
+                vectors_path, ids_path = self._list_files(list_id, generation)
+                self._write_npy(vectors_path, np.ascontiguousarray(vectors, dtype=np.float32))
+                self._write_npy(ids_path, np.ascontiguousarray(ids, dtype=np.int64))
+                manifest['lists'][str(list_id)] = generation
+            else:
+                manifest['lists'].pop(str(list_id), None)
+        manifest['generation'] = generation
+
+        tmp = self._manifest_path.with_name('manifest.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self._manifest_path)
+        for path in old_files:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        # Force a reload so this process sees exactly what is on disk.
+        self._manifest = None
+        self._refresh()
+
+    # -- updates --------------------------------------------------------------
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if self._centroids is None:
+            return np.zeros(len(vectors), dtype=np.int64)
+        return np.argmax(vectors @ self._centroids.T, axis=1)
+
+    def replace_document(self, document_id: int, owner_id: Optional[int],
+                         chunk_ids: Iterable[int], embeddings: Iterable) -> None:
+        """Drop any vectors of ``document_id`` and add its current chunks."""
+        with self._write_lock():
+            manifest = json.loads(json.dumps(self._manifest))
+            new_lists = self._without_document(manifest, document_id)
+            touched = self._add_vectors(manifest, new_lists, document_id, owner_id, chunk_ids, embeddings)
+            if touched:
+                manifest['documents'][str(document_id)] = touched
+            self._commit(manifest, new_lists)
+        self._maybe_train()
+
+    def update_document(self, document_id: int, owner_id: Optional[int],
+                        chunk_ids: Iterable[int], embeddings: Iterable,
+                        removed_chunk_ids: Iterable[int]) -> None:
+        """Remove some chunks of ``document_id`` and add others.
+
+        Only the lists holding removed or added vectors are rewritten; the
+        document's other vectors stay where they are.
+        """
+        removed = np.asarray(list(removed_chunk_ids), dtype=np.int64)
+        with self._write_lock():
+            manifest = json.loads(json.dumps(self._manifest))
+            new_lists = {}
+            kept = []
+            for list_id in manifest['documents'].pop(str(document_id), []):
+                vectors, ids = self._get_list(list_id)
+                own = ids[:, 1] == document_id
+                drop = own & np.isin(ids[:, 0], removed)
+                if drop.any():
+                    new_lists[list_id] = (vectors[~drop], ids[~drop])
+                if (own & ~drop).any():
+                    kept.append(list_id)
+            touched = self._add_vectors(manifest, new_lists, document_id, owner_id, chunk_ids, embeddings)
+            lists = sorted(set(kept) | set(touched))
+            if lists:
+                manifest['documents'][str(document_id)] = lists
+            self._commit(manifest, new_lists)
+        self._maybe_train()
+
+    def _add_vectors(self, manifest: dict, new_lists: Dict[int, Tuple[np.ndarray, np.ndarray]],
+                     document_id: int, owner_id: Optional[int],
+                     chunk_ids: Iterable[int], embeddings: Iterable) -> List[int]:
+        """Append vectors to their lists in ``new_lists``; return the list ids."""
+        chunk_ids = np.asarray(list(chunk_ids), dtype=np.int64)
+        embeddings = list(embeddings)
+        if not embeddings:
+            return []
+        vectors = _normalize(np.vstack(embeddings))
+        owner = ANONYMOUS_OWNER if owner_id is None else owner_id
+        if manifest['dim'] is None:
+            manifest['dim'] = int(vectors.shape[1])
+
+        touched = []
+        if self._centroids is None:
+            # Untrained: append to a list of this document's own (one being
+            # rewritten anyway, or a new one) instead of rewriting shared lists.
+            list_id = next(
+                (list_id for list_id, (_, ids) in new_lists.items() if len(ids) and (ids[:, 1] == document_id).all()),
+                max([int(list_id) for list_id in manifest['lists']] + list(new_lists), default=-1) + 1,
+            )
+            assignments = np.full(len(vectors), list_id, dtype=np.int64)
+        else:
+            assignments = self._assign(vectors)
+        for list_id in np.unique(assignments):
+            list_id = int(list_id)
+            mask = assignments == list_id
+            ids = np.column_stack([
+                chunk_ids[mask],
+                np.full(mask.sum(), document_id, dtype=np.int64),
+                np.full(mask.sum(), owner, dtype=np.int64),
+            ])
+            current_vectors, current_ids = new_lists.get(list_id) or self._get_list(list_id)
+            if len(current_ids):
+                new_lists[list_id] = (
+                    np.concatenate([current_vectors, vectors[mask]]),
+                    np.concatenate([current_ids, ids]),
+                )
+            else:
+                new_lists[list_id] = (vectors[mask], ids)
+            touched.append(list_id)
+        return touched
+
+    def _maybe_train(self) -> None:
+        if self._centroids is None and len(self) >= settings.VECTOR_INDEX_TRAIN_THRESHOLD:
+            self.train(retrain=False)
+
+    def remove_document(self, document_id: int) -> None:
+        with self._write_lock():
+            if str(document_id) not in self._manifest['documents']:
+                return
+            manifest = json.loads(json.dumps(self._manifest))
+            self._commit(manifest, self._without_document(manifest, document_id))
+
+    def _without_document(self, manifest: dict, document_id: int) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        new_lists = {}
+        for list_id in manifest['documents'].pop(str(document_id), []):
+            vectors, ids = self._get_list(list_id)
+            keep = ids[:, 1] != document_id
+            new_lists[list_id] = (vectors[keep], ids[keep])
+        return new_lists
+
+    def train(self, nlist: Optional[int] = None, retrain: bool = True) -> None:
+        """(Re)train the coarse quantiser and redistribute every vector.
+
+        With ``retrain=False`` an index that is already trained is left alone.
+        """
+        with self._write_lock():
+            if not retrain and self._centroids is not None:
+                return
+            manifest = json.loads(json.dumps(self._manifest))
+            list_ids = [int(list_id) for list_id in manifest['lists']]
+            if not list_ids:
+                return
+            vectors = np.concatenate([self._get_list(list_id)[0] for list_id in list_ids])
+            ids = np.concatenate([self._get_list(list_id)[1] for list_id in list_ids])
+            nlist = nlist or max(1, int(np.sqrt(len(vectors))))
+            nlist = min(nlist, len(vectors))
+            centroids = train_centroids(vectors, nlist)
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+
+            new_lists = {list_id: (vectors[:0], ids[:0]) for list_id in list_ids}
+            manifest['documents'] = {}
+            for list_id in range(nlist):
+                mask = assignments == list_id
+                new_lists[list_id] = (vectors[mask], ids[mask])
+                for document_id in np.unique(ids[mask, 1]):
+                    manifest['documents'].setdefault(str(int(document_id)), []).append(list_id)
+            self._commit(manifest, new_lists, centroids=centroids)
+        logger.info(f"Trained vector index with {nlist} lists over {len(vectors)} vectors")
+
+    # -- queries --------------------------------------------------------------
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return sum(len(self._get_list(int(list_id))[1]) for list_id in self._manifest['lists'])
+
+    def search(self, query_embedding, k: int = 10, owner_id: Optional[int] = None,
+               nprobe: Optional[int] = None) -> List[Tuple[int, int, float]]:
+        """Return ``(chunk_id, document_id, score)`` for the ``k`` best chunks.
+
+        ``owner_id`` restricts results to one owner (``ANONYMOUS_OWNER`` for
+        documents uploaded without a user); ``None`` searches everything.  As
+        an owner's chunks may sit in none of the ``nprobe`` nearest lists, the
+        probe then doubles until ``k`` of their chunks were seen or every list
+        was searched.
+        """
+        query = _normalize(query_embedding)[0]
+        nprobe = nprobe or settings.VECTOR_INDEX_NPROBE
+        for attempt in range(2):
+            try:
+                return self._search(query, k, owner_id, nprobe)
+            except (FileNotFoundError, _StaleSnapshot):
+                # Another process committed a new generation under us.
+                with self._lock:
+                    self._manifest = None
+                if attempt:
+                    raise
+
+    def _search(self, query: np.ndarray, k: int, owner_id: Optional[int],
+                nprobe: int) -> List[Tuple[int, int, float]]:
+        with self._lock:
+            self._refresh()
+            manifest = self._manifest
+            if self._centroids is None:
+                order = [int(list_id) for list_id in manifest['lists']]
+                nprobe = len(order)
+            else:
+                order = np.argsort(-(self._centroids @ query), kind='stable').tolist()
+
+        all_scores, all_ids = [], []
+        found = 0
+        start = 0
+        while start < len(order):
+            with self._lock:
+                if self._manifest is not manifest:
+                    raise _StaleSnapshot()
+                lists = [self._get_list(list_id) for list_id in order[start:start + nprobe]]
+            start += nprobe
+            for vectors, ids in lists:
+                if owner_id is not None:
+                    mask = ids[:, 2] == owner_id
+                    if not mask.any():
+                        continue
+                    vectors, ids = vectors[mask], ids[mask]
+                all_scores.append(vectors @ query)
+                all_ids.append(ids)
+                found += len(ids)
+            if owner_id is None or found >= k:
+                break
+            nprobe *= 2
+        if not all_scores:
+            return []
+        scores = np.concatenate(all_scores)
+        ids = np.concatenate(all_ids)
+        best = top_k(scores, k)
+        return [(int(ids[i, 0]), int(ids[i, 1]), float(scores[i])) for i in best]
+
+    def document_ids(self) -> List[int]:
+        with self._lock:
+            self._refresh()
+            return [int(document_id) for document_id in self._manifest['documents']]
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            return {
+                'vectors': len(self),
+                'lists': len(self._manifest['lists']),
+                'trained': self._centroids is not None,
+                'documents': len(self._manifest['documents']),
+            }
+
+
+_store: Optional[VectorStore] = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store() -> VectorStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = VectorStore(settings.VECTOR_INDEX_DIR)
+    return _store
+
+
+def index_document(document_id: int) -> None:
+    """Sync the vector index with the stored chunks of ``document_id``."""
+    from .models import Document
+
+    document = Document.objects.only('id', 'uploaded_by_id').get(pk=document_id)
+    chunks = list(
+        document.chunks.exclude(embedding__isnull=True).values_list('id', 'embedding')
+    )
+    get_vector_store().replace_document(
+        document.id,
+        document.uploaded_by_id,
+        [chunk_id for chunk_id, _ in chunks],
+        [embedding for _, embedding in chunks],
+    )
+
+
+def index_document_changes(document_id: int, added_chunk_ids: Iterable[int],
+                           removed_chunk_ids: Iterable[int]) -> None:
+    """Apply an incremental re-index of ``document_id`` to the vector index."""
+    from .models import Document, DocumentChunk
+
+    store = get_vector_store()
+    if document_id not in store.document_ids():
+        # Never indexed (or index rebuilt without it): index everything.
+        index_document(document_id)
+        return
+    owner_id = Document.objects.filter(pk=document_id).values_list('uploaded_by_id', flat=True).get()
+    added = list(
+        DocumentChunk.objects.filter(pk__in=list(added_chunk_ids), embedding__isnull=False)
+        .values_list('id', 'embedding')
+    )
+    store.update_document(
+        document_id,
+        owner_id,
+        [chunk_id for chunk_id, _ in added],
+        [embedding for _, embedding in added],
+        removed_chunk_ids,
+    )
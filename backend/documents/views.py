@@ -4,34 +4,37 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from django.core.cache import cache
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-import json
-import threading
 import logging
+import time
 from django.core.exceptions import ValidationError
 from rest_framework.exceptions import APIException
+from rest_framework.settings import api_settings
 from django.conf import settings
-import numpy as np
-import os
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
-from langchain_community.llms import HuggingFacePipeline
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from .models import Document, DocumentChunk, Query
-from .serializers import DocumentSerializer, DocumentChunkSerializer, QuerySerializer
-from .processors import process_document
-from .throttling import DocumentUploadRateThrottle, QueryRateThrottle, AnonQueryRateThrottle
-from langchain.memory import ConversationBufferMemory
-from langchain.schema import BaseRetriever, Document as LCDocument
-from typing import List, Any
-from pydantic import Field
-from langchain.prompts import PromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
+from .serializers import (
+    DocumentSerializer,
+    DocumentListSerializer,
+    DocumentChunkSerializer,
+    DocumentChunkEmbeddingSerializer,
+    QuerySerializer,
+)
+from .pagination import ChunkCursorPagination
+from .uploadhandlers import file_digest
+from . import answer_cache, dedup, jobs, metrics, model_registry, query_api
+from .index_cache import index_cache
+from .throttling import DocumentUploadRateThrottle
 
 logger = logging.getLogger(__name__)
 
+# The query/search services (qa, semantic_cache, vector_store) pull in NumPy
+# and the model stack, so they are imported inside the actions that use them
+# to keep URLconf loading light for workers that never answer queries.
+
 ALLOWED_FILE_TYPES = ['PDF', 'DOCX', 'DOC']
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_SEARCH_RESULTS = 50
+# Actions whose responses include the full extracted text of the document
+DOCUMENT_CONTENT_ACTIONS = ('retrieve', 'create', 'update', 'partial_update')
 
 class APIKeyError(APIException):
     status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -46,38 +49,40 @@ class DocumentViewSet(viewsets.ModelViewSet):
     def get_throttles(self):
         """Return throttle instances depending on the current action.
 
-        • ``create`` (POST /documents/)  → limit uploads via
+        • ``create`` / ``revise`` (file uploads)  → limit uploads via
           ``DocumentUploadRateThrottle``.
-        • ``query``  → stricter limits, with different caps for authenticated vs
+        • ``query`` / ``query_stream``  → stricter limits, with different caps for authenticated vs
           anonymous users.
         • All other actions (e.g. ``status`` or ``retrieve``)  → *no* rate-limit
           so the frontend can poll freely without hitting 429 errors while a
           document is processing.
         """
-        if self.action == 'create':
+        if self.action in ('create', 'revise'):
             return [DocumentUploadRateThrottle()]
 
-        if self.action == 'query':
-            if self.request.user.is_authenticated:
-                return [QueryRateThrottle()]
-            return [AnonQueryRateThrottle()]
+        if self.action in ('query', 'query_stream', 'search'):
+            return query_api.query_throttles(self.request.user)
 
         # No throttling for other actions such as `status`.
         return []
     
     def get_queryset(self):
-        """Return documents depending on authentication status.
+        """Return the caller's documents (see ``query_api.document_queryset``).
 
-        When a user is authenticated we show only their documents.  When the
-        request is anonymous we instead return documents that were uploaded
-        without an owner (``uploaded_by`` is NULL).  This prevents Django from
-        trying to compare the ForeignKey to an ``AnonymousUser`` instance,
-        which was raising the *Field 'id' expected a number* error.
+        The full extracted text is only loaded where the response includes it.
         """
-        if self.request.user.is_authenticated:
-            return Document.objects.filter(uploaded_by=self.request.user)
-        # Anonymous – return documents that were uploaded without a user
-        return Document.objects.filter(uploaded_by__isnull=True)
+        queryset = query_api.document_queryset(
+            self.request.user,
+            with_content=self.action in DOCUMENT_CONTENT_ACTIONS,
+        )
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.select_related('uploaded_by')
+        return queryset
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return DocumentListSerializer
+        return DocumentSerializer
     
     def validate_file(self, file):
         """Validate uploaded file."""
@@ -106,46 +111,22 @@ class DocumentViewSet(viewsets.ModelViewSet):
             self.validate_api_key()
             
             user = self.request.user if self.request.user.is_authenticated else None
+            # Identical files share one stored copy; ingestion then reuses the
+            # earlier document's chunks.
+            content_hash = file_digest(self.request, 'file', file)
+            duplicate = dedup.find_duplicate(content_hash)
+            dedup.record_upload(duplicate is not None)
             # Save the document
             document = serializer.save(
                 uploaded_by=user,
-                file=file,
+                file=duplicate.file.name if duplicate is not None else file,
                 file_type=file_type,
-                title=file.name
+                title=file.name,
+                content_hash=content_hash,
             )
             
-            # Start processing in background
-            def process_in_background():
-                try:
-                    process_document(document.id)
-                    # Notify user through WebSocket when processing is complete
-                    channel_layer = get_channel_layer()
-                    if channel_layer is not None and document.uploaded_by:
-                        async_to_sync(channel_layer.group_send)(
-                            f"user_{document.uploaded_by.id}",
-                            {
-                                "type": "document.processed",
-                                "document_id": document.id,
-                                "status": "completed"
-                            }
-                        )
-                except Exception as e:
-                    logger.error(f"Error processing document {document.id}: {str(e)}")
-                    channel_layer = get_channel_layer()
-                    if channel_layer is not None and document.uploaded_by:
-                        async_to_sync(channel_layer.group_send)(
-                            f"user_{document.uploaded_by.id}",
-                            {
-                                "type": "document.processed",
-                                "document_id": document.id,
-                                "status": "error",
-                                "error": str(e)
-                            }
-                        )
-            
-            # Start background processing
-            thread = threading.Thread(target=process_in_background)
-            thread.start()
+            # Queue for processing by the ingestion workers
+            jobs.enqueue(document)
             
             return Response(DocumentSerializer(document).data, status=status.HTTP_201_CREATED)
             
@@ -160,227 +141,263 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    def perform_destroy(self, instance):
+        document_id = instance.id
+        instance.delete()
+        index_cache.invalidate(document_id)
+        if settings.VECTOR_INDEX_ENABLED:
+            from .vector_store import get_vector_store
+            try:
+                get_vector_store().remove_document(document_id)
+            except Exception as e:
+                logger.error(f"Failed to remove document {document_id} from vector index: {str(e)}")
+    
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def stats(self, request):
+        """Per-worker cache counters and model load figures (staff only)."""
+        from . import rerank, semantic_cache
+        from .vector_store import get_vector_store
+
+        return Response({
+            'index_cache': index_cache.stats(),
+            'answer_cache': answer_cache.stats(),
+            'semantic_cache': semantic_cache.stats(),
+            'rerank': rerank.stats(),
+            'models': model_registry.stats(),
+            'vector_index': get_vector_store().stats() if settings.VECTOR_INDEX_ENABLED else None,
+            'ingestion_queue_depth': jobs.queue_depth(),
+            'dedup': dedup.stats(),
+        })
+    
+    @action(detail=False, methods=['get', 'post'])
+    def search(self, request):
+        """Search chunks across all of the caller's documents.
+
+        Accepts ``q`` (or ``query``) and optional ``k`` either as query
+        parameters or in the request body.
+        """
+        if not settings.VECTOR_INDEX_ENABLED:
+            return Response({'error': 'Search is not enabled'}, status=status.HTTP_404_NOT_FOUND)
+
+        params = request.data if request.method == 'POST' else request.query_params
+        query = params.get('q') or params.get('query')
+        if not query:
+            return Response({'error': 'No query provided'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            k = max(1, min(int(params.get('k', 10)), MAX_SEARCH_RESULTS))
+        except (TypeError, ValueError):
+            return Response({'error': 'k must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        from .vector_store import ANONYMOUS_OWNER, get_vector_store
+
+        owner_id = request.user.id if request.user.is_authenticated else ANONYMOUS_OWNER
+        query_embedding = model_registry.get_embeddings().embed_query(query)
+        hits = get_vector_store().search(query_embedding, k=k, owner_id=owner_id)
+
+        # Re-check ownership against the database; the index may briefly hold
+        # chunks of documents that were deleted or re-processed.
+        chunks = {
+            chunk.id: chunk
+            for chunk in DocumentChunk.objects.filter(
+                id__in=[chunk_id for chunk_id, _, _ in hits],
+                document__in=self.get_queryset(),
+            ).select_related('document').only(
+                'id', 'content', 'chunk_index', 'page_start', 'page_end',
+                'document__id', 'document__title',
+            )
+        }
+        results = [
+            {
+                'chunk_id': chunk_id,
+                'document_id': document_id,
+                'document_title': chunks[chunk_id].document.title,
+                'chunk_index': chunks[chunk_id].chunk_index,
+                'page_start': chunks[chunk_id].page_start,
+                'page_end': chunks[chunk_id].page_end,
+                'content': chunks[chunk_id].content,
+                'score': score,
+            }
+            for chunk_id, document_id, score in hits
+            if chunk_id in chunks
+        ]
+        return Response({'query': query, 'results': results})
+    
     @action(detail=True, methods=['get'])
     def chunks(self, request, pk=None):
+        """Page through the document's chunks (cursor-paginated).
+
+        Embeddings are left out unless ``?include_embeddings=true`` is passed.
+        """
         document = self.get_object()
+        include_embeddings = request.query_params.get('include_embeddings', '').lower() in ('1', 'true', 'yes')
         chunks = document.chunks.all()
-        serializer = DocumentChunkSerializer(chunks, many=True)
-        return Response(serializer.data)
+        if include_embeddings:
+            serializer_class = DocumentChunkEmbeddingSerializer
+        else:
+            chunks = chunks.defer('embedding')
+            serializer_class = DocumentChunkSerializer
+
+        paginator = ChunkCursorPagination()
+        page = paginator.paginate_queryset(chunks, request, view=self)
+        serializer = serializer_class(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
     
+    @action(detail=True, methods=['post'])
+    def revise(self, request, pk=None):
+        """Replace the document's file with a new version and re-index it.
+
+        Re-indexing is incremental: chunks whose text is unchanged keep their
+        embeddings, so a small edit only embeds the chunks it touched.
+        """
+        document = self.get_object()
+        try:
+            file = request.FILES.get('file')
+            file_type = self.validate_file(file)
+            self.validate_api_key()
+
+            content_hash = file_digest(request, 'file', file)
+            if content_hash == document.content_hash:
+                return Response({'document_id': document.id, 'status': 'unchanged'})
+            duplicate = dedup.find_duplicate(content_hash)
+            dedup.record_upload(duplicate is not None)
+            document.file = duplicate.file.name if duplicate is not None else file
+            document.file_type = file_type
+            document.content_hash = content_hash
+            document.save(update_fields=['file', 'file_type', 'content_hash', 'updated_at'])
+
+            job = jobs.enqueue(document)
+            return Response(
+                {'document_id': document.id, 'status': job.status},
+                status=status.HTTP_202_ACCEPTED,
+            )
+
+        except ValidationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except APIKeyError as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        except Exception as e:
+            logger.error(f"Unexpected error revising document {document.id}: {str(e)}")
+            return Response(
+                {'error': 'An unexpected error occurred'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
     @action(detail=True, methods=['get'])
     def status(self, request, pk=None):
         """Get the processing status of a document."""
         document = self.get_object()
-        status_key = f"document_processing_{document.id}"
-        processing_status = cache.get(status_key, "pending")
+        job = jobs.latest_job(document)
+        if job is not None:
+            processing_status = job.status
+        else:
+            status_key = f"document_processing_{document.id}"
+            processing_status = cache.get(status_key, "pending")
         
-        return Response({
+        data = {
             'document_id': document.id,
             'status': processing_status,
             'has_chunks': document.chunks.exists()
-        })
+        }
+        if job is not None:
+            data['attempts'] = job.attempts
+            if job.last_error:
+                data['error'] = job.last_error
+        return Response(data)
     
     @action(detail=True, methods=['post'])
     def query(self, request, pk=None):
+        from . import qa
+
         try:
             # No API key validation needed for local models
             
-            document = self.get_object()
-            query = request.data.get('query')
-            chat_history = request.data.get('chat_history', [])
-            
-            if not query:
-                return Response(
-                    {'error': 'No query provided'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            with metrics.QUERY_STAGE_SECONDS.time(stage='fetch'):
+                document = self.get_object()
+            params = query_api.parse_query(request.data)
+            if params is None:
+                return Response(*query_api.NO_QUERY)
             
-            if not document.chunks.exists():
-                return Response(
-                    {'error': 'Document is still being processed'}, 
-                    status=status.HTTP_400_BAD_REQUEST
+            try:
+                prepared = qa.prepare_query(
+                    document,
+                    params.question,
+                    params.chat_history,
+                    user=query_api.query_user(request.user),
+                    use_semantic_cache=params.use_semantic_cache,
                 )
+            except qa.DocumentNotReady:
+                return Response(*query_api.NOT_READY)
+            if prepared.cached_result:
+                return Response(prepared.cached_result)
             
-            # Check cache for this query
-            cache_key = f"query_{document.id}_{hash(query)}"
-            cached_result = cache.get(cache_key)
-            if cached_result:
-                return Response(cached_result)
-            
-            # Choose LLM: prefer Gemini if GOOGLE_API_KEY is configured, otherwise fallback to local Flan-T5
-            google_api_key = os.environ.get("GOOGLE_API_KEY")
-
-            if google_api_key:
-                if "GEMINI_LLM" not in globals():
-                    gemini_model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
-                    GEMINI_LLM = ChatGoogleGenerativeAI(
-                        model=gemini_model_name,
-                        temperature=0.2,
-                        max_output_tokens=512,
-                        n=1,
-                        verbose=False,
-                    )
-                llm = GEMINI_LLM
-            else:
-                if "HF_LLM" not in globals():
-                    model_name = "google/flan-t5-base"
-                    tokenizer = AutoTokenizer.from_pretrained(model_name)
-                    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-                    hf_pipeline = pipeline(
-                        "text2text-generation",
-                        model=model,
-                        tokenizer=tokenizer,
-                        max_length=512,
-                    )
-                    HF_LLM = HuggingFacePipeline(pipeline=hf_pipeline)
-                llm = HF_LLM
-            
-            # Create a memory object for conversation history
-            memory = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True
-            )
-            
-            # Convert chat history to the format expected by LangChain
-            for message in chat_history:
-                if message.get("role") == "user":
-                    memory.chat_memory.add_user_message(message.get("content", ""))
-                elif message.get("role") == "assistant":
-                    memory.chat_memory.add_ai_message(message.get("content", ""))
-            
-            # Create a list of document chunks with their embeddings
-            chunks = document.chunks.all().order_by('chunk_index')
-            texts = [chunk.content for chunk in chunks]
-            embeddings_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-            embeddings = [chunk.embedding if chunk.embedding else embeddings_model.embed_query(chunk.content) for chunk in chunks]
-            
-            # Define a custom retriever compatible with LangChain
+            # Try the preferred LLM first; gracefully fall back on failure
+            answer, answered_by = qa.generate_answer(prepared)
+            result = qa.finalize(prepared, answer, answered_by)
             
-            class DocumentRetriever(BaseRetriever):
-                """Pydantic-compatible retriever that performs naive cosine-similarity search in memory."""
-
-                texts: List[str]
-                embeddings: List[List[float]]
-                embedding_fn: Any = Field(repr=False)  # Callable; excluded from repr for brevity
-                k: int = 5
-
-                # Allow arbitrary (non-pydantic) types like callables, numpy arrays, etc.
-                class Config:
-                    arbitrary_types_allowed = True
-                    extra = "allow"
-
-                def _similarities(self, query_embedding):
-                    sims: List[float] = []
-                    for emb in self.embeddings:
-                        sim = float(np.dot(query_embedding, emb) / (np.linalg.norm(query_embedding) * np.linalg.norm(emb)))
-                        sims.append(sim)
-                    return sims
-
-                def get_relevant_documents(self, query: str):  # type: ignore[override]
-                    query_embedding = self.embedding_fn(query)
-                    sims = self._similarities(query_embedding)
-                    top_idx = np.argsort(sims)[-self.k:][::-1]
-                    return [LCDocument(page_content=self.texts[i], metadata={}) for i in top_idx]
-
-                async def aget_relevant_documents(self, query: str):  # type: ignore[override]
-                    return self.get_relevant_documents(query)
+            return Response(result, headers={'Server-Timing': prepared.server_timing()})
             
-            # Custom prompt to ground the LLM in the retrieved context only
-            QA_PROMPT = PromptTemplate(
-                template="""You are an AI assistant that answers questions strictly based on the provided context. Do not invent information. If the answer is not contained in the context, say you do not know.\n\nContext:\n{context}\n\nQuestion: {question}\nHelpful answer (use complete sentences):""",
-                input_variables=["context", "question"],
-            )
+        except APIKeyError as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        except Exception as e:
+            logger.error(f"Error processing query for document {pk}: {str(e)}")
+            return Response(*query_api.QUERY_FAILED)
 
-            # Build a retriever instance
-            retriever_instance = DocumentRetriever(
-                texts=texts,
-                embeddings=embeddings,
-                embedding_fn=embeddings_model.embed_query,
-            )
+    @action(
+        detail=True,
+        methods=['post'],
+        url_path='query/stream',
+        renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES + [query_api.EventStreamRenderer],
+    )
+    def query_stream(self, request, pk=None):
+        """Answer a question as a Server-Sent Events stream.
 
-            def answer_with_llm(current_llm):
-                """Retrieve relevant context and query the LLM directly (no chain)."""
-                relevant_docs = retriever_instance.get_relevant_documents(query)
-                context = "\n\n".join(doc.page_content for doc in relevant_docs)
+        Events are ``sources`` (the retrieved chunks, sent before generation
+        starts), one ``token`` per piece of generated text, and finally
+        ``done`` with the full answer, chat history and timings, or ``error``.
+        Cached answers are sent as a single ``token`` event.
+        """
+        from . import qa
 
-                prompt_text = QA_PROMPT.format(context=context, question=query)
+        with metrics.QUERY_STAGE_SECONDS.time(stage='fetch'):
+            document = self.get_object()
+        params = query_api.parse_query(request.data)
+        if params is None:
+            return Response(*query_api.NO_QUERY)
 
-                if hasattr(current_llm, "invoke"):
-                    response = current_llm.invoke(prompt_text)
-                    answer_text = (
-                        response.content if hasattr(response, "content") else str(response)
-                    )
-                else:
-                    # HuggingFacePipeline is callable and returns str
-                    answer_text = current_llm(prompt_text)
+        started = time.perf_counter()
+        try:
+            prepared = qa.prepare_query(
+                document,
+                params.question,
+                params.chat_history,
+                user=query_api.query_user(request.user),
+                use_semantic_cache=params.use_semantic_cache,
+            )
+        except qa.DocumentNotReady:
+            return Response(*query_api.NOT_READY)
+        except Exception as e:
+            logger.error(f"Error processing query for document {pk}: {str(e)}")
+            return Response(*query_api.QUERY_FAILED)
 
-                # Store assistant answer in memory so it gets returned to the client
-                memory.chat_memory.add_ai_message(answer_text)
+        return query_api.event_stream_response(self._stream_events(prepared, started))
 
-                return {"answer": answer_text}
+    def _stream_events(self, prepared, started):
+        from . import qa
 
-            # Try the preferred LLM first; gracefully fall back on failure
-            try:
-                result_raw = answer_with_llm(llm)
-            except Exception as primary_err:
-                logger.warning(
-                    f"Primary LLM ({llm.__class__.__name__}) failed: {primary_err}. Falling back to local HuggingFace model."
-                )
+        events = query_api.AnswerEvents(prepared, started)
+        yield from events.opening()
+        if prepared.cached_result:
+            return
 
-                # Ensure HF_LLM is initialised
-                if "HF_LLM" not in globals():
-                    model_name = "google/flan-t5-base"
-                    tokenizer = AutoTokenizer.from_pretrained(model_name)
-                    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-                    hf_pipeline = pipeline(
-                        "text2text-generation",
-                        model=model,
-                        tokenizer=tokenizer,
-                        max_length=512,
-                    )
-                    HF_LLM = HuggingFacePipeline(pipeline=hf_pipeline)
-
-                result_raw = answer_with_llm(HF_LLM)
-
-            # Normalise result variable name
-            result = result_raw
-            
-            # Cache the result
-            formatted_history = [
-                {
-                    "role": "user" if msg.type == "human" else "assistant",
-                    "content": msg.content,
-                }
-                for msg in memory.chat_memory.messages
-            ]
-
-            result = {
-                "answer": result["answer"],
-                "chat_history": formatted_history,
-            }
-            cache.set(cache_key, result, timeout=3600)  # Cache for 1 hour
-            
-            # Persist query history
-            try:
-                Query.objects.create(
-                    document=document,
-                    user=self.request.user if self.request.user.is_authenticated else None,
-                    question=query,
-                    answer=result["answer"],
-                )
-            except Exception as e:
-                logger.warning(f"Failed to save query history: {e}")
-            
-            return Response(result)
-            
-        except APIKeyError as e:
-            return Response({'error': str(e)}, status=e.status_code)
+        answered_by = []
+        try:
+            for text in qa.stream_answer(prepared, answered_by):
+                yield events.token(text)
+            result = qa.finalize(prepared, events.answer, answered_by[-1])
         except Exception as e:
-            logger.error(f"Error processing query for document {pk}: {str(e)}")
-            return Response(
-                {'error': 'An error occurred while processing your query'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            yield events.error(e)
+            return
+        yield events.done(result, answered_by[-1])
 
     @action(detail=True, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def chats(self, request, pk=None):
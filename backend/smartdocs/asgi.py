@@ -12,5 +12,15 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartdocs.settings')
+# Routes document queries to the async views (see documents/urls.py).
+os.environ.setdefault('SMARTDOCS_ASGI', 'True')
 
 application = get_asgi_application()
+
+# Load the configured models once per worker instead of on the first request.
+from django.conf import settings  # noqa: E402
+
+if settings.WARM_MODELS:
+    from documents.model_registry import warm_models
+
+    warm_models()
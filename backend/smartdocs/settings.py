@@ -74,6 +74,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'documents.profiling.ProfilingMiddleware',  # no-op unless PROFILING_ENABLED
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -116,6 +117,28 @@ else:
     }
 
 
+# Cache
+# CACHE_URL selects a backend shared by all workers:
+#   redis://host:6379/1          -> Redis
+#   file:///var/tmp/smartdocs    -> file-based cache
+#   db://smartdocs_cache         -> database table (run `manage.py createcachetable`)
+# Without it each process gets its own local-memory cache.
+CACHE_URL = os.getenv('CACHE_URL', '')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+elif CACHE_URL.startswith('file://'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                          'LOCATION': CACHE_URL[len('file://'):]}}
+elif CACHE_URL.startswith('db://'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                          'LOCATION': CACHE_URL[len('db://'):]}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Seconds a generated answer stays in the answer cache
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', '3600'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -248,3 +271,119 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': False,
     'BLACKLIST_AFTER_ROTATION': True,
 }
+
+# AI models (see documents/model_registry.py)
+EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2')
+HF_LLM_MODEL_NAME = os.getenv('HF_LLM_MODEL_NAME', 'google/flan-t5-base')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
+
+# Comma-separated registry names to load at worker boot, e.g. "embeddings,hf_llm"
+WARM_MODELS = [name.strip() for name in os.getenv('WARM_MODELS', '').split(',') if name.strip()]
+
+# Number of chunks per sentence-transformers forward pass during ingestion
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+# Embed one batch on a helper thread while the next one is being split
+EMBEDDING_STREAMING = os.getenv('EMBEDDING_STREAMING', 'True').lower() == 'true'
+
+# Rows per INSERT statement when persisting document chunks
+CHUNK_BULK_BATCH_SIZE = int(os.getenv('CHUNK_BULK_BATCH_SIZE', '500'))
+
+# Memory budget for the per-worker cache of searchable document indexes
+INDEX_CACHE_MAX_BYTES = int(os.getenv('INDEX_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Cross-document ANN vector index (see documents/vector_store.py)
+VECTOR_INDEX_ENABLED = os.getenv('VECTOR_INDEX_ENABLED', 'True').lower() == 'true'
+VECTOR_INDEX_DIR = os.getenv('VECTOR_INDEX_DIR', os.path.join(BASE_DIR, 'vector_index'))
+VECTOR_INDEX_TRAIN_THRESHOLD = int(os.getenv('VECTOR_INDEX_TRAIN_THRESHOLD', '20000'))
+VECTOR_INDEX_NPROBE = int(os.getenv('VECTOR_INDEX_NPROBE', '8'))
+
+# Background ingestion queue (see documents/jobs.py, manage.py ingest_worker)
+INGESTION_WORKER_PROCESSES = int(os.getenv('INGESTION_WORKER_PROCESSES', '2'))
+INGESTION_POLL_INTERVAL = float(os.getenv('INGESTION_POLL_INTERVAL', '2'))
+INGESTION_MAX_ATTEMPTS = int(os.getenv('INGESTION_MAX_ATTEMPTS', '3'))
+INGESTION_RETRY_BACKOFF = float(os.getenv('INGESTION_RETRY_BACKOFF', '30'))  # seconds, doubled per attempt
+INGESTION_RETRY_BACKOFF_MAX = float(os.getenv('INGESTION_RETRY_BACKOFF_MAX', '900'))
+INGESTION_JOB_TIMEOUT = int(os.getenv('INGESTION_JOB_TIMEOUT', '300'))  # stale-lock timeout in seconds
+
+# Semantic answer cache (see documents/semantic_cache.py)
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'True').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92'))  # cosine similarity
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '200'))  # per document and model
+
+# Async query view for ASGI deployments (see documents/async_views.py)
+ASYNC_QUERY_VIEW = os.getenv('ASYNC_QUERY_VIEW', 'True').lower() == 'true'
+SERVING_ASGI = os.getenv('SMARTDOCS_ASGI', 'False').lower() == 'true'  # set by smartdocs/asgi.py
+ASYNC_QUERY_CONCURRENCY = int(os.getenv('ASYNC_QUERY_CONCURRENCY', '32'))  # in-flight queries per process
+ASYNC_QUERY_QUEUE_TIMEOUT = float(os.getenv('ASYNC_QUERY_QUEUE_TIMEOUT', '30'))  # seconds before a 503
+QA_EXECUTOR_WORKERS = int(os.getenv('QA_EXECUTOR_WORKERS', '4'))  # threads for embedding/retrieval/local LLM
+
+# PDF text extraction (see documents/extraction.py)
+PDF_EXTRACT_PROCESSES = int(os.getenv('PDF_EXTRACT_PROCESSES', '0'))  # 0 = min(4, CPU count)
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '64'))  # smaller PDFs are read serially
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '32'))
+
+# Upload and embedding deduplication (see documents/dedup.py)
+FILE_UPLOAD_HANDLERS = [
+    'documents.uploadhandlers.HashingUploadHandler',  # must stay first
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'True').lower() == 'true'
+EMBEDDING_CACHE_TTL_DAYS = float(os.getenv('EMBEDDING_CACHE_TTL_DAYS', '30'))  # pruned by ingest_worker; 0 = keep
+
+# Incremental re-indexing: on average one page in this many closes a chunking
+# segment, which bounds how far an edit shifts chunk boundaries (0 = never)
+CHUNK_ANCHOR_PAGES = int(os.getenv('CHUNK_ANCHOR_PAGES', '4'))
+
+# Hybrid retrieval: vector matches fused with keyword (BM25) matches
+HYBRID_RETRIEVAL_ENABLED = os.getenv('HYBRID_RETRIEVAL_ENABLED', 'True').lower() == 'true'
+LEXICAL_BACKEND = os.getenv('LEXICAL_BACKEND', 'auto')  # auto, bm25 or postgres (full-text search)
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '20'))  # per ranking, before fusion
+
+# Prompt token budgets (template + history + retrieved chunks)
+HF_PROMPT_MAX_TOKENS = int(os.getenv('HF_PROMPT_MAX_TOKENS', '512'))  # Flan-T5 input window
+PROMPT_MAX_TOKENS = int(os.getenv('PROMPT_MAX_TOKENS', '2048'))  # other LLMs (Gemini)
+PROMPT_HISTORY_TOKENS = int(os.getenv('PROMPT_HISTORY_TOKENS', '512'))  # capped at a quarter of the room left
+
+# Local Flan-T5 request batching: off, inprocess or server (manage.py generation_server)
+HF_BATCHING = os.getenv('HF_BATCHING', 'inprocess')
+HF_BATCH_MAX_SIZE = int(os.getenv('HF_BATCH_MAX_SIZE', '8'))
+HF_BATCH_MAX_WAIT_MS = float(os.getenv('HF_BATCH_MAX_WAIT_MS', '10'))
+HF_GENERATION_SERVER_ADDRESS = os.getenv('HF_GENERATION_SERVER_ADDRESS', '127.0.0.1:8765')  # host:port or socket path
+HF_GENERATION_SERVER_AUTHKEY = os.getenv('HF_GENERATION_SERVER_AUTHKEY', '')  # defaults to SECRET_KEY
+
+# CPU inference backend for embeddings and local Flan-T5 (see documents/inference.py):
+# torch, torch_int8, onnx or onnx_int8 (onnx* need manage.py export_onnx_models)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch')
+INFERENCE_INTRA_OP_THREADS = int(os.getenv('INFERENCE_INTRA_OP_THREADS', '0'))  # per process; 0 = library default
+INFERENCE_INTER_OP_THREADS = int(os.getenv('INFERENCE_INTER_OP_THREADS', '0'))
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', os.path.join(BASE_DIR, 'onnx_models'))
+INFERENCE_MIN_COSINE = float(os.getenv('INFERENCE_MIN_COSINE', '0.99'))  # drift check vs full precision
+
+# Cross-encoder reranking between retrieval and the LLM (see documents/rerank.py)
+RERANK_ENABLED = os.getenv('RERANK_ENABLED', 'False').lower() == 'true'
+RERANK_MODEL_NAME = os.getenv('RERANK_MODEL_NAME', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', '20'))  # retrieved before reranking
+RERANK_TOP_K = int(os.getenv('RERANK_TOP_K', '3'))  # kept for the prompt
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', '150'))  # for uncached pairs
+RERANK_MAX_CONCURRENT = int(os.getenv('RERANK_MAX_CONCURRENT', '2'))  # per process; more are skipped
+RERANK_CACHE_TTL = int(os.getenv('RERANK_CACHE_TTL', '86400'))
+
+# Prometheus metrics at /metrics (see documents/metrics.py)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # if set, scrapes need "Authorization: Bearer <token>"
+# Without a token, addresses or networks allowed to scrape (comma-separated)
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()]
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '15'))  # seconds between shared-cache updates
+
+# Request profiling of /api/documents/ (see documents/profiling.py)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False').lower() == 'true'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))  # fraction of requests; staff can also send X-SmartDocs-Profile: 1
+PROFILING_PATH_PREFIX = os.getenv('PROFILING_PATH_PREFIX', '/api/documents/')
+PROFILING_MODE = os.getenv('PROFILING_MODE', 'sampling')  # sampling (.folded stacks) or cprofile (.prof)
+PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', '5'))  # sampling mode
+PROFILING_MAX_PER_MINUTE = int(os.getenv('PROFILING_MAX_PER_MINUTE', '6'))  # per process, one at a time
+PROFILING_TRACEMALLOC = os.getenv('PROFILING_TRACEMALLOC', 'False').lower() == 'true'  # slows profiled requests a lot
+PROFILING_TRACEMALLOC_FRAMES = int(os.getenv('PROFILING_TRACEMALLOC_FRAMES', '1'))
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '200'))  # oldest are deleted
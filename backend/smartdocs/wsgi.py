@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartdocs.settings')
 
 application = get_wsgi_application()
+
+# Load the configured models once per worker instead of on the first request.
+from django.conf import settings  # noqa: E402
+
+if settings.WARM_MODELS:
+    from documents.model_registry import warm_models
+
+    warm_models()
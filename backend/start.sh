@@ -0,0 +1,18 @@
+#!/bin/sh
+# Start the web server given as arguments. Unless RUN_INGEST_WORKER=false, an
+# ingestion worker (restarted if it exits) runs next to it, because uploads are
+# only processed by manage.py ingest_worker. Set RUN_INGEST_WORKER=false when
+# the worker runs as a service of its own.
+set -e
+
+if [ "${RUN_INGEST_WORKER:-true}" != "false" ]; then
+    (
+        while true; do
+            python manage.py ingest_worker || true
+            echo "ingest_worker exited; restarting in 5s" >&2
+            sleep 5
+        done
+    ) &
+fi
+
+exec "$@"